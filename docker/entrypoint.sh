@@ -110,8 +110,9 @@ case $1 in
     consume_messages)
         exec flask swpt_creditors "$@"
         ;;
-    process_ledger_updates | process_log_additions | scan_creditors | scan_accounts \
-        | scan_committed_transfers | scan_ledger_entries | scan_log_entries)
+    process_ledger_updates | process_log_additions | process_creditor_purges \
+        | scan_creditors | scan_accounts | scan_committed_transfers \
+        | scan_ledger_entries | scan_log_entries)
         exec flask swpt_creditors "$@"
         ;;
     flush_configure_accounts | flush_prepare_transfers | flush_finalize_transfers \
@@ -207,6 +207,7 @@ class Configuration(metaclass=MetaEnvReader):
 
     PROCESS_LOG_ADDITIONS_THREADS = 1
     PROCESS_LEDGER_UPDATES_THREADS = 1
+    PROCESS_CREDITOR_PURGES_THREADS = 1
 
     FLUSH_PROCESSES = 1
     FLUSH_PERIOD = 2.0
@@ -242,9 +243,13 @@ class Configuration(metaclass=MetaEnvReader):
     APP_ENABLE_CORS = False
     APP_PROCESS_LOG_ADDITIONS_WAIT = 5.0
     APP_PROCESS_LOG_ADDITIONS_MAX_COUNT = 100000
+    APP_PROCESS_LOG_ADDITIONS_BATCH_SIZE = 1
     APP_PROCESS_LEDGER_UPDATES_BURST = 1000
     APP_PROCESS_LEDGER_UPDATES_MAX_COUNT = 100000
     APP_PROCESS_LEDGER_UPDATES_WAIT = 5.0
+    APP_PROCESS_CREDITOR_PURGES_BURST = 1000
+    APP_PROCESS_CREDITOR_PURGES_MAX_COUNT = 100000
+    APP_PROCESS_CREDITOR_PURGES_WAIT = 5.0
     APP_FLUSH_CONFIGURE_ACCOUNTS_BURST_COUNT = 10000
     APP_FLUSH_PREPARE_TRANSFERS_BURST_COUNT = 10000
     APP_FLUSH_FINALIZE_TRANSFERS_BURST_COUNT = 10000
@@ -252,6 +257,30 @@ class Configuration(metaclass=MetaEnvReader):
     APP_FLUSH_UPDATED_POLICY_BURST_COUNT = 10000
     APP_FLUSH_UPDATED_FLAGS_BURST_COUNT = 10000
     APP_FLUSH_REJECTED_CONFIGS_BURST_COUNT = 10000
+    APP_FLUSH_CONFIGURE_ACCOUNTS_PERIOD = 0.0
+    APP_FLUSH_PREPARE_TRANSFERS_PERIOD = 0.0
+    APP_FLUSH_FINALIZE_TRANSFERS_PERIOD = 0.0
+    APP_FLUSH_UPDATED_LEDGER_PERIOD = 0.0
+    APP_FLUSH_UPDATED_POLICY_PERIOD = 0.0
+    APP_FLUSH_UPDATED_FLAGS_PERIOD = 0.0
+    APP_FLUSH_REJECTED_CONFIGS_PERIOD = 0.0
+    APP_FLUSH_CONFIGURE_ACCOUNTS_PRIORITY = 1
+    APP_FLUSH_PREPARE_TRANSFERS_PRIORITY = 0
+    APP_FLUSH_FINALIZE_TRANSFERS_PRIORITY = 0
+    APP_FLUSH_UPDATED_LEDGER_PRIORITY = 2
+    APP_FLUSH_UPDATED_POLICY_PRIORITY = 2
+    APP_FLUSH_UPDATED_FLAGS_PRIORITY = 2
+    APP_FLUSH_REJECTED_CONFIGS_PRIORITY = 1
+    APP_FLUSH_BULK = False
+    APP_FLUSH_PIPELINED = False
+    APP_FLUSH_MAX_PENDING_BURSTS = 2
+    APP_FLUSH_COALESCE = False
+    APP_CONSUMER_ORDERED_DISPATCH = False
+    APP_CONSUMER_ADAPTIVE_PREFETCH = False
+    APP_CONSUMER_MAX_PREFETCH_COUNT = 1000
+    APP_CONSUMER_MAX_QUEUE_SECONDS = 1.0
+    APP_CAPTURE_TRAFFIC_PATH = ""
+    APP_TRANSFERS_DUPLICATES_CACHE_SIZE = 100000
     APP_CREDITORS_SCAN_DAYS = 7.0
     APP_CREDITORS_SCAN_BLOCKS_PER_QUERY = 40
     APP_CREDITORS_SCAN_BEAT_MILLISECS = 100
@@ -281,11 +310,15 @@ class Configuration(metaclass=MetaEnvReader):
     APP_MAX_TRANSFER_DELAY_DAYS = 14.0
     APP_MAX_CONFIG_DELAY_HOURS = 24.0
     APP_PIN_FAILURES_RESET_DAYS = 7.0
+    APP_PIN_SESSION_SECONDS = 600.0
     APP_MAX_CREDITOR_ACCOUNTS = 1000  # should fit int16
     APP_MAX_CREDITOR_TRANSFERS = 20000  # should fit int16
     APP_MAX_CREDITOR_RECONFIGS = 5000  # should fit int16
     APP_MAX_CREDITOR_INITIATIONS = 20000  # should fit int16
     APP_CREDITOR_DOS_STATS_CLEAR_HOURS = 168.0
+    APP_CREDITOR_DOS_BUCKETS = False
+    APP_CREDITOR_DOS_BUCKETS_FLUSH_SECONDS = 10.0
+    APP_CREDITOR_DOS_BUCKETS_MAX_CREDITORS = 100000
     APP_SUPERUSER_SUBJECT_REGEX = ""
     APP_SUPERVISOR_SUBJECT_REGEX = ""
     APP_CREDITOR_SUBJECT_REGEX = "^creditors:([0-9]+)$"
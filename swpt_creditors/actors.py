@@ -1,5 +1,13 @@
+import asyncio
+import functools
 import logging
 import json
+import threading
+import time
+import pika
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Optional
 from datetime import datetime, date, timedelta
 from base64 import b16decode
 from marshmallow import ValidationError
@@ -7,8 +15,88 @@ from flask import current_app
 import swpt_pythonlib.protocol_schemas as ps
 from swpt_pythonlib import rabbitmq
 from swpt_creditors import procedures
+from swpt_creditors.extensions import db, call_after_commit
 from swpt_creditors.models import CT_DIRECT, is_valid_creditor_id
 from swpt_creditors.schemas import ActivateCreditorMessageSchema
+from swpt_creditors.fast_schemas import CompiledSchema
+from swpt_creditors.capture import TrafficRecorder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class RecentKeysCache:
+    """A thread-safe LRU set of recently seen keys.
+
+    The cache is used to short-circuit obvious duplicates before
+    making any database queries. The database remains the source of
+    truth: A key that has been evicted from the cache only costs a
+    database query. The hit ratio is logged periodically.
+    """
+
+    def __init__(self, max_size: int, name: str, log_interval=60.0):
+        self.max_size = max_size
+        self.name = name
+        self.log_interval = log_interval
+        self.keys: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.lookups = 0
+        self.last_logged_at = time.monotonic()
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def contains(self, key) -> bool:
+        with self.lock:
+            self.lookups += 1
+            is_hit = key in self.keys
+            if is_hit:
+                self.hits += 1
+                self.keys.move_to_end(key)
+
+            now = time.monotonic()
+            if now - self.last_logged_at >= self.log_interval:
+                _LOGGER.info(
+                    "%s: size=%i lookups=%i hits=%i hit_ratio=%.3f",
+                    self.name,
+                    len(self.keys),
+                    self.lookups,
+                    self.hits,
+                    self.hit_ratio,
+                )
+                self.last_logged_at = now
+
+            return is_hit
+
+    def clear(self) -> None:
+        with self.lock:
+            self.keys.clear()
+
+    def add(self, key) -> None:
+        with self.lock:
+            keys = self.keys
+            keys[key] = None
+            keys.move_to_end(key)
+            while len(keys) > self.max_size:
+                keys.popitem(last=False)
+
+
+def _get_transfers_duplicates_filter() -> RecentKeysCache:
+    extensions = current_app.extensions
+    duplicates_filter = extensions.get("transfers_duplicates_filter")
+    if duplicates_filter is None:
+        duplicates_filter = extensions.setdefault(
+            "transfers_duplicates_filter",
+            RecentKeysCache(
+                current_app.config["APP_TRANSFERS_DUPLICATES_CACHE_SIZE"],
+                name="Committed transfers duplicates filter",
+            ),
+        )
+    return duplicates_filter
 
 
 def _on_rejected_config_signal(
@@ -126,7 +214,12 @@ def _on_account_transfer_signal(
     *args,
     **kwargs
 ) -> None:
-    procedures.process_account_transfer_signal(
+    duplicates_filter = _get_transfers_duplicates_filter()
+    key = (creditor_id, debtor_id, creation_date, transfer_number)
+    if duplicates_filter.contains(key):
+        return
+
+    is_recorded = procedures.process_account_transfer_signal(
         debtor_id=debtor_id,
         creditor_id=creditor_id,
         creation_date=creation_date,
@@ -145,6 +238,13 @@ def _on_account_transfer_signal(
             days=current_app.config["APP_LOG_RETENTION_DAYS"]
         ),
     )
+    if is_recorded:
+        # NOTE: The key must be added only after the transaction has
+        # been committed. Otherwise, a transaction that has been
+        # rolled back (or retried) could cause the transfer to be
+        # lost. This matters when the actor is called inside an outer
+        # transaction (see the `replay` module).
+        call_after_commit(functools.partial(duplicates_filter.add, key))
 
 
 def _on_rejected_direct_transfer_signal(
@@ -321,49 +421,624 @@ _MESSAGE_TYPES = {
     ),
 }
 
+_COMPILED_SCHEMAS = {
+    message_type: CompiledSchema(schema)
+    for message_type, (schema, _) in _MESSAGE_TYPES.items()
+}
+
 _LOGGER = logging.getLogger(__name__)
 
 
+def _loads_json(body: bytes):
+    # NOTE: `orjson` is stricter than the standard `json` module (it
+    # does not accept "NaN", big integers, or lone surrogates, for
+    # example). Therefore, we fall back to the `json` module when
+    # `orjson` fails to parse the document.
+    if orjson is not None:
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            pass
+
+    return json.loads(body.decode("utf8"))
+
+
+def parse_message(body: bytes, properties) -> Optional[tuple]:
+    """Validate and load an incoming message.
+
+    Returns a (message_type, actor, message_content) tuple, or `None`
+    if the message is invalid.
+    """
+    content_type = getattr(properties, "content_type", None)
+    if content_type != "application/json":
+        _LOGGER.error('Unknown message content type: "%s"', content_type)
+        return None
+
+    massage_type = getattr(properties, "type", None)
+    try:
+        schema, actor = _MESSAGE_TYPES[massage_type]
+    except KeyError:
+        _LOGGER.error('Unknown message type: "%s"', massage_type)
+        return None
+
+    try:
+        obj = _loads_json(body)
+    except (UnicodeError, json.JSONDecodeError):
+        _LOGGER.error("The message does not contain a valid JSON document.")
+        return None
+
+    try:
+        message_content = _COMPILED_SCHEMAS[massage_type].load(obj)
+    except ValidationError as e:
+        _LOGGER.error("Message validation error: %s", str(e))
+        return None
+
+    return massage_type, actor, message_content
+
+
+def is_responsible_for(message_type: str, message_content: dict) -> bool:
+    return message_type == "ConfigureAccount" or is_valid_creditor_id(
+        message_content["creditor_id"]
+    )
+
+
 TerminatedConsumtion = rabbitmq.TerminatedConsumtion
 
 
+class ProcessingStats:
+    """Collects message processing times, and logs them periodically.
+
+    The processing time of a message includes the time spent waiting
+    for database row locks. When messages are dispatched to ordered
+    lanes (see `OrderedDispatcher`), the time spent waiting for the
+    lane to become free is measured separately.
+    """
+
+    def __init__(self, log_interval: float = 60.0):
+        self.log_interval = log_interval
+        self.lock = threading.Lock()
+        self._reset(time.monotonic())
+
+    def _reset(self, now: float) -> None:
+        self.started_at = now
+        self.count = 0
+        self.processing_seconds = 0.0
+        self.max_processing_seconds = 0.0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+
+    def record(self, processing_seconds: float, queue_seconds=0.0) -> None:
+        with self.lock:
+            self.count += 1
+            self.processing_seconds += processing_seconds
+            self.max_processing_seconds = max(
+                self.max_processing_seconds, processing_seconds
+            )
+            self.queue_seconds += queue_seconds
+            self.max_queue_seconds = max(self.max_queue_seconds, queue_seconds)
+
+            now = time.monotonic()
+            if now - self.started_at >= self.log_interval:
+                _LOGGER.info(
+                    "Processed %i messages in %.1f seconds (processing:"
+                    " avg=%.2fms max=%.2fms; lane waiting: avg=%.2fms"
+                    " max=%.2fms).",
+                    self.count,
+                    now - self.started_at,
+                    1000 * self.processing_seconds / self.count,
+                    1000 * self.max_processing_seconds,
+                    1000 * self.queue_seconds / self.count,
+                    1000 * self.max_queue_seconds,
+                )
+                self._reset(now)
+
+
+class OrderedDispatcher:
+    """Executes actors in per-account lanes, on a pool of `workers`
+    threads.
+
+    Every account (creditor_id, debtor_id) has its own lane. Messages
+    for the same account are processed sequentially, in the order in
+    which they have been dispatched, without competing for the
+    account's database row locks. Messages for different accounts
+    never wait for each other, unless all worker threads are busy. A
+    lane occupies a worker thread only while it has messages to
+    process.
+    """
+
+    def __init__(self, workers: int, stats: ProcessingStats):
+        assert workers > 0
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.lanes: Dict[tuple, deque] = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="worker"
+        )
+
+    def dispatch(self, key: tuple, actor, message_content: dict) -> Future:
+        """Schedule the execution of an actor, and return a future.
+
+        The caller may wait for the result of the future, so that the
+        message will be acknowledged only after it has been
+        successfully processed.
+        """
+        app = current_app._get_current_object()
+        future: Future = Future()
+        task = (app, actor, message_content, future, time.monotonic())
+
+        with self.lock:
+            lane = self.lanes.get(key)
+            if lane is not None:
+                lane.append(task)
+                return future
+            self.lanes[key] = deque([task])
+
+        self.executor.submit(self._run_lane, key)
+        return future
+
+    def _run_lane(self, key: tuple) -> None:
+        with self.lock:
+            lane = self.lanes[key]
+
+        while True:
+            with self.lock:
+                if not lane:
+                    del self.lanes[key]
+                    return
+                app, actor, message_content, future, submitted_at = lane[0]
+
+            if future.set_running_or_notify_cancel():
+                started_at = time.monotonic()
+                try:
+                    with app.app_context():
+                        actor(**message_content)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(None)
+                self.stats.record(
+                    time.monotonic() - started_at, started_at - submitted_at
+                )
+
+            # NOTE: The task is removed only after it has been
+            # executed, so that new tasks for the same key will be
+            # appended to the same lane meanwhile.
+            with self.lock:
+                lane.popleft()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
 class SmpConsumer(rabbitmq.Consumer):
-    """Passes messages to proper handlers (actors)."""
+    """Passes messages to proper handlers (actors).
+
+    When `ordered_dispatch` is true, the actors will be executed by an
+    `OrderedDispatcher` with the given number of `workers`. In this
+    case, the consumer threads only wait for the dispatched actors to
+    finish (this is required to acknowledge the messages after they
+    have been processed), and therefore, there should be more consumer
+    threads than workers (normally, as many as the prefetch count).
+
+    When `capture_path` is not empty, all consumed messages will be
+    recorded to a capture file (see `TrafficRecorder`).
+    """
+
+    def __init__(
+        self,
+        *args,
+        ordered_dispatch: bool = False,
+        workers: int = 1,
+        capture_path: str = "",
+        **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.stats = ProcessingStats()
+        self.dispatcher = (
+            OrderedDispatcher(workers, self.stats)
+            if ordered_dispatch
+            else None
+        )
+        self.recorder = TrafficRecorder(capture_path) if capture_path else None
 
     def process_message(self, body, properties):
-        content_type = getattr(properties, "content_type", None)
-        if content_type != "application/json":
-            _LOGGER.error('Unknown message content type: "%s"', content_type)
-            return False
+        if self.recorder:
+            self.recorder.record(body, properties)
 
-        massage_type = getattr(properties, "type", None)
-        try:
-            schema, actor = _MESSAGE_TYPES[massage_type]
-        except KeyError:
-            _LOGGER.error('Unknown message type: "%s"', massage_type)
+        parsed_message = parse_message(body, properties)
+        if parsed_message is None:
             return False
 
-        try:
-            obj = json.loads(body.decode("utf8"))
-        except (UnicodeError, json.JSONDecodeError):
-            _LOGGER.error(
-                "The message does not contain a valid JSON document."
+        massage_type, actor, message_content = parsed_message
+        if not is_responsible_for(massage_type, message_content):
+            raise RuntimeError(
+                "The agent is not responsible for this creditor."
             )
-            return False
 
+        if self.dispatcher:
+            key = (
+                message_content["creditor_id"],
+                message_content.get("debtor_id"),
+            )
+            self.dispatcher.dispatch(key, actor, message_content).result()
+        else:
+            started_at = time.monotonic()
+            actor(**message_content)
+            self.stats.record(time.monotonic() - started_at)
+
+        return True
+
+
+def _is_db_pool_exhausted(pool) -> bool:
+    # NOTE: Only `QueuePool`s have a limited size. A zero pool size,
+    # or a negative max overflow, means that the pool is unlimited.
+    try:
+        size = pool.size()
+        max_overflow = pool._max_overflow
+        checkedout = pool.checkedout()
+    except AttributeError:
+        return False
+
+    if size <= 0 or max_overflow < 0:
+        return False
+
+    return checkedout >= size + max_overflow
+
+
+class PrefetchController:
+    """Adjusts the prefetch window (the maximum number of unacknowledged
+    messages) according to the observed message processing times.
+
+    Messages which have been prefetched, but are waiting for a free
+    worker thread, form a local backlog which is invisible to the
+    message broker. The controller tries to keep this backlog at
+    about one message per worker thread: enough to hide the broker
+    round trips, but not more. When the average waiting time is more
+    than twice the average processing time, or exceeds
+    `max_queue_seconds`, the window is decreased multiplicatively.
+    When the window has been filled up, but the waiting time is less
+    than half the processing time, the window is increased by the
+    number of worker `threads`.
+
+    When the database connection pool is exhausted, the consumption
+    should be paused (see the `paused` attribute), and the window is
+    halved. The consumption can also be paused between two
+    adjustments (see the `pause` method).
+    """
+
+    def __init__(
+        self,
+        *,
+        threads: int,
+        initial_window: int,
+        max_window: int,
+        max_queue_seconds: float = 1.0,
+    ):
+        assert threads > 0
+        assert max_window > 0
+        self.threads = threads
+        self.max_window = max_window
+        self.max_queue_seconds = max_queue_seconds
+        self.window = min(max(initial_window, 1), max_window)
+        self.paused = False
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.count = 0
+        self.processing_seconds = 0.0
+        self.queue_seconds = 0.0
+        self.is_window_full = False
+
+    def record(self, processing_seconds: float, queue_seconds: float) -> None:
+        """Record the processing of a message. This method is
+        thread-safe.
+        """
+        with self.lock:
+            self.count += 1
+            self.processing_seconds += processing_seconds
+            self.queue_seconds += queue_seconds
+
+    def pause(self) -> None:
+        """Pause the consumption until the next adjustment."""
+        self.paused = True
+
+    def observe_in_flight(self, in_flight: int) -> None:
+        if in_flight >= self.window:
+            self.is_window_full = True
+
+    def adjust(self, is_db_pool_exhausted: bool = False) -> int:
+        """Calculate and return the new prefetch window."""
+
+        with self.lock:
+            count = self.count
+            processing_seconds = self.processing_seconds
+            queue_seconds = self.queue_seconds
+            is_window_full = self.is_window_full
+            self._reset()
+
+        window = self.window
+        self.paused = is_db_pool_exhausted
+        if is_db_pool_exhausted:
+            window = window // 2
+        elif count > 0:
+            avg_processing_seconds = processing_seconds / count
+            avg_queue_seconds = queue_seconds / count
+            if (
+                avg_queue_seconds > self.max_queue_seconds
+                or avg_queue_seconds > 2 * avg_processing_seconds
+            ):
+                window = (window * 3) // 4
+            elif (
+                is_window_full
+                and avg_queue_seconds < avg_processing_seconds / 2
+            ):
+                window += self.threads
+
+        self.window = min(max(window, 1), self.max_window)
+        return self.window
+
+
+class AsyncSmpConsumer:
+    """Consumes messages using pika's asyncio connection adapter.
+
+    All communication with the message broker happens in a single
+    asyncio event loop, so that many messages (up to `prefetch_count`)
+    can be in flight at the same time. The actors, however, are
+    executed synchronously by a pool of worker `threads`. Therefore,
+    this mode does not add any database concurrency: at most `threads`
+    messages are processed at the same time, exactly like with the
+    threaded consumer with the same number of threads. Messages are
+    acknowledged or rejected exactly like with `SmpConsumer`: a
+    message is acknowledged after it has been processed successfully,
+    and invalid messages are rejected. When an actor raises an
+    exception, the consumption is stopped, and the unacknowledged
+    messages will be redelivered later.
+
+    When `adaptive_prefetch` is true, every `adjust_interval` seconds
+    the prefetch window will be adjusted by a `PrefetchController`
+    (between 1 and `max_prefetch_count`), and the consumption will be
+    paused while the database connection pool is exhausted. The
+    consumption is paused as soon as a message arrives while the pool
+    is exhausted, and is resumed at the next adjustment after the
+    pool has become available.
+
+    Changing the prefetch count requires restarting the consumer
+    (quorum queues do not support per-channel prefetch limits), and
+    the messages which are in transit to the cancelled consumer get
+    requeued. Therefore, the prefetch count is changed only after the
+    window has at least doubled or halved, and not more often than
+    once every `min_restart_interval` seconds. The current prefetch
+    count is logged after every change.
+    """
+
+    def __init__(
+        self,
+        app,
+        *,
+        url: str,
+        queue: str,
+        threads: int = 1,
+        prefetch_count: int = 1,
+        adaptive_prefetch: bool = False,
+        max_prefetch_count: int = 1000,
+        max_queue_seconds: float = 1.0,
+        adjust_interval: float = 5.0,
+        min_restart_interval: float = 30.0,
+        capture_path: str = "",
+    ):
+        self.app = app
+        self.url = url
+        self.queue = queue
+        self.prefetch_count = prefetch_count
+        self.adjust_interval = adjust_interval
+        self.min_restart_interval = min_restart_interval
+        self.restarted_at = time.monotonic()
+        self.controller = (
+            PrefetchController(
+                threads=threads,
+                initial_window=prefetch_count,
+                max_window=max_prefetch_count,
+                max_queue_seconds=max_queue_seconds,
+            )
+            if adaptive_prefetch
+            else None
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="actor"
+        )
+        self.processor = SmpConsumer(capture_path=capture_path)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connection = None
+        self.channel = None
+        self.consumer_tag = None
+        self.in_flight = 0
+        self.stopping = False
+        self.error: Optional[BaseException] = None
+
+    def start(self) -> None:
+        """Consume messages until `stop` is called, or an error occurs."""
+
+        from pika.adapters.asyncio_connection import AsyncioConnection
+
+        self.loop = asyncio.new_event_loop()
+        self.connection = AsyncioConnection(
+            pika.URLParameters(self.url),
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self.loop,
+        )
         try:
-            message_content = schema.load(obj)
-        except ValidationError as e:
-            _LOGGER.error("Message validation error: %s", str(e))
-            return False
+            self.loop.run_forever()
+        finally:
+            self.executor.shutdown(wait=True)
+            self.loop.close()
+
+        if self.error is not None:
+            raise self.error
+
+    def stop(self, signum=None, frame=None) -> None:
+        """Stop the consumption. This method is thread-safe."""
 
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stop)
+
+    def _process_message(
+        self, body: bytes, properties, received_at: float
+    ) -> bool:
+        started_at = time.monotonic()
+        with self.app.app_context():
+            result = self.processor.process_message(body, properties)
+
+        if self.controller:
+            self.controller.record(
+                time.monotonic() - started_at, started_at - received_at
+            )
+        return result
+
+    def _is_db_pool_exhausted(self) -> bool:
+        with self.app.app_context():
+            return _is_db_pool_exhausted(db.engine.pool)
+
+    def _adjust_prefetch(self) -> None:
+        if self.stopping or self.channel is None or not self.channel.is_open:
+            return
+
+        controller = self.controller
+        was_paused = controller.paused
+        window = controller.adjust(self._is_db_pool_exhausted())
+
+        if controller.paused:
+            if not was_paused:
+                self._pause()
+        elif was_paused or self._should_restart(window):
+            self._restart(window)
+
+        self.loop.call_later(self.adjust_interval, self._adjust_prefetch)
+
+    def _should_restart(self, window: int) -> bool:
+        prefetch_count = self.prefetch_count
+        return (
+            window >= 2 * prefetch_count or 2 * window <= prefetch_count
+        ) and (
+            time.monotonic() - self.restarted_at >= self.min_restart_interval
+        )
+
+    def _pause(self) -> None:
+        _LOGGER.info(
+            "Prefetch window: prefetch_count=%i paused=True",
+            self.prefetch_count,
+        )
+        self._cancel_consumer()
+
+    def _restart(self, window: int) -> None:
+        _LOGGER.info(
+            "Prefetch window: prefetch_count=%i paused=False", window
+        )
+        self.prefetch_count = window
+        self.restarted_at = time.monotonic()
+
+        # NOTE: RabbitMQ applies the prefetch count to the consumers
+        # that are started after the `basic.qos` method. Therefore,
+        # the consumer must be restarted.
+        self._cancel_consumer()
+        self.channel.basic_qos(prefetch_count=window, callback=self._on_qos_ok)
+
+    def _cancel_consumer(self) -> None:
+        if self.consumer_tag is not None:
+            self.channel.basic_cancel(self.consumer_tag)
+            self.consumer_tag = None
+
+    def _stop(self) -> None:
+        if not self.stopping:
+            self.stopping = True
+            if self.channel is not None and self.channel.is_open:
+                self._cancel_consumer()
+        if self.in_flight == 0 and not (
+            self.connection.is_closing or self.connection.is_closed
+        ):
+            self.connection.close()
+
+    def _on_connection_open(self, connection) -> None:
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error) -> None:
+        self.error = error
+        self.loop.stop()
+
+    def _on_connection_closed(self, connection, reason) -> None:
+        if not self.stopping and self.error is None:
+            self.error = reason
+        self.loop.stop()
+
+    def _on_channel_open(self, channel) -> None:
+        self.channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.basic_qos(
+            prefetch_count=self.prefetch_count, callback=self._on_qos_ok
+        )
+        if self.controller:
+            self.loop.call_later(self.adjust_interval, self._adjust_prefetch)
+
+    def _on_channel_closed(self, channel, reason) -> None:
+        if not self.stopping and self.error is None:
+            self.error = reason
+        self.stopping = True
+        if not (self.connection.is_closing or self.connection.is_closed):
+            self.connection.close()
+
+    def _on_qos_ok(self, frame) -> None:
         if (
-                massage_type != "ConfigureAccount"
-                and not is_valid_creditor_id(message_content["creditor_id"])
+            not self.stopping
+            and self.consumer_tag is None
+            and not (self.controller and self.controller.paused)
         ):
-            raise RuntimeError(
-                "The agent is not responsible for this creditor."
+            self.consumer_tag = self.channel.basic_consume(
+                self.queue, self._on_message
             )
 
-        actor(**message_content)
-        return True
+    def _on_message(self, channel, method, properties, body) -> None:
+        self.in_flight += 1
+        controller = self.controller
+        if controller:
+            controller.observe_in_flight(self.in_flight)
+            if (
+                not (controller.paused or self.stopping)
+                and self._is_db_pool_exhausted()
+            ):
+                controller.pause()
+                self._pause()
+
+        future = self.loop.run_in_executor(
+            self.executor,
+            self._process_message,
+            body,
+            properties,
+            time.monotonic(),
+        )
+        future.add_done_callback(
+            functools.partial(self._on_message_processed, method.delivery_tag)
+        )
+
+    def _on_message_processed(self, delivery_tag, future) -> None:
+        self.in_flight -= 1
+        error = future.exception()
+
+        if error is not None:
+            _LOGGER.error(
+                "Caught error while processing a message.", exc_info=error
+            )
+            if self.error is None:
+                self.error = error
+            self._stop()
+            return
+
+        if self.channel.is_open:
+            if future.result():
+                self.channel.basic_ack(delivery_tag)
+            else:
+                self.channel.basic_reject(delivery_tag, requeue=False)
+
+        if self.stopping:
+            self._stop()
@@ -0,0 +1,266 @@
+"""Capturing of consumed Swaptacular Messaging Protocol traffic.
+
+Captured messages are appended to a binary file. The file starts with
+a short magic string, followed by records of the following form:
+
+    [8 bytes] the time of the capture (a float64 UNIX timestamp)
+    [2 bytes] the length of the message type
+    [2 bytes] the length of the content type
+    [4 bytes] the length of the headers
+    [4 bytes] the length of the body
+    [N bytes] the message type (UTF-8)
+    [N bytes] the content type (UTF-8)
+    [N bytes] the headers (a UTF-8 JSON object)
+    [N bytes] the body
+
+All integers are big-endian. A truncated last record (for example,
+when the process has been killed) is ignored when reading.
+"""
+
+import os
+import json
+import time
+import atexit
+import struct
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable, Iterator, NamedTuple, Optional
+from flask import Flask
+from swpt_pythonlib.rabbitmq import MessageProperties
+
+MAGIC = b"SMPCAP1\n"
+_RECORD_HEADER = struct.Struct("!dHHII")
+_LOGGER = logging.getLogger(__name__)
+
+
+class CapturedMessage(NamedTuple):
+    timestamp: float
+    type: str
+    content_type: str
+    headers: dict
+    body: bytes
+
+
+class TrafficRecorder:
+    """Appends consumed messages to a capture file.
+
+    The records are accumulated in memory, and written to the file
+    when the buffer gets full, or every `flush_interval` seconds (by a
+    background thread). The file is flushed when the process exits.
+
+    Every process must write to its own file. If `path` contains
+    "{pid}", it will be replaced with the ID of the current process.
+    Otherwise, "." followed by the ID of the current process will be
+    appended to the path.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        buffer_size: int = 65536,
+        flush_interval: float = 1.0,
+    ):
+        pid = str(os.getpid())
+        self.path = (
+            path.replace("{pid}", pid) if "{pid}" in path else f"{path}.{pid}"
+        )
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.buffer = bytearray()
+        self.flushed_at = time.monotonic()
+        self.file: Optional[BinaryIO] = open(self.path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+            self.file.flush()
+        self.closed = threading.Event()
+        threading.Thread(
+            target=self._flush_periodically,
+            name="traffic-recorder",
+            daemon=True,
+        ).start()
+        atexit.register(self.close)
+
+    def record(self, body: bytes, properties) -> None:
+        message_type = (getattr(properties, "type", None) or "").encode("utf8")
+        content_type = (
+            getattr(properties, "content_type", None) or ""
+        ).encode("utf8")
+        headers = getattr(properties, "headers", None)
+        headers = (
+            json.dumps(headers, default=str).encode("utf8")
+            if headers
+            else b"{}"
+        )
+        body = bytes(body)
+        record_header = _RECORD_HEADER.pack(
+            time.time(),
+            len(message_type),
+            len(content_type),
+            len(headers),
+            len(body),
+        )
+
+        with self.lock:
+            buffer = self.buffer
+            buffer += record_header
+            buffer += message_type
+            buffer += content_type
+            buffer += headers
+            buffer += body
+            if (
+                len(buffer) >= self.buffer_size
+                or time.monotonic() - self.flushed_at >= self.flush_interval
+            ):
+                self._flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def close(self) -> None:
+        self.closed.set()
+        with self.lock:
+            if self.file is not None:
+                self._flush()
+                self.file.close()
+                self.file = None
+
+    def _flush(self) -> None:
+        if self.file is not None:
+            self.file.write(self.buffer)
+            self.file.flush()
+        self.buffer.clear()
+        self.flushed_at = time.monotonic()
+
+    def _flush_periodically(self) -> None:
+        # NOTE: Without this, the records of an idle consumer would
+        # stay in the buffer until a new message is recorded.
+        while not self.closed.wait(self.flush_interval):
+            with self.lock:
+                if self.buffer:
+                    self._flush()
+
+
+def read_captured_messages(file: BinaryIO) -> Iterator[CapturedMessage]:
+    """Read captured messages from a binary file object."""
+
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Invalid capture file.")
+
+    header_size = _RECORD_HEADER.size
+    while True:
+        record_header = file.read(header_size)
+        if len(record_header) < header_size:
+            break
+
+        (
+            timestamp,
+            type_length,
+            content_type_length,
+            headers_length,
+            body_length,
+        ) = _RECORD_HEADER.unpack(record_header)
+        length = (
+            type_length + content_type_length + headers_length + body_length
+        )
+        data = file.read(length)
+        if len(data) < length:
+            break
+
+        i = type_length
+        j = i + content_type_length
+        k = j + headers_length
+        yield CapturedMessage(
+            timestamp=timestamp,
+            type=data[:i].decode("utf8"),
+            content_type=data[i:j].decode("utf8"),
+            headers=json.loads(data[j:k]),
+            body=data[k:],
+        )
+
+
+@dataclass
+class ReplayStats:
+    count: int = 0
+    rejected_count: int = 0
+    error_count: int = 0
+    elapsed_seconds: float = 0.0
+    max_lag_seconds: float = 0.0
+
+
+def replay_captured_messages(
+    app: Flask,
+    messages: Iterable[CapturedMessage],
+    *,
+    speed: float = 1.0,
+    threads: int = 1,
+) -> ReplayStats:
+    """Process captured messages with `SmpConsumer.process_message`.
+
+    The original intervals between the messages are divided by
+    `speed`. A zero `speed` means that the messages will be processed
+    as fast as possible. The messages are processed by the given
+    number of worker `threads`.
+    """
+
+    from swpt_creditors.actors import SmpConsumer
+
+    assert speed >= 0.0
+    assert threads > 0
+    consumer = SmpConsumer()
+    stats = ReplayStats()
+    lock = threading.Lock()
+    slots = threading.Semaphore(2 * threads)
+
+    def process(message: CapturedMessage) -> None:
+        properties = MessageProperties(
+            content_type=message.content_type or None,
+            type=message.type or None,
+            headers=message.headers or None,
+        )
+        try:
+            with app.app_context():
+                is_accepted = consumer.process_message(
+                    message.body, properties
+                )
+        except Exception:
+            _LOGGER.exception("Caught error while processing a message.")
+            with lock:
+                stats.error_count += 1
+        else:
+            if not is_accepted:
+                with lock:
+                    stats.rejected_count += 1
+        finally:
+            slots.release()
+
+    started_at = time.monotonic()
+    first_timestamp = None
+    with ThreadPoolExecutor(
+        max_workers=threads, thread_name_prefix="replay"
+    ) as executor:
+        for message in messages:
+            if speed > 0.0:
+                if first_timestamp is None:
+                    first_timestamp = message.timestamp
+                due_at = (
+                    started_at + (message.timestamp - first_timestamp) / speed
+                )
+                now = time.monotonic()
+                if due_at > now:
+                    time.sleep(due_at - now)
+                else:
+                    stats.max_lag_seconds = max(
+                        stats.max_lag_seconds, now - due_at
+                    )
+
+            slots.acquire()
+            stats.count += 1
+            executor.submit(process, message)
+
+    stats.elapsed_seconds = time.monotonic() - started_at
+    return stats
@@ -3,15 +3,17 @@ import os
 import time
 import signal
 import sys
+import threading
 import click
 import pika
 from typing import Optional, Any
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from flask import current_app
 from flask.cli import with_appcontext
 from flask_sqlalchemy.model import Model
 from swpt_creditors import procedures
 from .extensions import db
+from .flushing import FlushScheduler
 from .table_scanners import (
     CreditorScanner,
     AccountScanner,
@@ -25,7 +27,7 @@ from swpt_pythonlib.multiproc_utils import (
     try_unblock_signals,
     HANDLED_SIGNALS,
 )
-from swpt_pythonlib.flask_signalbus import SignalBus, get_models_to_flush
+from swpt_pythonlib.flask_signalbus import get_models_to_flush
 
 
 @click.group("swpt_creditors")
@@ -166,6 +168,33 @@ def subscribe():  # pragma: no cover
     )
 
 
+class BatchSizeController:
+    """Adapts the size of creditor batches to the lock contention.
+
+    When some of the creditors in a batch have been skipped, because
+    they were locked by other transactions, the batch size is halved.
+    Otherwise, the batch size is increased additively, until
+    `max_size` is reached.
+    """
+
+    def __init__(self, max_size: int):
+        assert max_size > 0
+        self.max_size = max_size
+        self.size = max_size
+        self.increment = max(1, max_size // 16)
+        self.lock = threading.Lock()
+
+    def record(self, skipped_count: int) -> None:
+        """Record the processing of a batch. This method is
+        thread-safe.
+        """
+        with self.lock:
+            if skipped_count > 0:
+                self.size = max(1, self.size // 2)
+            else:
+                self.size = min(self.max_size, self.size + self.increment)
+
+
 @swpt_creditors.command("process_log_additions")
 @with_appcontext
 @click.option(
@@ -180,13 +209,19 @@ def subscribe():  # pragma: no cover
         " the queries to obtain pending log entries."
     ),
 )
+@click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    help="The maximum number of creditors processed in one transaction.",
+)
 @click.option(
     "--quit-early",
     is_flag=True,
     default=False,
     help="Exit after some time (mainly useful during testing).",
 )
-def process_log_additions(threads, wait, quit_early):
+def process_log_additions(threads, wait, batch_size, quit_early):
     """Process pending log additions.
 
     If --threads is not specified, the value of the configuration
@@ -197,6 +232,15 @@ def process_log_additions(threads, wait, quit_early):
     variable APP_PROCESS_LOG_ADDITIONS_WAIT is taken. If it is not
     set, the default number of seconds is 5.
 
+    If --batch-size is not specified, the value of the configuration
+    variable APP_PROCESS_LOG_ADDITIONS_BATCH_SIZE is taken. If it is
+    not set, the default is 1 (a separate transaction for each
+    creditor). When the batch size is bigger than 1, each worker
+    thread processes the pending log entries of several creditors in
+    one transaction. In this case, the batch size will be
+    automatically decreased when creditors are found to be locked by
+    other transactions, and increased again when they are not.
+
     """
 
     # TODO: Consider allowing load-sharing between multiple processes
@@ -214,12 +258,52 @@ def process_log_additions(threads, wait, quit_early):
         if wait is not None
         else current_app.config["APP_PROCESS_LOG_ADDITIONS_WAIT"]
     )
+    batch_size = (
+        batch_size
+        or current_app.config["APP_PROCESS_LOG_ADDITIONS_BATCH_SIZE"]
+    )
     max_count = current_app.config["APP_PROCESS_LOG_ADDITIONS_MAX_COUNT"]
 
-    def get_args_collection():
-        return procedures.get_creditors_with_pending_log_entries(
-            max_count=max_count
-        )
+    if batch_size <= 1:
+        def get_args_collection():
+            return procedures.get_creditors_with_pending_log_entries(
+                max_count=max_count
+            )
+
+        process_func = procedures.process_pending_log_entries
+        max_args_count = max_count
+    else:
+        controller = BatchSizeController(batch_size)
+
+        def get_args_collection():
+            creditor_ids = sorted(
+                row[0]
+                for row in procedures.get_creditors_with_pending_log_entries(
+                    max_count=max_count
+                )
+            )
+            return [
+                (creditor_ids[i:i + batch_size],)
+                for i in range(0, len(creditor_ids), batch_size)
+            ]
+
+        def process_func(creditor_ids):
+            # NOTE: Every chunk of `batch_size` creditors is processed
+            # in one or more batches, depending on the contention.
+            # Skipped creditors are processed separately, waiting for
+            # the lock to be released.
+            i = 0
+            while i < len(creditor_ids):
+                size = controller.size
+                skipped_ids = procedures.process_pending_log_entries_batch(
+                    creditor_ids[i:i + size]
+                )
+                controller.record(len(skipped_ids))
+                for creditor_id in skipped_ids:
+                    procedures.process_pending_log_entries(creditor_id)
+                i += size
+
+        max_args_count = (max_count + batch_size - 1) // batch_size
 
     logger = logging.getLogger(__name__)
     logger.info("Started log additions processor.")
@@ -227,9 +311,9 @@ def process_log_additions(threads, wait, quit_early):
     ThreadPoolProcessor(
         threads,
         get_args_collection=get_args_collection,
-        process_func=procedures.process_pending_log_entries,
+        process_func=process_func,
         wait_seconds=wait,
-        max_count=max_count,
+        max_count=max_args_count,
     ).run(quit_early=quit_early)
 
 
@@ -302,6 +386,70 @@ def process_ledger_updates(threads, wait, quit_early):
     ).run(quit_early=quit_early)
 
 
+@swpt_creditors.command("process_creditor_purges")
+@with_appcontext
+@click.option(
+    "-t", "--threads", type=int, help="The number of worker threads."
+)
+@click.option(
+    "-w",
+    "--wait",
+    type=float,
+    help=(
+        "The minimal number of seconds between"
+        " the queries to obtain pending creditor purges."
+    ),
+)
+@click.option(
+    "--quit-early",
+    is_flag=True,
+    default=False,
+    help="Exit after some time (mainly useful during testing).",
+)
+def process_creditor_purges(threads, wait, quit_early):
+    """Delete the accounts and running transfers of deactivated
+    creditors.
+
+    If --threads is not specified, the value of the configuration
+    variable PROCESS_CREDITOR_PURGES_THREADS is taken. If it is not
+    set, the default number of threads is 1.
+
+    If --wait is not specified, the value of the configuration
+    variable APP_PROCESS_CREDITOR_PURGES_WAIT is taken. If it is not
+    set, the default number of seconds is 5.
+
+    """
+
+    threads = threads or current_app.config["PROCESS_CREDITOR_PURGES_THREADS"]
+    burst_count = current_app.config["APP_PROCESS_CREDITOR_PURGES_BURST"]
+    wait = (
+        wait
+        if wait is not None
+        else current_app.config["APP_PROCESS_CREDITOR_PURGES_WAIT"]
+    )
+    max_count = current_app.config["APP_PROCESS_CREDITOR_PURGES_MAX_COUNT"]
+
+    def get_args_collection():
+        return procedures.get_pending_creditor_purges(max_count=max_count)
+
+    def process_creditor_purge(creditor_id):
+        while not procedures.process_pending_creditor_purge(
+                creditor_id, burst_count=burst_count
+        ):
+            pass
+
+    logger = logging.getLogger(__name__)
+    logger.info("Started creditor purges processor.")
+
+    ThreadPoolProcessor(
+        threads,
+        get_args_collection=get_args_collection,
+        process_func=process_creditor_purge,
+        wait_seconds=wait,
+        max_count=max_count,
+    ).run(quit_early=quit_early)
+
+
 @swpt_creditors.command("scan_creditors")
 @with_appcontext
 @click.option("-d", "--days", type=float, help="The number of days.")
@@ -469,8 +617,25 @@ def scan_committed_transfers(days, quit_early):
     type=int,
     help="The prefetch window in terms of whole messages.",
 )
+@click.option(
+    "--asyncio",
+    "use_asyncio",
+    is_flag=True,
+    default=False,
+    help=(
+        "Use an asyncio event loop to communicate with the message broker."
+        " In this mode, many messages can be in flight at the same time"
+        " (up to the prefetch count), but they are processed by only"
+        " THREADS worker threads. Note that this does not increase the"
+        " number of messages processed concurrently, compared to the"
+        " threaded mode with the same number of THREADS. The prefetch"
+        " size is ignored. If the APP_CONSUMER_ADAPTIVE_PREFETCH"
+        " environment variable is set, the prefetch count will be"
+        " adjusted automatically."
+    ),
+)
 def consume_messages(
-    url, queue, processes, threads, prefetch_size, prefetch_count
+    url, queue, processes, threads, prefetch_size, prefetch_count, use_asyncio
 ):
     """Consume and process incoming Swaptacular Messaging Protocol
     messages.
@@ -500,14 +665,30 @@ def consume_messages(
         from swpt_creditors.actors import SmpConsumer, TerminatedConsumtion
         from swpt_creditors import create_app
 
+        app = create_app()
+        config = app.config
+        ordered_dispatch = config["APP_CONSUMER_ORDERED_DISPATCH"]
+        workers = threads or config["PROTOCOL_BROKER_THREADS"]
+        if ordered_dispatch:
+            # NOTE: The consumer threads only wait for the workers to
+            # process the messages, so that every prefetched message
+            # can be dispatched without waiting for a free thread.
+            threads = max(
+                workers,
+                prefetch_count or config["PROTOCOL_BROKER_PREFETCH_COUNT"],
+            )
+
         consumer = SmpConsumer(
-            app=create_app(),
+            app=app,
             config_prefix="PROTOCOL_BROKER",
             url=url,
             queue=queue,
             threads=threads,
             prefetch_size=prefetch_size,
             prefetch_count=prefetch_count,
+            ordered_dispatch=ordered_dispatch,
+            workers=workers,
+            capture_path=config["APP_CAPTURE_TRAFFIC_PATH"],
         )
         for sig in HANDLED_SIGNALS:
             signal.signal(sig, consumer.stop)
@@ -524,9 +705,44 @@ def consume_messages(
 
         logger.info("Worker with PID %i stopped processing messages.", pid)
 
+    def _consume_messages_async(
+        url, queue, threads, prefetch_size, prefetch_count
+    ):  # pragma: no cover
+        """Consume messages in a subprocess, using an asyncio loop."""
+
+        from swpt_creditors.actors import AsyncSmpConsumer
+        from swpt_creditors import create_app
+
+        app = create_app()
+        config = app.config
+        consumer = AsyncSmpConsumer(
+            app,
+            url=url or config["PROTOCOL_BROKER_URL"],
+            queue=queue or config["PROTOCOL_BROKER_QUEUE"],
+            threads=threads or config["PROTOCOL_BROKER_THREADS"],
+            prefetch_count=(
+                prefetch_count or config["PROTOCOL_BROKER_PREFETCH_COUNT"]
+            ),
+            adaptive_prefetch=config["APP_CONSUMER_ADAPTIVE_PREFETCH"],
+            max_prefetch_count=config["APP_CONSUMER_MAX_PREFETCH_COUNT"],
+            max_queue_seconds=config["APP_CONSUMER_MAX_QUEUE_SECONDS"],
+            capture_path=config["APP_CAPTURE_TRAFFIC_PATH"],
+        )
+        for sig in HANDLED_SIGNALS:
+            signal.signal(sig, consumer.stop)
+        try_unblock_signals()
+
+        pid = os.getpid()
+        logger = logging.getLogger(__name__)
+        logger.info("Worker with PID %i started processing messages.", pid)
+        consumer.start()
+        logger.info("Worker with PID %i stopped processing messages.", pid)
+
     spawn_worker_processes(
         processes=processes or current_app.config["PROTOCOL_BROKER_PROCESSES"],
-        target=_consume_messages,
+        target=(
+            _consume_messages_async if use_asyncio else _consume_messages
+        ),
         url=url,
         queue=queue,
         threads=threads,
@@ -553,9 +769,30 @@ def consume_messages(
     "--wait",
     type=float,
     help=(
-        "Flush every FLOAT seconds."
-        " If not specified, the value of the FLUSH_PERIOD environment"
-        " variable will be used, defaulting to 2 seconds if empty."
+        "Flush every FLOAT seconds, unless a different flush period is"
+        " configured for the given type of messages (see the"
+        " APP_FLUSH_*_PERIOD environment variables). If not specified,"
+        " the value of the FLUSH_PERIOD environment variable will be"
+        " used, defaulting to 2 seconds if empty."
+    ),
+)
+@click.option(
+    "--bulk/--no-bulk",
+    default=None,
+    help=(
+        "Delete pending messages in bulk, without loading ORM objects."
+        " If not specified, the value of the APP_FLUSH_BULK environment"
+        " variable will be used, defaulting to false if empty."
+    ),
+)
+@click.option(
+    "--pipelined/--no-pipelined",
+    default=None,
+    help=(
+        "Read the next burst of pending messages while waiting for the"
+        " publisher confirms of the previous burst. This implies --bulk."
+        " If not specified, the value of the APP_FLUSH_PIPELINED"
+        " environment variable will be used, defaulting to false if empty."
     ),
 )
 @click.option(
@@ -569,6 +806,8 @@ def flush_messages(
     message_types: list[str],
     processes: int,
     wait: float,
+    bulk: Optional[bool],
+    pipelined: Optional[bool],
     quit_early: bool,
 ) -> None:
     """Send pending messages to the message broker.
@@ -588,6 +827,8 @@ def flush_messages(
     def _flush(
         models_to_flush: list[type[Model]],
         wait: Optional[float],
+        bulk: bool,
+        pipelined: bool,
     ) -> None:  # pragma: no cover
         from swpt_creditors import create_app
 
@@ -603,11 +844,16 @@ def flush_messages(
         try_unblock_signals()
 
         with app.app_context():
-            signalbus: SignalBus = current_app.extensions["signalbus"]
+            scheduler = FlushScheduler(
+                models_to_flush,
+                default_period=wait,
+                bulk=bulk,
+                pipelined=pipelined,
+                max_pending=current_app.config["APP_FLUSH_MAX_PENDING_BURSTS"],
+            )
             while not stopped:
-                started_at = time.time()
                 try:
-                    count = signalbus.flushmany(models_to_flush)
+                    count = scheduler.flush_due()
                 except Exception:
                     logger.exception(
                         "Caught error while sending pending signals."
@@ -618,12 +864,13 @@ def flush_messages(
                     logger.info(
                         "%i signals have been successfully processed.", count
                     )
+                    scheduler.log_stats(logger)
                 else:
                     logger.debug("0 signals have been processed.")
 
                 if quit_early:
                     break
-                time.sleep(max(0.0, wait + started_at - time.time()))
+                time.sleep(scheduler.get_wait_seconds())
 
     spawn_worker_processes(
         processes=(
@@ -636,5 +883,206 @@ def flush_messages(
         wait=(
             wait if wait is not None else current_app.config["FLUSH_PERIOD"]
         ),
+        bulk=(
+            bulk if bulk is not None else current_app.config["APP_FLUSH_BULK"]
+        ),
+        pipelined=(
+            pipelined
+            if pipelined is not None
+            else current_app.config["APP_FLUSH_PIPELINED"]
+        ),
     )
     sys.exit(1)
+
+
+@swpt_creditors.command("replay_dead_letters")
+@with_appcontext
+@click.option("-u", "--url", type=str, help="The RabbitMQ connection URL.")
+@click.option(
+    "-q",
+    "--queue",
+    type=str,
+    help=(
+        "The name of the dead-letter stream to read from. If not"
+        ' specified, PROTOCOL_BROKER_QUEUE + ".XQ" will be used.'
+    ),
+)
+@click.option(
+    "-o",
+    "--offset",
+    type=str,
+    help=(
+        'The stream offset to start reading from ("first", "last",'
+        ' "next", or an integer). The default is "first", unless'
+        " --since is specified."
+    ),
+)
+@click.option(
+    "--since",
+    type=datetime.fromisoformat,
+    help="Skip messages dead-lettered before this ISO 8601 time.",
+)
+@click.option(
+    "--until",
+    type=datetime.fromisoformat,
+    help="Stop at the first message dead-lettered at this ISO 8601 time.",
+)
+@click.option(
+    "-m",
+    "--message-type",
+    "message_types",
+    type=str,
+    multiple=True,
+    help="Replay only messages of this type. Can be given many times.",
+)
+@click.option(
+    "-t",
+    "--threads",
+    type=int,
+    default=1,
+    help="The number of threads processing messages in parallel.",
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=1000,
+    help="The number of messages to process in one database transaction.",
+)
+@click.option(
+    "--idle-timeout",
+    type=float,
+    default=5.0,
+    help="Stop when no messages arrive for FLOAT seconds.",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="Only validate and count the messages.",
+)
+def replay_dead_letters(
+    url,
+    queue,
+    offset,
+    since,
+    until,
+    message_types,
+    threads,
+    batch_size,
+    idle_timeout,
+    dry_run,
+):  # pragma: no cover
+    """Reprocess messages from the dead-letter stream.
+
+    The messages are validated again, and passed directly to the
+    actors, processing many messages in a single database
+    transaction. The offset before which all messages have been
+    processed is logged periodically (as "resume_offset"), so that an
+    interrupted replay can be resumed with the --offset option.
+
+    """
+
+    from .replay import MessageReplayer, read_stream
+
+    def _to_utc(t: Optional[datetime]) -> Optional[datetime]:
+        if t is not None and t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+        return t
+
+    since = _to_utc(since)
+    until = _to_utc(until)
+
+    if offset is None:
+        offset = since if since is not None else "first"
+    elif offset.isdigit():
+        offset = int(offset)
+
+    config = current_app.config
+    url = url or config["PROTOCOL_BROKER_URL"]
+    queue = queue or config["PROTOCOL_BROKER_QUEUE"] + ".XQ"
+    replayer = MessageReplayer(
+        current_app._get_current_object(),
+        threads=threads,
+        batch_size=batch_size,
+        message_types=set(message_types) if message_types else None,
+        since=since,
+        until=until,
+        dry_run=dry_run,
+    )
+
+    connection = pika.BlockingConnection(pika.URLParameters(url))
+    try:
+        channel = connection.channel()
+        for stream_offset, properties, body in read_stream(
+            channel,
+            queue,
+            offset=offset,
+            prefetch_count=2 * batch_size,
+            idle_timeout=idle_timeout,
+        ):
+            if not replayer.add(body, properties, stream_offset):
+                break
+    finally:
+        stats = replayer.finish()
+        connection.close()
+
+    logger = logging.getLogger(__name__)
+    for message_type, count in sorted(stats.type_counts.items()):
+        logger.info("%s: %i messages.", message_type, count)
+    if stats.failed_count > 0:
+        sys.exit(1)
+
+
+@swpt_creditors.command("replay_traffic")
+@with_appcontext
+@click.argument("files", nargs=-1, type=click.File("rb"), required=True)
+@click.option(
+    "-s",
+    "--speed",
+    type=float,
+    default=1.0,
+    help=(
+        "Replay the messages FLOAT times faster than they were captured."
+        " Zero means as fast as possible. The default is 1."
+    ),
+)
+@click.option(
+    "-t",
+    "--threads",
+    type=int,
+    default=1,
+    help="The number of threads processing messages in parallel.",
+)
+def replay_traffic(files, speed, threads):  # pragma: no cover
+    """Process captured Swaptacular Messaging Protocol traffic.
+
+    The messages from the given capture files (see the
+    APP_CAPTURE_TRAFFIC_PATH configuration variable) are processed
+    against the local database, exactly as if they were received from
+    the message broker.
+
+    """
+
+    from .capture import read_captured_messages, replay_captured_messages
+
+    def _read_all():
+        for file in files:
+            yield from read_captured_messages(file)
+
+    logger = logging.getLogger(__name__)
+    stats = replay_captured_messages(
+        current_app._get_current_object(),
+        _read_all(),
+        speed=speed,
+        threads=threads,
+    )
+    logger.info(
+        "Replayed %i messages in %.1f seconds (rejected=%i errors=%i"
+        " max_lag=%.3fs).",
+        stats.count,
+        stats.elapsed_seconds,
+        stats.rejected_count,
+        stats.error_count,
+        stats.max_lag_seconds,
+    )
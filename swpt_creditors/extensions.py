@@ -1,5 +1,8 @@
 import warnings
+from typing import Callable
+from sqlalchemy import event
 from sqlalchemy.exc import SAWarning
+from sqlalchemy.orm import Session
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from swpt_pythonlib.flask_signalbus import (
@@ -38,3 +41,40 @@ db = CustomAlchemy()
 migrate = Migrate()
 publisher = rabbitmq.Publisher(url_config_key="PROTOCOL_BROKER_URL")
 api = Api()
+
+_AFTER_COMMIT_SESSION_INFO_KEY = "swpt_creditors_after_commit"
+
+
+def call_after_commit(callback: Callable[[], None]) -> None:
+    """Call `callback` after the current transaction has been committed.
+
+    If the transaction gets rolled back (for example, before `db.atomic`
+    retries it), the callback is discarded. If there is no transaction
+    in progress, the callback is called immediately.
+    """
+
+    session = db.session()
+    if session.in_transaction():
+        session.info.setdefault(_AFTER_COMMIT_SESSION_INFO_KEY, []).append(
+            callback
+        )
+    else:
+        callback()
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit_callbacks(session):
+    if session.in_nested_transaction():
+        return  # This is a savepoint release.
+
+    for callback in session.info.pop(_AFTER_COMMIT_SESSION_INFO_KEY, ()):
+        callback()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_after_commit_callbacks(session, transaction):
+    # NOTE: This is called after `_run_after_commit_callbacks` when
+    # the transaction has been committed, and is the only handler
+    # called when the transaction has been rolled back.
+    if transaction.parent is None:
+        session.info.pop(_AFTER_COMMIT_SESSION_INFO_KEY, None)
@@ -0,0 +1,537 @@
+"""An in-process stand-in for an accounting authority.
+
+The `FakeAccountingAuthority` class can be passed as a message
+publisher to `Signal.flush_burst`. It responds to the received
+`ConfigureAccount`, `PrepareTransfer`, and `FinalizeTransfer`
+messages with realistic `AccountUpdate`, `AccountPurge`,
+`PreparedTransfer`, `RejectedTransfer`, `FinalizedTransfer`, and
+`AccountTransfer` messages, and feeds them to
+`SmpConsumer.process_message`. This allows the whole "create an
+account, make a transfer, update the ledger, add log entries" cycle
+to be executed (and benchmarked) without a message broker.
+
+This is meant to be used only for testing.
+"""
+
+import json
+import time
+import logging
+import statistics
+from collections import deque, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, date, timedelta, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+from flask import Flask, current_app
+from swpt_pythonlib.flask_signalbus import get_models_to_flush
+from swpt_pythonlib.rabbitmq import MessageProperties
+from swpt_creditors import procedures
+from swpt_creditors.models import AccountData
+
+_LOGGER = logging.getLogger(__name__)
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_TTL_SECONDS = 365 * 24 * 3600
+_COMMIT_PERIOD_SECONDS = 30 * 24 * 3600
+_TRANSFER_NOTE_MAX_BYTES = 500
+
+
+def _isoformat(t: datetime) -> str:
+    return t.isoformat()
+
+
+@dataclass
+class FakeAccount:
+    creditor_id: int
+    debtor_id: int
+    creation_date: date
+    principal: int = 0
+    total_locked_amount: int = 0
+    last_change_seqnum: int = 0
+    last_transfer_number: int = 0
+    last_transfer_committed_at: datetime = _EPOCH
+    last_config_ts: datetime = _EPOCH
+    last_config_seqnum: int = 0
+    negligible_amount: float = 0.0
+    config_flags: int = 0
+    config_data: str = ""
+
+    @property
+    def account_id(self) -> str:
+        return str(self.creditor_id)
+
+
+@dataclass
+class FakePreparedTransfer:
+    creditor_id: int
+    debtor_id: int
+    transfer_id: int
+    coordinator_id: int
+    coordinator_request_id: int
+    locked_amount: int
+    recipient: str
+    prepared_at: datetime
+    deadline: datetime
+    final_interest_rate_ts: datetime
+
+
+@dataclass
+class LatencyStats:
+    count: int
+    avg_seconds: float
+    median_seconds: float
+    max_seconds: float
+
+
+@dataclass
+class _Response:
+    stage: str
+    request_ts: datetime
+    message_type: str
+    data: dict = field(default_factory=dict)
+
+
+class FakeAccountingAuthority:
+    """Responds to the messages that the creditors agent sends to the
+    accounting authorities.
+
+    Every new account receives `initial_principal` units, which are
+    transferred to it by an "issuing" transfer. Responses are
+    accumulated in memory, and are processed when `deliver_responses`
+    is called. For every response, the time between the creation of
+    the request (the "ts" field) and the processing of the response is
+    recorded, so that the end-to-end latency can be measured per stage
+    (for example, "PrepareTransfer->PreparedTransfer").
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        *,
+        initial_principal: int = 0,
+        demurrage_rate: float = -50.0,
+    ):
+        from swpt_creditors.actors import SmpConsumer
+
+        self.app = app
+        self.initial_principal = initial_principal
+        self.demurrage_rate = demurrage_rate
+        self.consumer = SmpConsumer()
+        self.accounts: Dict[Tuple[int, int], FakeAccount] = {}
+        self.prepared_transfers: Dict[int, FakePreparedTransfer] = {}
+        self.responses: Deque[_Response] = deque()
+        self.ignored_count = 0
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.stage_seconds: Dict[str, float] = defaultdict(float)
+        self._last_transfer_id = 0
+
+    def publish_messages(self, messages: list) -> None:
+        """Receive messages, like `rabbitmq.Publisher.publish_messages`."""
+
+        for message in messages:
+            message_type = message.properties.type
+            handler = self._REQUEST_HANDLERS.get(message_type)
+            if handler is None:
+                self.ignored_count += 1
+                continue
+
+            data = json.loads(message.body)
+            handler(self, data, datetime.fromisoformat(data["ts"]))
+
+    def flush_signals(self) -> int:
+        """Send all pending signals, and return their number."""
+
+        models = get_models_to_flush(current_app.extensions["signalbus"], [])
+        count = 0
+        for model in models:
+            while True:
+                n = len(model.flush_burst(message_publisher=self))
+                count += n
+                if n < model.signalbus_burst_count:
+                    break
+        return count
+
+    def deliver_responses(self) -> int:
+        """Process all accumulated responses, and return their number."""
+
+        count = 0
+        while self.responses:
+            response = self.responses.popleft()
+            body = json.dumps(
+                response.data, default=_isoformat
+            ).encode("utf8")
+            properties = MessageProperties(
+                content_type="application/json",
+                type=response.message_type,
+            )
+            with self.app.app_context():
+                self.consumer.process_message(body, properties)
+
+            latency = datetime.now(tz=timezone.utc) - response.request_ts
+            self.latencies[response.stage].append(latency.total_seconds())
+            count += 1
+        return count
+
+    def process_ledger_updates(self) -> int:
+        config = current_app.config
+        burst_count = config["APP_PROCESS_LEDGER_UPDATES_BURST"]
+        max_delay = timedelta(days=config["APP_MAX_TRANSFER_DELAY_DAYS"])
+        pending_ledger_updates = procedures.get_pending_ledger_updates()
+        for creditor_id, debtor_id in pending_ledger_updates:
+            while not procedures.process_pending_ledger_update(
+                creditor_id,
+                debtor_id,
+                burst_count=burst_count,
+                max_delay=max_delay,
+            ):
+                pass
+        return len(pending_ledger_updates)
+
+    def process_log_additions(self) -> int:
+        creditor_ids = procedures.get_creditors_with_pending_log_entries()
+        for (creditor_id,) in creditor_ids:
+            procedures.process_pending_log_entries(creditor_id)
+        return len(creditor_ids)
+
+    def run_cycle(self) -> int:
+        """Execute every processing stage once, and return the total
+        number of processed items.
+        """
+        count = 0
+        for stage, method in [
+            ("flush_signals", self.flush_signals),
+            ("deliver_responses", self.deliver_responses),
+            ("process_ledger_updates", self.process_ledger_updates),
+            ("process_log_additions", self.process_log_additions),
+        ]:
+            started_at = time.monotonic()
+            count += method()
+            self.stage_seconds[stage] += time.monotonic() - started_at
+        return count
+
+    def run_until_idle(self, max_cycles: int = 100) -> int:
+        """Execute processing cycles until there is nothing to do, and
+        return the number of executed cycles.
+        """
+        for cycle in range(1, max_cycles + 1):
+            if self.run_cycle() == 0:
+                return cycle
+
+        _LOGGER.warning("Stopped after %i processing cycles.", max_cycles)
+        return max_cycles
+
+    def get_latency_stats(self) -> Dict[str, LatencyStats]:
+        return {
+            stage: LatencyStats(
+                count=len(latencies),
+                avg_seconds=sum(latencies) / len(latencies),
+                median_seconds=statistics.median(latencies),
+                max_seconds=max(latencies),
+            )
+            for stage, latencies in self.latencies.items()
+        }
+
+    def log_stats(self, logger: logging.Logger = _LOGGER) -> None:
+        for stage, s in sorted(self.get_latency_stats().items()):
+            logger.info(
+                "%s: count=%i avg=%.2fms median=%.2fms max=%.2fms",
+                stage,
+                s.count,
+                1000 * s.avg_seconds,
+                1000 * s.median_seconds,
+                1000 * s.max_seconds,
+            )
+        for stage, seconds in self.stage_seconds.items():
+            logger.info("%s: %.3f seconds", stage, seconds)
+
+    def _respond(
+        self,
+        stage: str,
+        request_ts: datetime,
+        message_type: str,
+        **data,
+    ) -> None:
+        data["type"] = message_type
+        data["ts"] = datetime.now(tz=timezone.utc)
+        self.responses.append(
+            _Response(stage, request_ts, message_type, data)
+        )
+
+    def _send_account_update(
+        self, account: FakeAccount, stage: str, request_ts: datetime
+    ) -> None:
+        account.last_change_seqnum += 1
+        self._respond(
+            stage,
+            request_ts,
+            "AccountUpdate",
+            debtor_id=account.debtor_id,
+            creditor_id=account.creditor_id,
+            creation_date=account.creation_date.isoformat(),
+            last_change_ts=datetime.now(tz=timezone.utc),
+            last_change_seqnum=account.last_change_seqnum,
+            principal=account.principal,
+            interest=0.0,
+            interest_rate=0.0,
+            last_interest_rate_change_ts=_EPOCH,
+            last_transfer_number=account.last_transfer_number,
+            last_transfer_committed_at=account.last_transfer_committed_at,
+            last_config_ts=account.last_config_ts,
+            last_config_seqnum=account.last_config_seqnum,
+            negligible_amount=account.negligible_amount,
+            config_flags=account.config_flags,
+            config_data=account.config_data,
+            account_id=account.account_id,
+            debtor_info_iri="",
+            debtor_info_content_type="",
+            debtor_info_sha256="",
+            demurrage_rate=self.demurrage_rate,
+            commit_period=_COMMIT_PERIOD_SECONDS,
+            transfer_note_max_bytes=_TRANSFER_NOTE_MAX_BYTES,
+            ttl=_TTL_SECONDS,
+        )
+
+    def _send_account_transfer(
+        self,
+        account: FakeAccount,
+        stage: str,
+        request_ts: datetime,
+        *,
+        coordinator_type: str,
+        sender: str,
+        recipient: str,
+        acquired_amount: int,
+        transfer_note_format: str = "",
+        transfer_note: str = "",
+    ) -> None:
+        committed_at = datetime.now(tz=timezone.utc)
+        previous_transfer_number = account.last_transfer_number
+        account.principal += acquired_amount
+        account.last_transfer_number += 1
+        account.last_transfer_committed_at = committed_at
+        self._respond(
+            stage,
+            request_ts,
+            "AccountTransfer",
+            debtor_id=account.debtor_id,
+            creditor_id=account.creditor_id,
+            creation_date=account.creation_date.isoformat(),
+            transfer_number=account.last_transfer_number,
+            coordinator_type=coordinator_type,
+            sender=sender,
+            recipient=recipient,
+            acquired_amount=acquired_amount,
+            transfer_note_format=transfer_note_format,
+            transfer_note=transfer_note,
+            committed_at=committed_at,
+            principal=account.principal,
+            previous_transfer_number=previous_transfer_number,
+        )
+
+    def _on_configure_account(self, data: dict, request_ts: datetime):
+        stage = "ConfigureAccount->AccountUpdate"
+        key = (data["creditor_id"], data["debtor_id"])
+        account = self.accounts.get(key)
+        config_ts = datetime.fromisoformat(data["ts"])
+        is_new_account = account is None
+        if is_new_account:
+            account = self.accounts[key] = FakeAccount(
+                creditor_id=key[0],
+                debtor_id=key[1],
+                creation_date=datetime.now(tz=timezone.utc).date(),
+            )
+        elif (config_ts, data["seqnum"]) <= (
+            account.last_config_ts,
+            account.last_config_seqnum,
+        ):
+            return
+
+        account.last_config_ts = config_ts
+        account.last_config_seqnum = data["seqnum"]
+        account.negligible_amount = data["negligible_amount"]
+        account.config_flags = data["config_flags"]
+        account.config_data = data["config_data"]
+
+        is_scheduled_for_deletion = (
+            account.config_flags
+            & AccountData.CONFIG_SCHEDULED_FOR_DELETION_FLAG
+        )
+        if (
+            is_scheduled_for_deletion
+            and account.principal == 0
+            and account.total_locked_amount == 0
+        ):
+            del self.accounts[key]
+            self._respond(
+                "ConfigureAccount->AccountPurge",
+                request_ts,
+                "AccountPurge",
+                debtor_id=account.debtor_id,
+                creditor_id=account.creditor_id,
+                creation_date=account.creation_date.isoformat(),
+            )
+            return
+
+        self._send_account_update(account, stage, request_ts)
+
+        if is_new_account and self.initial_principal > 0:
+            self._send_account_transfer(
+                account,
+                "ConfigureAccount->AccountTransfer",
+                request_ts,
+                coordinator_type="issuing",
+                sender="0",
+                recipient=account.account_id,
+                acquired_amount=self.initial_principal,
+            )
+            self._send_account_update(account, stage, request_ts)
+
+    def _on_prepare_transfer(self, data: dict, request_ts: datetime):
+        account = self.accounts.get((data["creditor_id"], data["debtor_id"]))
+        recipient = self._find_account(data["recipient"], data["debtor_id"])
+        min_locked_amount = data["min_locked_amount"]
+        status_code = None
+        if account is None:
+            status_code = "SENDER_IS_UNREACHABLE"
+        elif recipient is None or recipient is account:
+            status_code = "RECIPIENT_IS_UNREACHABLE"
+        else:
+            available_amount = account.principal - account.total_locked_amount
+            if available_amount < min_locked_amount:
+                status_code = "INSUFFICIENT_AVAILABLE_AMOUNT"
+
+        if status_code is not None:
+            self._respond(
+                "PrepareTransfer->RejectedTransfer",
+                request_ts,
+                "RejectedTransfer",
+                debtor_id=data["debtor_id"],
+                creditor_id=data["creditor_id"],
+                coordinator_type=data["coordinator_type"],
+                coordinator_id=data["coordinator_id"],
+                coordinator_request_id=data["coordinator_request_id"],
+                status_code=status_code,
+                total_locked_amount=(
+                    account.total_locked_amount if account else 0
+                ),
+            )
+            return
+
+        locked_amount = max(
+            min(data["max_locked_amount"], available_amount),
+            min_locked_amount,
+        )
+        account.total_locked_amount += locked_amount
+        self._last_transfer_id += 1
+        now = datetime.now(tz=timezone.utc)
+        pt = self.prepared_transfers[self._last_transfer_id] = (
+            FakePreparedTransfer(
+                creditor_id=account.creditor_id,
+                debtor_id=account.debtor_id,
+                transfer_id=self._last_transfer_id,
+                coordinator_id=data["coordinator_id"],
+                coordinator_request_id=data["coordinator_request_id"],
+                locked_amount=locked_amount,
+                recipient=data["recipient"],
+                prepared_at=now,
+                deadline=now + timedelta(seconds=data["max_commit_delay"]),
+                final_interest_rate_ts=datetime.fromisoformat(
+                    data["final_interest_rate_ts"]
+                ),
+            )
+        )
+        self._respond(
+            "PrepareTransfer->PreparedTransfer",
+            request_ts,
+            "PreparedTransfer",
+            debtor_id=pt.debtor_id,
+            creditor_id=pt.creditor_id,
+            transfer_id=pt.transfer_id,
+            coordinator_type=data["coordinator_type"],
+            coordinator_id=pt.coordinator_id,
+            coordinator_request_id=pt.coordinator_request_id,
+            locked_amount=pt.locked_amount,
+            recipient=pt.recipient,
+            prepared_at=pt.prepared_at,
+            demurrage_rate=self.demurrage_rate,
+            deadline=pt.deadline,
+            final_interest_rate_ts=pt.final_interest_rate_ts,
+        )
+
+    def _on_finalize_transfer(self, data: dict, request_ts: datetime):
+        pt = self.prepared_transfers.get(data["transfer_id"])
+        if pt is None or (pt.creditor_id, pt.debtor_id) != (
+            data["creditor_id"],
+            data["debtor_id"],
+        ):
+            return
+
+        del self.prepared_transfers[pt.transfer_id]
+        account = self.accounts[(pt.creditor_id, pt.debtor_id)]
+        account.total_locked_amount -= pt.locked_amount
+        recipient = self._find_account(pt.recipient, pt.debtor_id)
+        committed_amount = data["committed_amount"]
+        status_code = "OK"
+        if committed_amount > 0:
+            available_amount = (
+                account.principal
+                - account.total_locked_amount
+                + pt.locked_amount
+            )
+            if recipient is None:
+                status_code = "RECIPIENT_IS_UNREACHABLE"
+            elif committed_amount > available_amount:
+                status_code = "INSUFFICIENT_AVAILABLE_AMOUNT"
+
+        if status_code != "OK":
+            committed_amount = 0
+
+        self._respond(
+            "FinalizeTransfer->FinalizedTransfer",
+            request_ts,
+            "FinalizedTransfer",
+            debtor_id=pt.debtor_id,
+            creditor_id=pt.creditor_id,
+            transfer_id=pt.transfer_id,
+            coordinator_type=data["coordinator_type"],
+            coordinator_id=pt.coordinator_id,
+            coordinator_request_id=pt.coordinator_request_id,
+            committed_amount=committed_amount,
+            status_code=status_code,
+            total_locked_amount=account.total_locked_amount,
+            prepared_at=pt.prepared_at,
+        )
+        if committed_amount > 0:
+            assert recipient is not None
+            stage = "FinalizeTransfer->AccountTransfer"
+            for acc, amount in [
+                (account, -committed_amount),
+                (recipient, committed_amount),
+            ]:
+                self._send_account_transfer(
+                    acc,
+                    stage,
+                    request_ts,
+                    coordinator_type=data["coordinator_type"],
+                    sender=account.account_id,
+                    recipient=recipient.account_id,
+                    acquired_amount=amount,
+                    transfer_note_format=data["transfer_note_format"],
+                    transfer_note=data["transfer_note"],
+                )
+                self._send_account_update(
+                    acc, "FinalizeTransfer->AccountUpdate", request_ts
+                )
+
+    def _find_account(
+        self, account_id: str, debtor_id: int
+    ) -> Optional[FakeAccount]:
+        try:
+            creditor_id = int(account_id)
+        except ValueError:
+            return None
+        return self.accounts.get((creditor_id, debtor_id))
+
+    _REQUEST_HANDLERS = {
+        "ConfigureAccount": _on_configure_account,
+        "PrepareTransfer": _on_prepare_transfer,
+        "FinalizeTransfer": _on_finalize_transfer,
+    }
@@ -0,0 +1,203 @@
+"""Fast loading of incoming messages.
+
+Loading a message with `Schema.load` is relatively slow, because
+marshmallow supports many features (partial loading, error
+accumulation, nested schemas, etc.) which are not needed for the
+messages that we receive. The `CompiledSchema` class inspects a
+marshmallow schema only once, and then loads messages using a
+specialized code path, falling back to `Schema.load` whenever the
+specialized code path can not guarantee the same result.
+"""
+
+import math
+from typing import Any, Callable, List, Tuple
+from marshmallow import Schema, fields, missing, EXCLUDE, INCLUDE, RAISE
+from marshmallow.decorators import (
+    PRE_LOAD,
+    POST_LOAD,
+    VALIDATES,
+    VALIDATES_SCHEMA,
+)
+
+_INT = 1
+_FLOAT = 2
+_STR = 3
+_GENERIC = 4
+
+
+class _Fallback(Exception):
+    """The fast code path can not handle the data."""
+
+
+def _get_field_kind(field: fields.Field) -> int:
+    field_type = type(field)
+    if field_type is fields.Integer or field_type is fields.Int:
+        return _INT
+    if field_type is fields.Float:
+        return _FLOAT
+    if field_type is fields.String or field_type is fields.Str:
+        return _STR
+    return _GENERIC
+
+
+class CompiledSchema:
+    """Loads data exactly like the passed marshmallow `schema`, but
+    faster.
+
+    For valid data, `load` returns the same result as
+    `schema.load`. For invalid data, `schema.load` is called to raise
+    the same `ValidationError`.
+    """
+
+    def __init__(self, schema: Schema):
+        self.schema = schema
+        self.fields: List[Tuple[str, str, int, fields.Field, list]] = []
+        self.field_validators: List[Tuple[Callable, str]] = []
+        self.schema_validators: List[Tuple[Callable, bool]] = []
+        self.post_load_processors: List[Tuple[Callable, bool]] = []
+        self.is_compiled = self._compile(schema)
+
+    def _compile(self, schema: Schema) -> bool:
+        if (
+            schema.many
+            or schema.partial
+            or schema.unknown not in (RAISE, EXCLUDE, INCLUDE)
+            or schema._hooks[PRE_LOAD]
+        ):
+            return False
+
+        for field_name, field in schema.load_fields.items():
+            data_key = (
+                field.data_key if field.data_key is not None else field_name
+            )
+            attribute = field.attribute or field_name
+            if "." in attribute:
+                return False
+            self.fields.append(
+                (
+                    data_key,
+                    attribute,
+                    _get_field_kind(field),
+                    field,
+                    list(field.validators),
+                )
+            )
+
+        self.data_keys = frozenset(f[0] for f in self.fields)
+
+        for attr_name, _, kwargs in schema._hooks[VALIDATES]:
+            field_name = kwargs["field_name"]
+            field = schema.fields.get(field_name)
+            if field is None:
+                return False
+            self.field_validators.append(
+                (getattr(schema, attr_name), field.attribute or field_name)
+            )
+
+        # NOTE: Marshmallow invokes the "pass_many" hooks first.
+        for pass_many in [True, False]:
+            for attr_name, hook_many, kwargs in schema._hooks[
+                VALIDATES_SCHEMA
+            ]:
+                if hook_many == pass_many:
+                    self.schema_validators.append(
+                        (
+                            getattr(schema, attr_name),
+                            kwargs.get("pass_original", False),
+                        )
+                    )
+        for pass_many in [True, False]:
+            for attr_name, hook_many, kwargs in schema._hooks[POST_LOAD]:
+                if hook_many == pass_many:
+                    self.post_load_processors.append(
+                        (
+                            getattr(schema, attr_name),
+                            kwargs.get("pass_original", False),
+                        )
+                    )
+
+        return True
+
+    def load(self, data: Any) -> Any:
+        if self.is_compiled:
+            try:
+                return self._load(data)
+            except Exception:
+                pass
+
+        return self.schema.load(data)
+
+    def _load(self, data: Any) -> dict:
+        if type(data) is not dict:
+            raise _Fallback()
+
+        unknown = self.schema.unknown
+        if unknown is not EXCLUDE and not self.data_keys.issuperset(data):
+            # NOTE: When unknown fields should be included, the order
+            # of the keys in the result is not deterministic.
+            raise _Fallback()
+
+        result = {}
+        for data_key, attribute, kind, field, validators in self.fields:
+            value = data.get(data_key, missing)
+
+            if value is missing:
+                if field.required:
+                    raise _Fallback()
+                load_default = field.load_default
+                if load_default is missing:
+                    continue
+                result[attribute] = (
+                    load_default() if callable(load_default) else load_default
+                )
+                continue
+
+            if value is None:
+                if not field.allow_none:
+                    raise _Fallback()
+                result[attribute] = None
+                continue
+
+            value_type = type(value)
+            if kind == _INT:
+                if value_type is not int:
+                    raise _Fallback()
+            elif kind == _STR:
+                if value_type is not str:
+                    raise _Fallback()
+            elif kind == _FLOAT:
+                if value_type is not float and value_type is not int:
+                    raise _Fallback()
+                value = float(value)
+                if field.allow_nan is False and (
+                    math.isnan(value) or math.isinf(value)
+                ):
+                    raise _Fallback()
+            else:
+                value = field.deserialize(value, data_key, data)
+
+            if kind != _GENERIC:
+                for validator in validators:
+                    if validator(value) is False:
+                        raise _Fallback()
+
+            result[attribute] = value
+
+        for validator, attribute in self.field_validators:
+            if attribute in result:
+                if validator(result[attribute]) is missing:
+                    raise _Fallback()
+
+        for validator, pass_original in self.schema_validators:
+            if pass_original:
+                validator(result, data, partial=None, many=False)
+            else:
+                validator(result, partial=None, many=False)
+
+        for processor, pass_original in self.post_load_processors:
+            if pass_original:
+                result = processor(result, data, many=False, partial=None)
+            else:
+                result = processor(result, many=False, partial=None)
+
+        return result
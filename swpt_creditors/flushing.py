@@ -0,0 +1,158 @@
+import time
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Set, Tuple
+from flask import current_app
+from swpt_pythonlib.flask_signalbus import SignalBus
+
+
+@dataclass
+class FlushStats:
+    """Per-signal-type flushing statistics.
+
+    Note that `max_delay_seconds` and `has_backlog` are measured only
+    in the "bulk" mode. In the other modes every type of signals is
+    flushed completely, so that `has_backlog` is always false, and
+    `max_delay_seconds` is always zero.
+    """
+
+    sent_count: int = 0
+    burst_count: int = 0
+    max_delay_seconds: float = 0.0
+    has_backlog: bool = False
+
+    def reset(self) -> None:
+        self.sent_count = 0
+        self.burst_count = 0
+        self.max_delay_seconds = 0.0
+
+
+class FlushScheduler:
+    """Flushes several types of signals, giving precedence to the
+    types with higher priority.
+
+    Every signal model defines its own flush period
+    (`signalbus_flush_period`), and its own flush priority
+    (`signalbus_flush_priority`, smaller numbers mean higher
+    priority). A zero flush period means that the `default_period`
+    will be used.
+
+    In the "bulk" mode, the pending signals are flushed burst by burst,
+    and before every burst, the highest priority type which is due for
+    a flush will be chosen (including the types that have already been
+    flushed during the current call). Therefore, a big backlog of
+    low-priority signals can not delay the sending of high-priority
+    signals by more than the time needed to flush one burst. In the
+    other modes, every type of signals is flushed completely, in order
+    of priority.
+    """
+
+    def __init__(
+        self,
+        models: list,
+        *,
+        default_period: float,
+        bulk: bool = False,
+        pipelined: bool = False,
+        max_pending: int = 2,
+    ):
+        self.models = sorted(models, key=lambda m: m.signalbus_flush_priority)
+        self.default_period = default_period
+        self.bulk = bulk
+        self.pipelined = pipelined
+        self.max_pending = max_pending
+        self.next_flush_at: Dict[type, float] = {m: 0.0 for m in self.models}
+        self.stats: Dict[type, FlushStats] = {
+            m: FlushStats() for m in self.models
+        }
+
+    def get_period(self, model) -> float:
+        return model.signalbus_flush_period or self.default_period
+
+    def get_wait_seconds(self) -> float:
+        """Return the number of seconds until the next flush is due."""
+
+        return max(0.0, min(self.next_flush_at.values()) - time.time())
+
+    def flush_due(self) -> int:
+        """Flush all types of signals that are due for a flush, and
+        return the number of processed signals.
+        """
+        for stats in self.stats.values():
+            stats.reset()
+
+        # The types that have been flushed completely during this
+        # call. They will be checked again (when due) after every
+        # burst of a type which still has a backlog.
+        done: Set[type] = set()
+
+        # The types that have been flushed completely after the last
+        # burst of a type which still has a backlog. This guarantees
+        # that a type with a very short flush period will not keep
+        # us here forever.
+        idle: Set[type] = set()
+
+        count = 0
+
+        while True:
+            # NOTE: `self.models` is sorted by priority.
+            now = time.time()
+            due = [
+                m
+                for m in self.models
+                if m not in idle and self.next_flush_at[m] <= now
+            ]
+            if all(m in done for m in due):
+                return count
+
+            model = due[0]
+            n, has_backlog = self._flush_model(model)
+            count += n
+
+            if has_backlog:
+                done.discard(model)
+                idle.clear()
+            else:
+                done.add(model)
+                idle.add(model)
+                period = self.get_period(model)
+                self.next_flush_at[model] = time.time() + period
+
+    def log_stats(self, logger: logging.Logger) -> None:
+        for model, stats in self.stats.items():
+            if stats.sent_count > 0 or stats.has_backlog:
+                logger.info(
+                    "%s: sent=%i bursts=%i max_delay=%.3fs backlog=%s",
+                    model.__name__,
+                    stats.sent_count,
+                    stats.burst_count,
+                    stats.max_delay_seconds,
+                    stats.has_backlog,
+                )
+
+    def _flush_model(self, model) -> Tuple[int, bool]:
+        # Returns the number of processed signals, and whether there
+        # are more signals waiting to be sent.
+        stats = self.stats[model]
+        has_backlog = False
+
+        if self.pipelined:
+            n = model.flush_pipelined(max_pending=self.max_pending)
+        elif self.bulk:
+            rows = model.flush_burst()
+            n = len(rows)
+            has_backlog = n >= model.signalbus_burst_count
+            if rows:
+                now = datetime.now(tz=timezone.utc)
+                oldest = min(row.inserted_at for row in rows)
+                delay = (now - oldest).total_seconds()
+                stats.max_delay_seconds = max(stats.max_delay_seconds, delay)
+        else:
+            signalbus: SignalBus = current_app.extensions["signalbus"]
+            n = signalbus.flushmany([model])
+
+        stats.burst_count += 1
+        stats.sent_count += n
+        stats.has_backlog = has_backlog
+        return n, has_backlog
@@ -1,51 +1,347 @@
 """Implement functions that inspect operations susceptible to DoS attacks."""
 
 import math
-from flask import current_app
+import functools
+import time
+import logging
+import threading
+from collections import OrderedDict
+from uuid import UUID
+from typing import TypeVar, Callable, Collection, Dict, Sequence, Optional
+from flask import Flask, current_app
+from swpt_creditors.extensions import db, call_after_commit
+from swpt_creditors.models import Account, RunningTransfer
 from swpt_creditors import procedures
 
+T = TypeVar("T")
+atomic: Callable[[T], T] = db.atomic
+
+
+RECONFIGS = "reconfigs"
+INITIATIONS = "initiations"
+RECONFIGS_FLUSH_CHUNK_SIZE = 500
+TOKEN_BUCKETS_EXTENSION = "creditor_dos_token_buckets"
+
+_LOGGER = logging.getLogger(__name__)
+
 
 class ForbiddenOperation(Exception):
     """The operation is forbidden."""
 
 
+class TokenBuckets:
+    """An in-process token bucket front for the usage stats.
+
+    Every creditor has a bucket of "reconfigs" tokens, and a bucket of
+    "initiations" tokens. A bucket can hold up to `2 * max_count`
+    tokens, and gets refilled with `max_count` tokens per
+    `clear_hours`. This guarantees that the buckets will never reject
+    an operation that the usage stats in the database would allow.
+    (The database allows up to `max_count` operations per
+    `clear_hours`-long period, which means up to `2 * max_count`
+    operations in a short time around the end of a period.)
+
+    Also, the registered reconfigs are accumulated in memory (for up
+    to `max_creditors` creditors), and are periodically flushed to the
+    database by a background thread (see `flush_reconfigs`). Note that
+    in case of a crash, the accumulated reconfigs will be lost, which
+    is in users' favor.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_reconfigs: int,
+        max_initiations: int,
+        clear_hours: float,
+        flush_seconds: float = 10.0,
+        max_creditors: int = 100000,
+    ):
+        assert clear_hours > 0.0
+        assert max_creditors > 0
+        period_seconds = clear_hours * 3600.0
+        self.params = {
+            RECONFIGS: (2.0 * max_reconfigs, max_reconfigs / period_seconds),
+            INITIATIONS: (
+                2.0 * max_initiations,
+                max_initiations / period_seconds,
+            ),
+        }
+        self.flush_seconds = flush_seconds
+        self.max_creditors = max_creditors
+        self.lock = threading.Lock()
+        self.buckets: OrderedDict = OrderedDict()
+        self.pending_reconfigs: Dict[int, int] = {}
+
+    def try_consume(self, kind: str, creditor_id: int, count: int = 1) -> bool:
+        """Try to take `count` tokens from creditor's bucket."""
+
+        capacity, refill_rate = self.params[kind]
+        key = (kind, creditor_id)
+        now = time.monotonic()
+
+        with self.lock:
+            buckets = self.buckets
+            bucket = buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens, updated_at = bucket
+                tokens = min(
+                    capacity, tokens + (now - updated_at) * refill_rate
+                )
+
+            is_allowed = tokens >= count
+            if is_allowed:
+                tokens -= count
+
+            # NOTE: Forgetting a bucket is equivalent to filling it up,
+            # which is always safe.
+            buckets[key] = (tokens, now)
+            buckets.move_to_end(key)
+            while len(buckets) > 2 * self.max_creditors:
+                buckets.popitem(last=False)
+
+        return is_allowed
+
+    def refund(self, kind: str, creditor_id: int, count: int = 1) -> None:
+        """Give back `count` tokens to creditor's bucket."""
+
+        capacity, refill_rate = self.params[kind]
+        key = (kind, creditor_id)
+
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                tokens, updated_at = bucket
+                self.buckets[key] = (min(capacity, tokens + count), updated_at)
+
+    def can_add_reconfigs(self, creditor_id: int) -> bool:
+        """Check whether reconfigs for the creditor can be accumulated
+        in memory.
+        """
+
+        with self.lock:
+            pending = self.pending_reconfigs
+            return creditor_id in pending or len(pending) < self.max_creditors
+
+    def add_reconfigs(self, creditor_id: int, count: int = 1) -> bool:
+        """Try to accumulate reconfigs in memory.
+
+        Returns `False` if reconfigs for too many creditors have
+        been accumulated already.
+        """
+
+        with self.lock:
+            pending = self.pending_reconfigs
+            pending_count = pending.get(creditor_id)
+            if pending_count is None:
+                if len(pending) >= self.max_creditors:
+                    return False
+                pending_count = 0
+
+            pending[creditor_id] = pending_count + count
+            return True
+
+    def take_reconfigs(self, max_creditors: int) -> Dict[int, int]:
+        """Remove and return accumulated reconfigs.
+
+        The returned dictionary maps creditor IDs to numbers of
+        reconfigs. It will contain at most `max_creditors` items.
+        """
+
+        with self.lock:
+            pending = self.pending_reconfigs
+            n = min(max_creditors, len(pending))
+            return dict(pending.popitem() for _ in range(n))
+
+    def restore_reconfigs(self, reconfigs: Dict[int, int]) -> None:
+        """Return reconfigs which could not be flushed."""
+
+        with self.lock:
+            pending = self.pending_reconfigs
+            for creditor_id, count in reconfigs.items():
+                pending[creditor_id] = pending.get(creditor_id, 0) + count
+
+
+def _get_token_buckets() -> Optional[TokenBuckets]:
+    config = current_app.config
+    if not config["APP_CREDITOR_DOS_BUCKETS"]:
+        return None
+
+    extensions = current_app.extensions
+    token_buckets = extensions.get(TOKEN_BUCKETS_EXTENSION)
+    if token_buckets is None:
+        token_buckets = extensions[TOKEN_BUCKETS_EXTENSION] = (
+            TokenBuckets(
+                max_reconfigs=config["APP_MAX_CREDITOR_RECONFIGS"],
+                max_initiations=config["APP_MAX_CREDITOR_INITIATIONS"],
+                clear_hours=config["APP_CREDITOR_DOS_STATS_CLEAR_HOURS"],
+                flush_seconds=config["APP_CREDITOR_DOS_BUCKETS_FLUSH_SECONDS"],
+                max_creditors=config["APP_CREDITOR_DOS_BUCKETS_MAX_CREDITORS"],
+            )
+        )
+        threading.Thread(
+            target=_flush_reconfigs_periodically,
+            args=(current_app._get_current_object(), token_buckets),
+            name="reconfigs-flusher",
+            daemon=True,
+        ).start()
+
+    return token_buckets
+
+
+def _flush_reconfigs(token_buckets: TokenBuckets) -> int:
+    reconfig_clear_hours = math.ceil(
+        current_app.config["APP_CREDITOR_DOS_STATS_CLEAR_HOURS"]
+    )
+    count = 0
+
+    while True:
+        reconfigs = token_buckets.take_reconfigs(RECONFIGS_FLUSH_CHUNK_SIZE)
+        if not reconfigs:
+            return count
+
+        try:
+            procedures.register_account_reconfigs(
+                reconfigs, reconfig_clear_hours
+            )
+        except Exception:
+            token_buckets.restore_reconfigs(reconfigs)
+            raise
+
+        count += len(reconfigs)
+
+
+def _flush_reconfigs_periodically(
+    app: Flask, token_buckets: TokenBuckets
+) -> None:
+    # NOTE: The thread stops when the token buckets get replaced.
+    while app.extensions.get(TOKEN_BUCKETS_EXTENSION) is token_buckets:
+        time.sleep(token_buckets.flush_seconds)
+        try:
+            with app.app_context():
+                _flush_reconfigs(token_buckets)
+        except Exception:
+            _LOGGER.exception("Caught error while flushing reconfigs.")
+
+
+def flush_reconfigs() -> int:
+    """Write the reconfigs accumulated in memory to the database.
+
+    Every chunk of creditors is written in its own transaction.
+    Returns the number of creditors whose usage stats were updated.
+    """
+
+    token_buckets = _get_token_buckets()
+    return _flush_reconfigs(token_buckets) if token_buckets else 0
+
+
+def _consume_tokens(kind: str, creditor_id: int, count: int = 1) -> None:
+    token_buckets = _get_token_buckets()
+    if token_buckets and not token_buckets.try_consume(
+        kind, creditor_id, count
+    ):
+        raise ForbiddenOperation
+
+
+def _refund_tokens(kind: str, creditor_id: int, count: int = 1) -> None:
+    token_buckets = _get_token_buckets()
+    if token_buckets and count > 0:
+        token_buckets.refund(kind, creditor_id, count)
+
+
+def _register_reconfigs(creditor_id: int, count: int = 1) -> None:
+    reconfig_clear_hours = math.ceil(
+        current_app.config["APP_CREDITOR_DOS_STATS_CLEAR_HOURS"]
+    )
+    token_buckets = _get_token_buckets()
+    if token_buckets is None or not token_buckets.can_add_reconfigs(
+        creditor_id
+    ):
+        procedures.register_account_reconfig(
+            creditor_id, reconfig_clear_hours, count=count
+        )
+        return
+
+    # NOTE: The reconfigs are accumulated only after the transaction
+    # has been committed. Otherwise, the reconfigs performed by
+    # transactions which have been rolled back (or retried) would be
+    # counted too. In the rare case that meanwhile reconfigs for too
+    # many creditors have been accumulated, the reconfigs will not be
+    # counted at all, which is in creditor's favour.
+    call_after_commit(
+        functools.partial(token_buckets.add_reconfigs, creditor_id, count)
+    )
+
+
 def allow_pin_change(creditor_id: int) -> None:
+    _consume_tokens(RECONFIGS, creditor_id)
     if not procedures.is_account_reconfig_allowed(
             creditor_id,
             current_app.config["APP_MAX_CREDITOR_RECONFIGS"],
     ):
+        _refund_tokens(RECONFIGS, creditor_id)
         raise ForbiddenOperation
 
 
 def register_pin_change(creditor_id: int) -> None:
-    procedures.register_account_reconfig(
+    _register_reconfigs(creditor_id)
+
+
+def allow_account_creation(creditor_id: int, debtor_id: int) -> None:
+    _consume_tokens(RECONFIGS, creditor_id)
+    if not procedures.is_account_creation_allowed(
+            creditor_id,
+            current_app.config["APP_MAX_CREDITOR_ACCOUNTS"],
+            current_app.config["APP_MAX_CREDITOR_RECONFIGS"],
+    ):
+        _refund_tokens(RECONFIGS, creditor_id)
+        raise ForbiddenOperation
+
+
+def register_account_creation(creditor_id: int, debtor_id: int) -> None:
+    procedures.register_account_creation(
         creditor_id,
         math.ceil(current_app.config["APP_CREDITOR_DOS_STATS_CLEAR_HOURS"]),
     )
 
 
-def allow_account_creation(creditor_id: int, debtor_id: int) -> None:
+def allow_accounts_creation(
+        creditor_id: int, debtor_ids: Collection[int]
+) -> None:
+    if not debtor_ids:
+        return
+
+    _consume_tokens(RECONFIGS, creditor_id, len(debtor_ids))
     if not procedures.is_account_creation_allowed(
             creditor_id,
             current_app.config["APP_MAX_CREDITOR_ACCOUNTS"],
             current_app.config["APP_MAX_CREDITOR_RECONFIGS"],
+            count=len(debtor_ids),
     ):
+        _refund_tokens(RECONFIGS, creditor_id, len(debtor_ids))
         raise ForbiddenOperation
 
 
-def register_account_creation(creditor_id: int, debtor_id: int) -> None:
+def register_accounts_creation(
+        creditor_id: int, debtor_ids: Collection[int]
+) -> None:
     procedures.register_account_creation(
         creditor_id,
         math.ceil(current_app.config["APP_CREDITOR_DOS_STATS_CLEAR_HOURS"]),
+        count=len(debtor_ids),
     )
 
 
 def allow_transfer_creation(creditor_id: int, debtor_id: int) -> None:
+    _consume_tokens(INITIATIONS, creditor_id)
     if not procedures.is_transfer_creation_allowed(
             creditor_id,
             current_app.config["APP_MAX_CREDITOR_TRANSFERS"],
             current_app.config["APP_MAX_CREDITOR_INITIATIONS"],
     ):
+        _refund_tokens(INITIATIONS, creditor_id)
         raise ForbiddenOperation
 
 
@@ -56,19 +352,45 @@ def register_transfer_creation(creditor_id: int, debtor_id: int) -> None:
     )
 
 
+def allow_transfers_creation(
+        creditor_id: int, debtor_ids: Collection[int]
+) -> None:
+    if not debtor_ids:
+        return
+
+    _consume_tokens(INITIATIONS, creditor_id, len(debtor_ids))
+    if not procedures.is_transfer_creation_allowed(
+            creditor_id,
+            current_app.config["APP_MAX_CREDITOR_TRANSFERS"],
+            current_app.config["APP_MAX_CREDITOR_INITIATIONS"],
+            count=len(debtor_ids),
+    ):
+        _refund_tokens(INITIATIONS, creditor_id, len(debtor_ids))
+        raise ForbiddenOperation
+
+
+def register_transfers_creation(
+        creditor_id: int, debtor_ids: Collection[int]
+) -> None:
+    procedures.register_transfer_creation(
+        creditor_id,
+        math.ceil(current_app.config["APP_CREDITOR_DOS_STATS_CLEAR_HOURS"]),
+        count=len(debtor_ids),
+    )
+
+
 def allow_account_reconfig(creditor_id: int, debtor_id: int) -> None:
+    _consume_tokens(RECONFIGS, creditor_id)
     if not procedures.is_account_reconfig_allowed(
             creditor_id,
             current_app.config["APP_MAX_CREDITOR_RECONFIGS"],
     ):
+        _refund_tokens(RECONFIGS, creditor_id)
         raise ForbiddenOperation
 
 
 def register_account_reconfig(creditor_id: int, debtor_id: int) -> None:
-    procedures.register_account_reconfig(
-        creditor_id,
-        math.ceil(current_app.config["APP_CREDITOR_DOS_STATS_CLEAR_HOURS"]),
-    )
+    _register_reconfigs(creditor_id)
 
 
 def increment_account_number(creditor_id: int, debtor_id: int) -> None:
@@ -85,3 +407,145 @@ def increment_transfer_number(creditor_id: int, debtor_id: int) -> None:
 
 def decrement_transfer_number(creditor_id: int, debtor_id: int) -> None:
     procedures.decrement_transfer_number(creditor_id)
+
+
+def change_pin(creditor_id: int, change: Callable[[], T]) -> T:
+    """Perform an inspected PIN change.
+
+    Unlike the functions below, this is not executed in a single
+    database transaction, because failed PIN attempts must be recorded
+    even when the PIN change fails.
+    """
+
+    allow_pin_change(creditor_id)
+    try:
+        result = change()
+    except Exception:
+        _refund_tokens(RECONFIGS, creditor_id)
+        raise
+
+    register_pin_change(creditor_id)
+    return result
+
+
+# NOTE: The functions below perform inspected operations. The DoS
+# check, the operation itself, and the update of the usage stats are
+# executed in a single database transaction. Therefore, in case of a
+# crash, the recorded usage stats will never differ from the real
+# ones. Note that PIN verification should not be executed inside
+# these transactions, because failed PIN attempts must be recorded
+# even when the operation fails. Also, the tokens taken from the
+# token buckets are given back for operations that fail, or turn out
+# to be no-ops, so that only the registered operations are charged.
+
+
+@atomic
+def create_account(creditor_id: int, debtor_id: int) -> Account:
+    allow_account_creation(creditor_id, debtor_id)
+    try:
+        account = procedures.create_new_account(creditor_id, debtor_id)
+        register_account_creation(creditor_id, debtor_id)
+    except Exception:
+        _refund_tokens(RECONFIGS, creditor_id)
+        raise
+
+    procedures.ensure_synchronous_commit()
+    return account
+
+
+@atomic
+def create_accounts(
+        creditor_id: int, debtor_ids: Sequence[int]
+) -> Dict[int, bool]:
+    unique_debtor_ids = set(debtor_ids)
+    allow_accounts_creation(creditor_id, unique_debtor_ids)
+    try:
+        created = procedures.create_new_accounts(creditor_id, debtor_ids)
+        created_debtor_ids = [d for d, x in created.items() if x]
+        register_accounts_creation(creditor_id, created_debtor_ids)
+    except Exception:
+        _refund_tokens(RECONFIGS, creditor_id, len(unique_debtor_ids))
+        raise
+
+    _refund_tokens(
+        RECONFIGS,
+        creditor_id,
+        len(unique_debtor_ids) - len(created_debtor_ids),
+    )
+    procedures.ensure_synchronous_commit()
+    return created
+
+
+@atomic
+def delete_account(creditor_id: int, debtor_id: int) -> None:
+    # NOTE: The usage stats are updated after the operation, so that
+    # the creditor's rows are always locked before the usage stats
+    # row. Otherwise, concurrent creations and deletions may deadlock.
+    procedures.delete_account(creditor_id, debtor_id)
+    decrement_account_number(creditor_id, debtor_id)
+    procedures.ensure_synchronous_commit()
+
+
+@atomic
+def reconfig_account(
+        creditor_id: int, debtor_id: int, reconfig: Callable[[], T]
+) -> T:
+    allow_account_reconfig(creditor_id, debtor_id)
+    try:
+        result = reconfig()
+        register_account_reconfig(creditor_id, debtor_id)
+    except Exception:
+        _refund_tokens(RECONFIGS, creditor_id)
+        raise
+
+    procedures.ensure_synchronous_commit()
+    return result
+
+
+@atomic
+def initiate_transfer(
+        creditor_id: int, debtor_id: int, **kwargs
+) -> RunningTransfer:
+    allow_transfer_creation(creditor_id, debtor_id)
+    try:
+        transfer = procedures.initiate_running_transfer(
+            creditor_id=creditor_id, debtor_id=debtor_id, **kwargs
+        )
+        register_transfer_creation(creditor_id, debtor_id)
+    except Exception:
+        _refund_tokens(INITIATIONS, creditor_id)
+        raise
+
+    procedures.ensure_synchronous_commit()
+    return transfer
+
+
+@atomic
+def initiate_transfers(
+        creditor_id: int, transfers: Sequence[dict]
+) -> Dict[UUID, bool]:
+    debtor_ids = {t["transfer_uuid"]: t["debtor_id"] for t in transfers}
+    allow_transfers_creation(creditor_id, list(debtor_ids.values()))
+    try:
+        created = procedures.initiate_running_transfers(
+            creditor_id, transfers
+        )
+        created_debtor_ids = [debtor_ids[u] for u, x in created.items() if x]
+        register_transfers_creation(creditor_id, created_debtor_ids)
+    except Exception:
+        _refund_tokens(INITIATIONS, creditor_id, len(debtor_ids))
+        raise
+
+    _refund_tokens(
+        INITIATIONS, creditor_id, len(debtor_ids) - len(created_debtor_ids)
+    )
+    procedures.ensure_synchronous_commit()
+    return created
+
+
+@atomic
+def delete_transfer(creditor_id: int, transfer_uuid: UUID) -> None:
+    # NOTE: See the note in `delete_account`.
+    procedures.delete_running_transfer(creditor_id, transfer_uuid)
+    decrement_transfer_number(creditor_id, transfer_uuid)
+    procedures.ensure_synchronous_commit()
@@ -1,10 +1,20 @@
 from __future__ import annotations
 import json
-from datetime import datetime, timezone
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, date, timezone
+from typing import Any, Callable, Iterable, List, Optional, Tuple
 from flask import current_app
+from marshmallow import fields
+from sqlalchemy import and_, column, delete, select, tuple_, values
 from swpt_creditors.extensions import db, publisher
 from swpt_pythonlib import rabbitmq
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 MIN_INT16 = -1 << 15
 MAX_INT16 = (1 << 15) - 1
 MIN_INT32 = -1 << 31
@@ -40,19 +50,452 @@ def is_valid_creditor_id(creditor_id: int, match_parent=False) -> bool:
     )
 
 
+def _get_creditor_id_validator() -> Callable[..., bool]:
+    """Return a function equivalent to `is_valid_creditor_id`, which
+    does not read the app configuration on every call.
+    """
+    sharding_realm = current_app.config["SHARDING_REALM"]
+    min_creditor_id = current_app.config["MIN_CREDITOR_ID"]
+    max_creditor_id = current_app.config["MAX_CREDITOR_ID"]
+
+    def validator(creditor_id: int, match_parent=False) -> bool:
+        return (
+            min_creditor_id <= creditor_id <= max_creditor_id
+            and sharding_realm.match(creditor_id, match_parent=match_parent)
+        )
+
+    return validator
+
+
+_JSON_ENCODER = json.JSONEncoder(
+    ensure_ascii=False,
+    check_circular=False,
+    allow_nan=False,
+    separators=(",", ":"),
+)
+
+
+def _json_encode_compact(data: dict) -> bytes:
+    return _JSON_ENCODER.encode(data).encode("utf8")
+
+
+def _format_int(value: Any) -> Optional[int]:
+    return None if value is None else int(value)
+
+
+def _format_float(value: Any) -> Optional[float]:
+    return None if value is None else float(value)
+
+
+def _format_str(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _format_datetime(value: Any) -> Optional[str]:
+    return None if value is None else value.isoformat()
+
+
+def _format_date(value: Any) -> Optional[str]:
+    return None if value is None else date.isoformat(value)
+
+
+class SignalMessageEncoder:
+    """Creates RabbitMQ messages for a given signal model.
+
+    The marshmallow schema of the signal model is inspected only once,
+    producing a list of (JSON key, attribute name, formatter) triples,
+    which is then used to encode the message bodies. The produced
+    message bodies are byte-identical to the ones produced by
+    `Signal._create_message`, but the encoding is several times
+    faster. The encoded objects can be model instances, or any other
+    objects that have the same attributes (SQLAlchemy result rows, for
+    example).
+
+    When the `orjson` library is installed, it will be used to
+    serialize the bodies of messages that do not contain float
+    numbers. (`orjson` and the standard `json` module serialize floats
+    differently.)
+    """
+
+    def __init__(self, model: type[Signal]):
+        schema = model.__marshmallow_schema__
+        self.exchange_name: str = model.exchange_name
+        self.get_routing_key: Callable[[Any], str] = model.routing_key.fget
+
+        # NOTE: For constant fields, the attribute name is `None`, and
+        # the constant value is stored instead of a formatter.
+        self.fields: List[Tuple[str, Optional[str], Any]] = []
+        constants = {}
+        has_floats = False
+
+        for field_name, field in schema.dump_fields.items():
+            key = field.data_key or field_name
+            attr = field.attribute or field_name
+            if isinstance(field, fields.Constant):
+                self.fields.append((key, None, field.constant))
+                constants[key] = field.constant
+                continue
+            elif isinstance(field, fields.Integer):
+                formatter = _format_int
+            elif isinstance(field, fields.Float):
+                formatter = _format_float
+                has_floats = True
+            elif isinstance(field, fields.String):
+                formatter = _format_str
+            elif isinstance(field, fields.Date):
+                formatter = _format_date
+            elif isinstance(field, fields.DateTime):
+                formatter = _format_datetime
+            else:  # pragma: no cover
+                raise TypeError(
+                    f"Unsupported field type: {type(field).__name__}"
+                )
+            self.fields.append((key, attr, formatter))
+
+        self.message_type: str = constants["type"]
+        self.coordinator_type: Optional[str] = constants.get(
+            "coordinator_type"
+        )
+        self.has_coordinator_id = any(
+            key == "coordinator_id" for key, _, _ in self.fields
+        )
+        self.is_mandatory = self.message_type == "FinalizeTransfer"
+        self.checks_creditor_id = self.message_type != "RejectedConfig"
+        self.encode_body: Callable[[dict], bytes] = (
+            orjson.dumps
+            if orjson is not None and not has_floats
+            else _json_encode_compact
+        )
+
+        # NOTE: The message headers and properties are created by
+        # copying these templates, and then filling in only the fields
+        # that change from message to message. This is cheaper than
+        # building them from scratch for every message.
+        self.headers_template: dict = {
+            "message-type": self.message_type,
+            "debtor-id": None,
+            "creditor-id": None,
+        }
+        if self.has_coordinator_id:
+            self.headers_template["coordinator-id"] = None
+            self.headers_template["coordinator-type"] = self.coordinator_type
+
+        self.properties_template = rabbitmq.MessageProperties(
+            delivery_mode=2,
+            app_id="swpt_creditors",
+            content_type="application/json",
+            type=self.message_type,
+        )
+
+    def encode_data(self, obj: Any) -> dict:
+        """Return the dictionary that `Signal._create_message` would
+        serialize as the message body.
+        """
+        return {
+            key: value if attr is None else value(getattr(obj, attr))
+            for key, attr, value in self.fields
+        }
+
+    def encode_messages(
+        self, objects: Iterable[Any]
+    ) -> List[rabbitmq.Message]:
+        """Return a list of messages for the passed objects.
+
+        Messages that are left-overs from the splitting of the parent
+        shard will be omitted.
+        """
+        is_valid_creditor_id = _get_creditor_id_validator()
+        delete_parent_shard_records = current_app.config[
+            "DELETE_PARENT_SHARD_RECORDS"
+        ]
+        exchange_name = self.exchange_name
+        get_routing_key = self.get_routing_key
+        encode_data = self.encode_data
+        encode_body = self.encode_body
+        headers_template = self.headers_template
+        properties_cls = type(self.properties_template)
+        properties_attrs = vars(self.properties_template)
+        has_coordinator_id = self.has_coordinator_id
+        checks_creditor_id = self.checks_creditor_id
+        is_mandatory = self.is_mandatory
+        Message = rabbitmq.Message
+        new_object = object.__new__
+        messages = []
+
+        for obj in objects:
+            data = encode_data(obj)
+            creditor_id = data["creditor_id"]
+            debtor_id = data["debtor_id"]
+
+            if checks_creditor_id and not is_valid_creditor_id(creditor_id):
+                if delete_parent_shard_records and is_valid_creditor_id(
+                    creditor_id, match_parent=True
+                ):
+                    continue
+                raise RuntimeError(
+                    "The agent is not responsible for this creditor."
+                )
+
+            headers = headers_template.copy()
+            headers["debtor-id"] = debtor_id
+            headers["creditor-id"] = creditor_id
+            if has_coordinator_id:
+                headers["coordinator-id"] = data["coordinator_id"]
+
+            properties = new_object(properties_cls)
+            properties.__dict__.update(properties_attrs)
+            properties.headers = headers
+
+            messages.append(
+                Message(
+                    exchange=exchange_name,
+                    routing_key=get_routing_key(obj),
+                    body=encode_body(data),
+                    properties=properties,
+                    mandatory=is_mandatory,
+                )
+            )
+
+        return messages
+
+
+_MESSAGE_ENCODERS: dict = {}
+_publishing_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_publishing_executor() -> ThreadPoolExecutor:
+    # NOTE: The publishing thread is created only once, and is reused,
+    # so that it can keep its connection to the message broker open.
+    global _publishing_executor
+    if _publishing_executor is None:
+        _publishing_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="publisher"
+        )
+    return _publishing_executor
+
+
 class Signal(db.Model):
     __abstract__ = True
 
+    # When set to the name of a primary key column, newer signals
+    # supersede older ones: For each combination of values in the
+    # other primary key columns, only the signal with the biggest
+    # value in this column needs to be sent. (See `_coalesce_rows`.)
+    coalescing_column: Optional[str] = None
+
+    @classmethod
+    def get_message_encoder(cls) -> SignalMessageEncoder:
+        encoder = _MESSAGE_ENCODERS.get(cls)
+        if encoder is None:
+            encoder = _MESSAGE_ENCODERS[cls] = SignalMessageEncoder(cls)
+        return encoder
+
     @classmethod
     def send_signalbus_messages(cls, objects):  # pragma: no cover
         assert all(isinstance(obj, cls) for obj in objects)
-        messages = (obj._create_message() for obj in objects)
-        publisher.publish_messages([m for m in messages if m is not None])
+        messages = cls.get_message_encoder().encode_messages(objects)
+        publisher.publish_messages(messages)
 
     def send_signalbus_message(self):  # pragma: no cover
         self.send_signalbus_messages([self])
 
+    @classmethod
+    def _get_bulk_delete_statement(cls, burst_count: int):
+        table = cls.__table__
+        pk_columns = list(table.primary_key.columns)
+        return (
+            delete(table)
+            .where(
+                tuple_(*pk_columns).in_(
+                    select(*pk_columns)
+                    .limit(burst_count)
+                    .with_for_update(skip_locked=True)
+                )
+            )
+            .returning(*table.columns)
+        )
+
+    @classmethod
+    def _coalesce_rows(cls, connection, rows: list) -> list:
+        """Return only the rows that are not superseded by other rows.
+
+        Also, pending signals that are superseded by the passed rows
+        will be deleted (unless they are locked by another process).
+        """
+        if not (
+            rows
+            and cls.coalescing_column
+            and current_app.config["APP_FLUSH_COALESCE"]
+        ):
+            return rows
+
+        table = cls.__table__
+        pk_columns = list(table.primary_key.columns)
+        coalescing_column = table.c[cls.coalescing_column]
+        key_columns = [c for c in pk_columns if c is not coalescing_column]
+        key_names = [c.name for c in key_columns]
+        seqnum_name = coalescing_column.name
+        latest = {}
+
+        for row in rows:
+            key = tuple(getattr(row, name) for name in key_names)
+            other = latest.get(key)
+            if other is None or (
+                getattr(row, seqnum_name) > getattr(other, seqnum_name)
+            ):
+                latest[key] = row
+
+        latest_values = (
+            values(*[column(c.name, c.type) for c in pk_columns], name="v")
+            .data(
+                [
+                    tuple(getattr(row, c.name) for c in pk_columns)
+                    for row in latest.values()
+                ]
+            )
+        )
+        superseded = (
+            select(*pk_columns)
+            .join(
+                latest_values,
+                and_(
+                    *[table.c[n] == latest_values.c[n] for n in key_names],
+                    coalescing_column < latest_values.c[seqnum_name],
+                ),
+            )
+            .with_for_update(of=table, skip_locked=True)
+        )
+        connection.execute(
+            delete(table).where(tuple_(*pk_columns).in_(superseded))
+        )
+        return list(latest.values())
+
+    @classmethod
+    def flush_burst(cls, message_publisher=None) -> list:
+        """Send and delete one burst of pending signals, without
+        loading ORM instances.
+
+        The burst is deleted with "DELETE ... RETURNING", and messages
+        are encoded directly from the returned rows. The deleted rows
+        are selected with "FOR UPDATE SKIP LOCKED", so that several
+        processes can flush the same table at the same time. Returns
+        the deleted rows.
+        """
+        if message_publisher is None:
+            message_publisher = publisher
+
+        statement = cls._get_bulk_delete_statement(cls.signalbus_burst_count)
+        try:
+            rows = db.session.execute(statement).all()
+            if rows:
+                message_publisher.publish_messages(
+                    cls.get_message_encoder().encode_messages(
+                        cls._coalesce_rows(db.session, rows)
+                    )
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        return rows
+
+    @classmethod
+    def flush_bulk(cls, message_publisher=None) -> int:
+        """Send and delete all pending signals, burst by burst (see
+        `flush_burst`). Returns the number of deleted rows.
+        """
+        burst_count = cls.signalbus_burst_count
+        count = 0
+
+        while True:
+            n = len(cls.flush_burst(message_publisher))
+            count += n
+            if n < burst_count:
+                return count
+
+    @classmethod
+    def flush_pipelined(cls, message_publisher=None, max_pending=2) -> int:
+        """Send and delete all pending signals, overlapping the
+        database reads with the waiting for publisher confirms.
+
+        This works like `flush_bulk`, but every burst is deleted in
+        its own database connection, and is published (and then
+        committed) by a separate thread. Meanwhile, the next burst is
+        read and encoded. The transaction that deletes a burst is
+        committed only after the broker has confirmed all of its
+        messages. At most `max_pending` bursts will be awaiting
+        confirmation at the same time. Returns the number of deleted
+        rows.
+        """
+        if message_publisher is None:
+            message_publisher = publisher
+
+        app = current_app._get_current_object()
+        burst_count = cls.signalbus_burst_count
+        statement = cls._get_bulk_delete_statement(burst_count)
+        encoder = cls.get_message_encoder()
+        pending: deque[Future] = deque()
+        count = 0
+
+        def publish_and_commit(connection, messages):
+            try:
+                with app.app_context():
+                    message_publisher.publish_messages(messages)
+                connection.commit()
+            finally:
+                connection.close()
+
+        executor = _get_publishing_executor()
+        try:
+            while True:
+                connection = db.engine.connect()
+                try:
+                    rows = connection.execute(statement).all()
+                    messages = encoder.encode_messages(
+                        cls._coalesce_rows(connection, rows)
+                    )
+                except Exception:
+                    connection.close()
+                    raise
+
+                if rows:
+                    pending.append(
+                        executor.submit(
+                            publish_and_commit, connection, messages
+                        )
+                    )
+                else:
+                    connection.close()
+
+                count += len(rows)
+                if len(rows) < burst_count:
+                    break
+
+                while len(pending) >= max_pending:
+                    pending.popleft().result()
+
+            while pending:
+                pending.popleft().result()
+
+        except Exception:
+            # Let the remaining bursts finish (or fail) before
+            # re-raising the error. The transactions of failed
+            # bursts are rolled back when their connections are
+            # closed.
+            for future in pending:
+                future.exception()
+            raise
+
+        return count
+
     def _create_message(self):  # pragma: no cover
+        """Create a message using the signal's marshmallow schema.
+
+        This is the reference implementation for the (much faster)
+        `SignalMessageEncoder`. It is not used for sending messages,
+        but is useful for testing.
+        """
         data = self.__marshmallow_schema__.dump(self)
         message_type = data["type"]
         creditor_id = data["creditor_id"]
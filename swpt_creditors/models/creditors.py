@@ -484,6 +484,36 @@ class LogEntry(BaseLogEntry):
     )
 
 
+class PendingCreditorPurge(db.Model):
+    creditor_id = db.Column(
+        db.BigInteger, primary_key=True, autoincrement=False
+    )
+    added_at = db.Column(
+        db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc
+    )
+    deleted_accounts_count = db.Column(
+        db.BigInteger, nullable=False, default=0
+    )
+    deleted_transfers_count = db.Column(
+        db.BigInteger, nullable=False, default=0
+    )
+    __table_args__ = (
+        db.ForeignKeyConstraint(
+            ["creditor_id"], ["creditor.creditor_id"], ondelete="CASCADE"
+        ),
+        db.CheckConstraint(deleted_accounts_count >= 0),
+        db.CheckConstraint(deleted_transfers_count >= 0),
+        {
+            "comment": (
+                "Represents a deactivated creditor whose accounts and running"
+                " transfers have not been deleted yet. Because a creditor can"
+                " have lots of accounts, they are deleted in the background,"
+                " in many small database transactions."
+            ),
+        },
+    )
+
+
 class UsageStats(db.Model):
     creditor_id = db.Column(
         db.BigInteger, primary_key=True, autoincrement=False
@@ -50,6 +50,14 @@ class ConfigureAccountSignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_CONFIGURE_ACCOUNTS_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_CONFIGURE_ACCOUNTS_PERIOD"]
+
+    @classproperty
+    def signalbus_flush_priority(self):
+        return current_app.config["APP_FLUSH_CONFIGURE_ACCOUNTS_PRIORITY"]
+
 
 class PrepareTransferSignal(Signal):
     exchange_name = CREDITORS_OUT_EXCHANGE
@@ -94,6 +102,14 @@ class PrepareTransferSignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_PREPARE_TRANSFERS_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_PREPARE_TRANSFERS_PERIOD"]
+
+    @classproperty
+    def signalbus_flush_priority(self):
+        return current_app.config["APP_FLUSH_PREPARE_TRANSFERS_PRIORITY"]
+
 
 class FinalizeTransferSignal(Signal):
     exchange_name = CREDITORS_OUT_EXCHANGE
@@ -131,6 +147,14 @@ class FinalizeTransferSignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_FINALIZE_TRANSFERS_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_FINALIZE_TRANSFERS_PERIOD"]
+
+    @classproperty
+    def signalbus_flush_priority(self):
+        return current_app.config["APP_FLUSH_FINALIZE_TRANSFERS_PRIORITY"]
+
 
 class UpdatedLedgerSignal(Signal):
     """Notifies about a change in account's principal balance.
@@ -143,6 +167,7 @@ class UpdatedLedgerSignal(Signal):
     """
 
     exchange_name = TO_TRADE_EXCHANGE
+    coalescing_column = "update_id"
 
     class __marshmallow__(Schema):
         type = fields.Constant("UpdatedLedger")
@@ -174,6 +199,14 @@ class UpdatedLedgerSignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_UPDATED_LEDGER_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_UPDATED_LEDGER_PERIOD"]
+
+    @classproperty
+    def signalbus_flush_priority(self):
+        return current_app.config["APP_FLUSH_UPDATED_LEDGER_PRIORITY"]
+
 
 class UpdatedPolicySignal(Signal):
     """Notifies about a change in account's automatic exchange policy.
@@ -183,6 +216,7 @@ class UpdatedPolicySignal(Signal):
     """
 
     exchange_name = TO_TRADE_EXCHANGE
+    coalescing_column = "update_id"
 
     class __marshmallow__(Schema):
         type = fields.Constant("UpdatedPolicy")
@@ -216,6 +250,14 @@ class UpdatedPolicySignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_UPDATED_POLICY_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_UPDATED_POLICY_PERIOD"]
+
+    @classproperty
+    def signalbus_flush_priority(self):
+        return current_app.config["APP_FLUSH_UPDATED_POLICY_PRIORITY"]
+
 
 class UpdatedFlagsSignal(Signal):
     """Notifies about a change in account's configuration flags.
@@ -225,6 +267,7 @@ class UpdatedFlagsSignal(Signal):
     """
 
     exchange_name = TO_TRADE_EXCHANGE
+    coalescing_column = "update_id"
 
     class __marshmallow__(Schema):
         type = fields.Constant("UpdatedFlags")
@@ -250,6 +293,14 @@ class UpdatedFlagsSignal(Signal):
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_UPDATED_FLAGS_BURST_COUNT"]
 
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_UPDATED_FLAGS_PERIOD"]
+
+    @classproperty
+    def signalbus_flush_priority(self):
+        return current_app.config["APP_FLUSH_UPDATED_FLAGS_PRIORITY"]
+
 
 class RejectedConfigSignal(Signal):
     """NOTE: For `ConfigureAccount` messages that can not be routed to
@@ -294,3 +345,11 @@ class RejectedConfigSignal(Signal):
     @classproperty
     def signalbus_burst_count(self):
         return current_app.config["APP_FLUSH_REJECTED_CONFIGS_BURST_COUNT"]
+
+    @classproperty
+    def signalbus_flush_period(self):
+        return current_app.config["APP_FLUSH_REJECTED_CONFIGS_PERIOD"]
+
+    @classproperty
+    def signalbus_flush_priority(self):
+        return current_app.config["APP_FLUSH_REJECTED_CONFIGS_PRIORITY"]
@@ -1,7 +1,7 @@
 from datetime import datetime, timezone
-from typing import TypeVar, Callable, List, Optional
+from typing import TypeVar, Callable, List, Optional, Iterable, Dict
 from sqlalchemy.orm import joinedload
-from sqlalchemy.sql.expression import null
+from sqlalchemy.sql.expression import null, insert
 from swpt_pythonlib.utils import increment_seqnum
 from swpt_creditors.extensions import db
 from swpt_creditors.models import (
@@ -14,6 +14,7 @@ from swpt_creditors.models import (
     AccountKnowledge,
     AccountExchange,
     LedgerEntry,
+    LogEntry,
     PendingLogEntry,
     Creditor,
     DEFAULT_NEGLIGIBLE_AMOUNT,
@@ -105,6 +106,55 @@ def create_new_account(creditor_id: int, debtor_id: int) -> Account:
     return account
 
 
+@atomic
+def create_new_accounts(
+    creditor_id: int, debtor_ids: Iterable[int]
+) -> Dict[int, bool]:
+    """Create many accounts for one creditor, in one transaction.
+
+    Returns a dictionary which maps each of the given debtor IDs to
+    whether a new account has been created for it (`False` means that
+    the account already existed).
+
+    """
+
+    current_ts = datetime.now(tz=timezone.utc)
+    debtor_ids = list(dict.fromkeys(debtor_ids))
+
+    creditor = get_active_creditor(creditor_id, lock=True)
+    if creditor is None:
+        raise errors.CreditorDoesNotExist()
+
+    existing_debtor_ids = {
+        t[0]
+        for t in db.session.query(Account.debtor_id)
+        .filter(Account.creditor_id == creditor_id)
+        .filter(Account.debtor_id.in_(debtor_ids))
+        .all()
+    }
+    new_debtor_ids = [
+        x for x in debtor_ids if x not in existing_debtor_ids
+    ]
+    if new_debtor_ids:
+        _insert_accounts(creditor, new_debtor_ids, current_ts)
+        db.session.execute(
+            insert(ConfigureAccountSignal),
+            [
+                {
+                    "debtor_id": debtor_id,
+                    "creditor_id": creditor_id,
+                    "ts": current_ts,
+                    "seqnum": 0,
+                    "negligible_amount": DEFAULT_NEGLIGIBLE_AMOUNT,
+                    "config_flags": DEFAULT_CONFIG_FLAGS,
+                }
+                for debtor_id in new_debtor_ids
+            ],
+        )
+
+    return {x: x not in existing_debtor_ids for x in debtor_ids}
+
+
 @atomic
 def delete_account(creditor_id: int, debtor_id: int) -> None:
     current_ts = datetime.now(tz=timezone.utc)
@@ -560,6 +610,79 @@ def _insert_account(
     return account
 
 
+def _insert_accounts(
+    creditor: Creditor, debtor_ids: List[int], current_ts: datetime
+) -> None:
+    # NOTE: This does the same as calling `_insert_account` for each
+    # of the debtor IDs, but uses bulk inserts, and adds only one
+    # "AccountsList" log entry for all the accounts.
+    creditor_id = creditor.creditor_id
+    rows = [
+        {
+            "creditor_id": creditor_id,
+            "debtor_id": debtor_id,
+            "latest_update_ts": current_ts,
+        }
+        for debtor_id in debtor_ids
+    ]
+    account_update_ids = dict(
+        db.session.execute(
+            insert(Account).returning(
+                Account.debtor_id, Account.latest_update_id
+            ),
+            [{**row, "created_at": current_ts} for row in rows],
+        ).all()
+    )
+    db.session.execute(
+        insert(AccountData),
+        [
+            {
+                "creditor_id": creditor_id,
+                "debtor_id": debtor_id,
+                "last_config_ts": current_ts,
+                "last_config_seqnum": 0,
+                "config_latest_update_ts": current_ts,
+                "info_latest_update_ts": current_ts,
+                "ledger_latest_update_ts": current_ts,
+                "ledger_last_entry_id": (
+                    creditor.largest_historic_ledger_entry_id + 1
+                ),  # a gap
+            }
+            for debtor_id in debtor_ids
+        ],
+    )
+    for model in [AccountKnowledge, AccountExchange, AccountDisplay]:
+        db.session.execute(insert(model), rows)
+
+    paths, types = get_paths_and_types()
+    log_entries = [
+        {
+            "creditor_id": creditor_id,
+            "entry_id": creditor.generate_log_entry_id(),
+            "object_type": types.account,
+            "object_uri": paths.account(
+                creditorId=creditor_id, debtorId=debtor_id
+            ),
+            "object_update_id": account_update_ids[debtor_id],
+            "added_at": current_ts,
+        }
+        for debtor_id in debtor_ids
+    ]
+    creditor.accounts_list_latest_update_id += 1
+    creditor.accounts_list_latest_update_ts = current_ts
+    log_entries.append(
+        {
+            "creditor_id": creditor_id,
+            "entry_id": creditor.generate_log_entry_id(),
+            "object_type": types.accounts_list,
+            "object_uri": paths.accounts_list(creditorId=creditor_id),
+            "object_update_id": creditor.accounts_list_latest_update_id,
+            "added_at": current_ts,
+        }
+    )
+    db.session.execute(insert(LogEntry), log_entries)
+
+
 def _log_account_deletion(
     creditor: Creditor, debtor_id: int, current_ts: datetime
 ) -> None:
@@ -1,9 +1,23 @@
-from typing import TypeVar, Callable, List, Tuple, Optional, Iterable
+import hmac
+import time
+from random import randint
+from base64 import urlsafe_b64encode
+from typing import (
+    TypeVar,
+    Callable,
+    List,
+    Dict,
+    Tuple,
+    Optional,
+    Iterable,
+    Iterator,
+)
 from datetime import datetime, timezone, timedelta
 from flask import current_app
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.sql.expression import func, text
+from sqlalchemy.sql.expression import func, text, select
 from sqlalchemy.orm import joinedload
+from sqlalchemy.dialects import postgresql
 from swpt_creditors.extensions import db
 from swpt_creditors.models import (
     MIN_INT64,
@@ -13,6 +27,7 @@ from swpt_creditors.models import (
     Creditor,
     LogEntry,
     PendingLogEntry,
+    PendingCreditorPurge,
     PinInfo,
     Account,
     RunningTransfer,
@@ -49,12 +64,43 @@ CALL_IS_TRANSFER_CREATION_ALLOWED = text(
 CALL_REGISTER_ACCOUNT_CREATION = text(
     "SELECT register_account_creation(:creditor_id, :reconfig_clear_hours)"
 )
+CALL_REGISTER_ACCOUNT_CREATIONS = text(
+    "SELECT register_account_creation(:creditor_id, :reconfig_clear_hours)"
+    " FROM generate_series(1, :count)"
+)
 CALL_REGISTER_ACCOUNT_RECONFIG = text(
     "SELECT register_account_reconfig(:creditor_id, :reconfig_clear_hours)"
 )
+ADD_ACCOUNT_RECONFIGS = text(
+    "UPDATE usage_stats"
+    " SET"
+    " reconfigs_count = ("
+    "CASE WHEN e.current_epoch < reconfigs_reset_at"
+    " THEN LEAST(reconfigs_count + CAST(:count AS INTEGER), 32767)"
+    " ELSE LEAST(CAST(:count AS INTEGER), 32767) END"
+    "),"
+    " reconfigs_reset_at = ("
+    "CASE WHEN e.current_epoch < reconfigs_reset_at"
+    " THEN reconfigs_reset_at"
+    " ELSE e.current_epoch + :reconfig_clear_hours END"
+    ")"
+    " FROM ("
+    "SELECT CAST("
+    "floor(EXTRACT(EPOCH FROM CURRENT_TIMESTAMP) / 3600.0) AS INTEGER"
+    ") AS current_epoch"
+    ") AS e"
+    " WHERE creditor_id = :creditor_id"
+)
 CALL_REGISTER_TRANSFER_CREATION = text(
     "SELECT register_transfer_creation(:creditor_id, :initiations_clear_hours)"
 )
+CALL_REGISTER_TRANSFER_CREATIONS = text(
+    "SELECT register_transfer_creation(:creditor_id, :initiations_clear_hours)"
+    " FROM generate_series(1, :count)"
+)
+SET_DEFAULT_SYNCHRONOUS_COMMIT = text(
+    "SET LOCAL synchronous_commit TO DEFAULT"
+)
 CALL_INCREMENT_ACCOUNT_NUMBER = text(
     "SELECT increment_account_number(:creditor_id)"
 )
@@ -70,6 +116,95 @@ CALL_DECREMENT_TRANSFER_NUMBER = text(
 CALL_PROCESS_PENDING_LOG_ENTRIES = text(
     "SELECT process_pending_log_entries(:creditor_id)"
 )
+LOG_ENTRY_COPIED_COLUMNS = [
+    "object_type",
+    "object_uri",
+    "object_update_id",
+    "added_at",
+    "is_deleted",
+    "data",
+    *sorted(LogEntry.AUX_FIELDS),
+    *sorted(LogEntry.DATA_FIELDS),
+]
+
+# NOTE: For every pending log entry which informs about the creation
+# or the deletion of a transfer, an additional "TransfersList" update
+# log entry must be inserted right after it. The `tl` column tells
+# whether this is the case, and the running sum of `tl` determines
+# the IDs of the inserted log entries.
+#
+# IMPORTANT: The creditor's row must be locked before executing this
+# statement. Otherwise, two concurrent transactions could pick
+# disjoint sets of pending log entries, and the one which happens to
+# update the creditor first would get the lower log entry IDs, even
+# if its pending log entries came later. The range of log entry IDs
+# is reserved by the `UPDATE creditor` sub-statement. Holding the row
+# lock until the commit is what guarantees that readers will never
+# see "holes" in the sequence of log entry IDs, which get filled
+# later. When the creditor does not exist, the pending log entries
+# are just deleted.
+MOVE_PENDING_LOG_ENTRIES = text(
+    "WITH deleted AS ("
+    " DELETE FROM pending_log_entry"
+    " WHERE creditor_id = :creditor_id AND pending_entry_id IN ("
+    "  SELECT pending_entry_id FROM pending_log_entry"
+    "  WHERE creditor_id = :creditor_id"
+    "  FOR UPDATE SKIP LOCKED"
+    " )"
+    " RETURNING *"
+    "), flagged AS ("
+    " SELECT *, CASE WHEN"
+    "  (object_type = :transfer_type"
+    "   OR (object_type IS NULL AND object_type_hint = :oth_transfer))"
+    "  AND (object_update_id IS NULL OR object_update_id = 1 OR is_deleted)"
+    "  THEN 1 ELSE 0 END AS tl"
+    " FROM deleted"
+    "), positioned AS ("
+    " SELECT *,"
+    "  row_number() OVER w + sum(tl) OVER w - tl AS n,"
+    "  sum(tl) OVER w AS tl_n"
+    " FROM flagged"
+    " WINDOW w AS (ORDER BY pending_entry_id ROWS UNBOUNDED PRECEDING)"
+    "), totals AS ("
+    " SELECT"
+    "  count(*) + coalesce(sum(tl), 0) AS entries_count,"
+    "  coalesce(sum(tl), 0) AS tl_count,"
+    "  (array_agg(added_at ORDER BY pending_entry_id DESC)"
+    "   FILTER (WHERE tl = 1))[1] AS tl_added_at"
+    " FROM positioned"
+    "), allocated AS ("
+    " UPDATE creditor SET"
+    "  last_log_entry_id = last_log_entry_id + totals.entries_count,"
+    "  transfers_list_latest_update_id ="
+    "   transfers_list_latest_update_id + totals.tl_count,"
+    "  transfers_list_latest_update_ts ="
+    "   coalesce(totals.tl_added_at, transfers_list_latest_update_ts)"
+    " FROM totals"
+    " WHERE creditor_id = :creditor_id AND totals.entries_count > 0"
+    " RETURNING"
+    "  last_log_entry_id - totals.entries_count AS first_id,"
+    "  transfers_list_latest_update_id - totals.tl_count AS tl_first_id"
+    "), inserted AS ("
+    " INSERT INTO log_entry (creditor_id, entry_id, "
+    + ", ".join(LOG_ENTRY_COPIED_COLUMNS)
+    + ")"
+    " SELECT creditor_id, first_id + n, "
+    + ", ".join(LOG_ENTRY_COPIED_COLUMNS)
+    + " FROM positioned, allocated"
+    " UNION ALL"
+    " SELECT creditor_id, first_id + n + 1, "
+    + ", ".join(
+        {
+            "object_update_id": "tl_first_id + tl_n",
+            "added_at": "added_at",
+            "object_type_hint": ":oth_transfers_list",
+        }.get(column, "NULL")
+        for column in LOG_ENTRY_COPIED_COLUMNS
+    )
+    + " FROM positioned, allocated WHERE tl = 1"
+    ")"
+    " SELECT entries_count FROM totals"
+)
 
 
 def verify_pin_value(
@@ -89,6 +224,54 @@ def verify_pin_value(
         raise errors.WrongPinValue()
 
 
+def create_pin_session(
+    creditor_id: int,
+    *,
+    secret: str,
+    pin_value: Optional[str],
+    pin_failures_reset_interval: timedelta,
+    max_age_seconds: float
+) -> Tuple[str, datetime]:
+    is_pin_value_ok, latest_update_id = create_pin_session_helper(
+        creditor_id,
+        secret=secret,
+        pin_value=pin_value,
+        pin_failures_reset_interval=pin_failures_reset_interval,
+    )
+    if not is_pin_value_ok:
+        raise errors.WrongPinValue()
+
+    expires_at = int(time.time() + max_age_seconds)
+    signature = _calc_pin_session_signature(
+        secret, creditor_id, latest_update_id, expires_at
+    )
+    token = f"{latest_update_id}.{expires_at}.{signature}"
+
+    return token, datetime.fromtimestamp(expires_at, tz=timezone.utc)
+
+
+def verify_pin_session(creditor_id: int, token: str, *, secret: str) -> bool:
+    try:
+        update_id_str, expires_at_str, signature = token.split(".")
+        latest_update_id = int(update_id_str)
+        expires_at = int(expires_at_str)
+    except ValueError:
+        return False
+
+    if expires_at <= time.time():
+        return False
+
+    if not hmac.compare_digest(
+        signature,
+        _calc_pin_session_signature(
+            secret, creditor_id, latest_update_id, expires_at
+        ),
+    ):
+        return False
+
+    return verify_pin_session_helper(creditor_id, latest_update_id)
+
+
 def update_pin_info(
     creditor_id: int,
     *,
@@ -141,6 +324,34 @@ def get_creditor_ids(
     return creditor_ids, next_creditor_id
 
 
+def iter_creditor_ids(
+    start_from: int, chunk_size: int = 10000
+) -> Iterator[List[int]]:
+    """Iterate over the IDs of all active creditors, in chunks.
+
+    The IDs are sorted, starting from `start_from`. They are fetched
+    with a server-side cursor, so that enumerating millions of
+    creditors does not require a query per page, nor holding all the
+    IDs in memory. The caller is responsible for ending the
+    transaction when the iteration is finished.
+
+    """
+
+    assert chunk_size >= 1
+    result = db.session.execute(
+        select(Creditor.creditor_id)
+        .where(Creditor.creditor_id >= start_from)
+        .where(
+            Creditor.status_flags.op("&")(ACTIVATION_STATUS_MASK)
+            == Creditor.STATUS_IS_ACTIVATED_FLAG
+        )
+        .order_by(Creditor.creditor_id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for partition in result.partitions():
+        yield [row[0] for row in partition]
+
+
 @atomic
 def reserve_creditor(creditor_id) -> Creditor:
     creditor = Creditor(creditor_id=creditor_id)
@@ -162,6 +373,106 @@ def reserve_creditor(creditor_id) -> Creditor:
     return creditor
 
 
+@atomic
+def reserve_creditors(
+    creditor_ids: Iterable[int], activate: bool = False
+) -> list:
+    """Try to reserve (and optionally activate) many creditors at once.
+
+    Creditor IDs that already exist are silently skipped. Returns a
+    list of rows (with `creditor_id`, `reservation_id`, and
+    `created_at` attributes) for the created creditors.
+
+    """
+
+    creditor_ids = list(set(creditor_ids))
+    if not creditor_ids:
+        return []
+
+    # NOTE: When a creditor has been deleted, and then created again,
+    # the log entry IDs must continue from where they were left (see
+    # `reserve_creditor`).
+    relic_log_entry_ids = dict(
+        db.session.query(LogEntry.creditor_id, func.max(LogEntry.entry_id))
+        .filter(LogEntry.creditor_id.in_(creditor_ids))
+        .group_by(LogEntry.creditor_id)
+        .all()
+    )
+    if activate:
+        extra_values = {
+            "status_flags": Creditor.STATUS_IS_ACTIVATED_FLAG,
+            "reservation_id": None,
+        }
+    else:
+        extra_values = {}
+
+    rows = db.session.execute(
+        postgresql.insert(Creditor.__table__)
+        .values(
+            [
+                {
+                    "creditor_id": creditor_id,
+                    "last_log_entry_id": (
+                        0
+                        if creditor_id not in relic_log_entry_ids
+                        else relic_log_entry_ids[creditor_id] + 1
+                    ),
+                    **extra_values,
+                }
+                for creditor_id in creditor_ids
+            ]
+        )
+        .on_conflict_do_nothing()
+        .returning(
+            Creditor.creditor_id,
+            Creditor.reservation_id,
+            Creditor.created_at,
+        )
+    ).all()
+
+    if activate and rows:
+        db.session.execute(
+            postgresql.insert(PinInfo.__table__).values(
+                [{"creditor_id": row.creditor_id} for row in rows]
+            )
+        )
+
+    return rows
+
+
+@atomic
+def reserve_random_creditors(
+    count: int,
+    *,
+    min_creditor_id: int,
+    max_creditor_id: int,
+    activate: bool = False,
+    chunk_size: int = 1000
+) -> list:
+    """Reserve (and optionally activate) `count` random creditor IDs.
+
+    All reservations are made in a single database transaction, in
+    chunks of up to `chunk_size` IDs. In the very unlikely case that
+    not enough unique creditor IDs can be generated, less than
+    `count` rows will be returned (see `reserve_creditors`).
+
+    """
+
+    rows = []
+    failed_attempts = 0
+    while len(rows) < count and failed_attempts < 100:
+        creditor_ids = [
+            randint(min_creditor_id, max_creditor_id)
+            for _ in range(min(count - len(rows), chunk_size))
+        ]
+        chunk_rows = reserve_creditors(creditor_ids, activate=activate)
+        if not chunk_rows:  # pragma: no cover
+            failed_attempts += 1
+        rows.extend(chunk_rows)
+
+    return rows
+
+
 @atomic
 def activate_creditor(creditor_id: int, reservation_id: str) -> Creditor:
     creditor = _get_creditor(creditor_id, lock=True)
@@ -187,8 +498,69 @@ def deactivate_creditor(creditor_id: int) -> None:
     if creditor:
         creditor.deactivate()
         _delete_creditor_pin_info(creditor_id)
-        _delete_creditor_accounts(creditor_id)
-        _delete_creditor_running_transfers(creditor_id)
+
+        # NOTE: The creditor may have lots of accounts and running
+        # transfers. To avoid huge transactions, they will be deleted
+        # later, in small chunks (see `process_pending_creditor_purge`).
+        db.session.add(PendingCreditorPurge(creditor_id=creditor_id))
+
+
+@atomic
+def get_pending_creditor_purges(
+    max_count: int = None,
+) -> List[Tuple[int]]:
+    query = db.session.query(PendingCreditorPurge.creditor_id)
+    if max_count is not None:
+        query = query.limit(max_count)
+
+    return query.all()
+
+
+@atomic
+def process_pending_creditor_purge(
+    creditor_id: int, *, burst_count: int
+) -> bool:
+    """Delete some of the accounts and running transfers of a
+    deactivated creditor.
+
+    This function will not try to delete more than `burst_count`
+    accounts, and more than `burst_count` running transfers. When
+    some of them remained undeleted, `False` will be returned. In this
+    case the function should be called again, and again, until it
+    returns `True`.
+
+    """
+
+    purge = (
+        PendingCreditorPurge.query.filter_by(creditor_id=creditor_id)
+        .with_for_update(skip_locked=True)
+        .one_or_none()
+    )
+    if purge is None:
+        # The purge has been completed, or is being processed by
+        # another worker at the moment.
+        return True
+
+    # NOTE: Locking the creditor prevents races with `delete_account`.
+    _get_creditor(creditor_id, lock=True)
+
+    deleted_accounts_count = _delete_creditor_accounts(
+        creditor_id, max_count=burst_count
+    )
+    deleted_transfers_count = _delete_creditor_running_transfers(
+        creditor_id, max_count=burst_count
+    )
+    purge.deleted_accounts_count += deleted_accounts_count
+    purge.deleted_transfers_count += deleted_transfers_count
+
+    if (
+        deleted_accounts_count < burst_count
+        and deleted_transfers_count < burst_count
+    ):
+        db.session.delete(purge)
+        return True
+
+    return False
 
 
 @atomic
@@ -299,6 +671,76 @@ def process_pending_log_entries(creditor_id: int) -> None:
         )
         return
 
+    db.session.query(Creditor.creditor_id).filter_by(
+        creditor_id=creditor_id
+    ).with_for_update(key_share=True).one_or_none()
+    _move_pending_log_entries(creditor_id)
+
+
+@atomic
+def process_pending_log_entries_batch(creditor_ids: List[int]) -> List[int]:
+    """Process the pending log entries of many creditors at once.
+
+    All the given creditors will be processed in a single database
+    transaction. The creditors are locked in the order of their IDs,
+    and creditors that are currently locked by other transactions are
+    skipped. Returns the (sorted) list of skipped creditor IDs.
+
+    """
+
+    creditor_ids = sorted(set(creditor_ids))
+    locked_ids = {
+        row.creditor_id
+        for row in db.session.query(Creditor.creditor_id)
+        .filter(Creditor.creditor_id.in_(creditor_ids))
+        .order_by(Creditor.creditor_id)
+        .with_for_update(key_share=True, skip_locked=True)
+        .all()
+    }
+    not_locked_ids = [x for x in creditor_ids if x not in locked_ids]
+    skipped_ids = (
+        {
+            row.creditor_id
+            for row in db.session.query(Creditor.creditor_id)
+            .filter(Creditor.creditor_id.in_(not_locked_ids))
+            .all()
+        }
+        if not_locked_ids
+        else set()
+    )
+    use_pgplsql_functions = current_app.config["APP_USE_PGPLSQL_FUNCTIONS"]
+
+    for creditor_id in creditor_ids:
+        if creditor_id in skipped_ids:
+            continue
+        if use_pgplsql_functions:  # pragma: no cover
+            db.session.execute(
+                CALL_PROCESS_PENDING_LOG_ENTRIES,
+                {"creditor_id": creditor_id},
+            )
+        else:
+            _move_pending_log_entries(creditor_id)
+
+    return sorted(skipped_ids)
+
+
+def _move_pending_log_entries(creditor_id: int) -> int:
+    paths, types = get_paths_and_types()
+    return db.session.execute(
+        MOVE_PENDING_LOG_ENTRIES,
+        {
+            "creditor_id": creditor_id,
+            "transfer_type": types.transfer,
+            "oth_transfer": LogEntry.OTH_TRANSFER,
+            "oth_transfers_list": LogEntry.OTH_TRANSFERS_LIST,
+        },
+    ).scalar_one()
+
+
+def _process_pending_log_entries_one_by_one(creditor_id: int) -> None:
+    # NOTE: This is the original, row-by-row implementation of
+    # `process_pending_log_entries`. It is easier to understand, and
+    # is used as a reference in the tests and the benchmarks.
     creditor = _get_creditor(creditor_id, lock=True)
     pending_log_entries = (
         PendingLogEntry.query.filter_by(creditor_id=creditor_id)
@@ -310,6 +752,55 @@ def process_pending_log_entries(creditor_id: int) -> None:
         _process_pending_log_entry(creditor, entry)
 
 
+def ensure_synchronous_commit() -> None:
+    """Make sure that the current transaction will be committed
+    synchronously.
+
+    The stored procedures that update the usage stats turn off the
+    synchronous commit for the current transaction. This is fine when
+    they are called in a separate transaction, but must be undone when
+    they are called in the same transaction as the inspected operation.
+
+    """
+
+    db.session.execute(SET_DEFAULT_SYNCHRONOUS_COMMIT)
+
+
+@atomic
+def create_pin_session_helper(
+    creditor_id: int,
+    *,
+    secret: str,
+    pin_value: Optional[str],
+    pin_failures_reset_interval: timedelta
+) -> Tuple[bool, int]:
+    pin_info = get_pin_info(creditor_id)
+    if pin_info is None:
+        raise errors.CreditorDoesNotExist()
+
+    is_pin_value_ok = pin_info.try_value(
+        pin_value, secret, pin_failures_reset_interval
+    )
+    return is_pin_value_ok, pin_info.latest_update_id
+
+
+@atomic
+def verify_pin_session_helper(creditor_id: int, latest_update_id: int) -> bool:
+    # NOTE: The session gets invalidated when the PIN info is
+    # updated, or when the PIN is blocked. This is a cheap
+    # primary-key lookup, which does not lock or write anything.
+    row = db.session.execute(
+        select(PinInfo.latest_update_id, PinInfo.status)
+        .where(PinInfo.creditor_id == creditor_id)
+    ).one_or_none()
+
+    return (
+        row is not None
+        and row.latest_update_id == latest_update_id
+        and row.status != PinInfo.STATUS_BLOCKED
+    )
+
+
 @atomic
 def verify_pin_value_helper(
     creditor_id: int,
@@ -330,14 +821,19 @@ def is_account_creation_allowed(
     creditor_id: int,
     max_accounts: int,
     max_reconfigs: int,
+    count: int = 1,
 ) -> bool:
+    assert count >= 1
+
+    # NOTE: Creating `count` accounts is allowed when creating one
+    # account would be allowed with the limits reduced by `count - 1`.
     return (
         db.session.execute(
             CALL_IS_ACCOUNT_CREATION_ALLOWED,
             {
                 "creditor_id": creditor_id,
-                "max_accounts": max_accounts,
-                "max_reconfigs": max_reconfigs,
+                "max_accounts": max_accounts - count + 1,
+                "max_reconfigs": max_reconfigs - count + 1,
             },
         )
         .scalar()
@@ -366,14 +862,19 @@ def is_transfer_creation_allowed(
     creditor_id: int,
     max_transfers: int,
     max_initiations: int,
+    count: int = 1,
 ) -> bool:
+    assert count >= 1
+
+    # NOTE: Creating `count` transfers is allowed when creating one
+    # transfer would be allowed with the limits reduced by `count - 1`.
     return (
         db.session.execute(
             CALL_IS_TRANSFER_CREATION_ALLOWED,
             {
                 "creditor_id": creditor_id,
-                "max_transfers": max_transfers,
-                "max_initiations": max_initiations,
+                "max_transfers": max_transfers - count + 1,
+                "max_initiations": max_initiations - count + 1,
             },
         )
         .scalar()
@@ -381,36 +882,89 @@ def is_transfer_creation_allowed(
 
 
 @atomic
-def register_account_creation(creditor_id: int, reconfig_clear_hours: int):
-    db.session.execute(
-        CALL_REGISTER_ACCOUNT_CREATION,
-        {
-            "creditor_id": creditor_id,
-            "reconfig_clear_hours": reconfig_clear_hours,
-        },
-    )
+def register_account_creation(
+    creditor_id: int, reconfig_clear_hours: int, count: int = 1
+):
+    if count == 1:
+        db.session.execute(
+            CALL_REGISTER_ACCOUNT_CREATION,
+            {
+                "creditor_id": creditor_id,
+                "reconfig_clear_hours": reconfig_clear_hours,
+            },
+        )
+    elif count > 1:
+        db.session.execute(
+            CALL_REGISTER_ACCOUNT_CREATIONS,
+            {
+                "creditor_id": creditor_id,
+                "reconfig_clear_hours": reconfig_clear_hours,
+                "count": count,
+            },
+        )
 
 
 @atomic
-def register_account_reconfig(creditor_id: int, reconfig_clear_hours: int):
-    db.session.execute(
-        CALL_REGISTER_ACCOUNT_RECONFIG,
-        {
+def register_account_reconfig(
+    creditor_id: int, reconfig_clear_hours: int, count: int = 1
+):
+    if count == 1:
+        db.session.execute(
+            CALL_REGISTER_ACCOUNT_RECONFIG,
+            {
+                "creditor_id": creditor_id,
+                "reconfig_clear_hours": reconfig_clear_hours,
+            },
+        )
+    elif count > 1:
+        params = {
             "creditor_id": creditor_id,
             "reconfig_clear_hours": reconfig_clear_hours,
-        },
-    )
+            "count": count,
+        }
+        if db.session.execute(ADD_ACCOUNT_RECONFIGS, params).rowcount == 0:
+            # NOTE: The creditor does not have a usage stats row yet.
+            # The stored procedure will create it (if the creditor
+            # exists), and then the remaining reconfigs will be added.
+            db.session.execute(CALL_REGISTER_ACCOUNT_RECONFIG, params)
+            db.session.execute(
+                ADD_ACCOUNT_RECONFIGS, {**params, "count": count - 1}
+            )
 
 
 @atomic
-def register_transfer_creation(creditor_id: int, initiations_clear_hours: int):
-    db.session.execute(
-        CALL_REGISTER_TRANSFER_CREATION,
-        {
-            "creditor_id": creditor_id,
-            "initiations_clear_hours": initiations_clear_hours,
-        },
-    )
+def register_account_reconfigs(
+    reconfigs: Dict[int, int], reconfig_clear_hours: int
+) -> None:
+    # NOTE: The rows are updated in the order of the creditor IDs, so
+    # as to avoid deadlocks.
+    for creditor_id, count in sorted(reconfigs.items()):
+        register_account_reconfig(
+            creditor_id, reconfig_clear_hours, count=count
+        )
+
+
+@atomic
+def register_transfer_creation(
+    creditor_id: int, initiations_clear_hours: int, count: int = 1
+):
+    if count == 1:
+        db.session.execute(
+            CALL_REGISTER_TRANSFER_CREATION,
+            {
+                "creditor_id": creditor_id,
+                "initiations_clear_hours": initiations_clear_hours,
+            },
+        )
+    elif count > 1:
+        db.session.execute(
+            CALL_REGISTER_TRANSFER_CREATIONS,
+            {
+                "creditor_id": creditor_id,
+                "initiations_clear_hours": initiations_clear_hours,
+                "count": count,
+            },
+        )
 
 
 @atomic
@@ -521,6 +1075,14 @@ def _add_log_entry(creditor: Creditor, **kwargs) -> None:
     )
 
 
+def _calc_pin_session_signature(
+    secret: str, creditor_id: int, latest_update_id: int, expires_at: int
+) -> str:
+    value = f"pin-session:{creditor_id}:{latest_update_id}:{expires_at}"
+    digest = PinInfo.calc_hmac(secret, value)
+    return urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+
 def _delete_creditor_pin_info(creditor_id: int) -> None:
     PinInfo.query.filter_by(creditor_id=creditor_id).delete(
         synchronize_session=False
@@ -568,11 +1130,13 @@ def _stop_account_trade(
     ))
 
 
-def _delete_creditor_accounts(creditor_id: int) -> None:
+def _delete_creditor_accounts(creditor_id: int, max_count: int) -> int:
     current_ts = datetime.now(tz=timezone.utc)
     object_update_id = db.session.scalar(uid_seq)
     accounts = (
         Account.query.filter_by(creditor_id=creditor_id)
+        .order_by(Account.debtor_id)
+        .limit(max_count)
         .with_for_update()
         .all()
     )
@@ -582,8 +1146,23 @@ def _delete_creditor_accounts(creditor_id: int) -> None:
         )
         db.session.delete(account)
 
+    return len(accounts)
 
-def _delete_creditor_running_transfers(creditor_id: int) -> None:
-    RunningTransfer.query.filter_by(creditor_id=creditor_id).delete(
-        synchronize_session=False
-    )
+
+def _delete_creditor_running_transfers(
+    creditor_id: int, max_count: int
+) -> int:
+    transfer_uuids = [
+        row.transfer_uuid
+        for row in db.session.query(RunningTransfer.transfer_uuid)
+        .filter(RunningTransfer.creditor_id == creditor_id)
+        .limit(max_count)
+        .all()
+    ]
+    if transfer_uuids:
+        RunningTransfer.query.filter(
+            RunningTransfer.creditor_id == creditor_id,
+            RunningTransfer.transfer_uuid.in_(transfer_uuids),
+        ).delete(synchronize_session=False)
+
+    return len(transfer_uuids)
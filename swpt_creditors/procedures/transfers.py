@@ -1,8 +1,9 @@
 from uuid import UUID
 from math import floor
 from datetime import datetime, timezone, date, timedelta
-from typing import TypeVar, Callable, Optional, List
+from typing import TypeVar, Callable, Optional, List, Dict, Sequence
 from sqlalchemy.orm import exc
+from sqlalchemy.sql.expression import insert
 from sqlalchemy.dialects import postgresql
 from swpt_creditors.extensions import db
 from swpt_creditors.models import (
@@ -136,6 +137,109 @@ def initiate_running_transfer(
     return new_running_transfer
 
 
+@atomic
+def initiate_running_transfers(
+    creditor_id: int, transfers: Sequence[dict]
+) -> Dict[UUID, bool]:
+    """Initiate many transfers for one creditor, in one transaction.
+
+    Each element of `transfers` is a dictionary containing the keyword
+    arguments that `initiate_running_transfer` accepts (without
+    `creditor_id`). Returns a dictionary which maps each of the given
+    transfer UUIDs to whether a new transfer has been initiated for it
+    (`False` means that an identical transfer already existed). Raises
+    `UpdateConflict` if an existing transfer (or another transfer in
+    the same batch) has the same UUID, but different data.
+
+    """
+
+    current_ts = datetime.now(tz=timezone.utc)
+
+    creditor = get_active_creditor(creditor_id)
+    if creditor is None:
+        raise errors.CreditorDoesNotExist()
+
+    transfer_data_by_uuid: Dict[UUID, dict] = {}
+    for transfer in transfers:
+        transfer_data = {
+            "deadline": None,
+            "final_interest_rate_ts": T_INFINITY,
+            "locked_amount": 0,
+            **transfer,
+        }
+        transfer_uuid = transfer_data.pop("transfer_uuid")
+        if transfer_data_by_uuid.setdefault(
+            transfer_uuid, transfer_data
+        ) != transfer_data:
+            raise errors.UpdateConflict()
+
+    existing_transfers = RunningTransfer.query.filter(
+        RunningTransfer.creditor_id == creditor_id,
+        RunningTransfer.transfer_uuid.in_(transfer_data_by_uuid),
+    ).all()
+    for rt in existing_transfers:
+        transfer_data = transfer_data_by_uuid[rt.transfer_uuid]
+        if any(
+            getattr(rt, attr) != value for attr, value in transfer_data.items()
+        ):
+            raise errors.UpdateConflict()
+
+    existing_uuids = {rt.transfer_uuid for rt in existing_transfers}
+    new_running_transfers = [
+        RunningTransfer(
+            creditor_id=creditor_id,
+            transfer_uuid=transfer_uuid,
+            latest_update_ts=current_ts,
+            **transfer_data,
+        )
+        for transfer_uuid, transfer_data in transfer_data_by_uuid.items()
+        if transfer_uuid not in existing_uuids
+    ]
+    if new_running_transfers:
+        # NOTE: The new running transfers are inserted with a single
+        # multi-row INSERT statement, which returns the generated
+        # coordinator request IDs.
+        with db.retry_on_integrity_error():
+            db.session.add_all(new_running_transfers)
+
+        # NOTE: The log entries that inform about the change in the
+        # creditor's `TransfersList` will be added later, when these
+        # pending log entries are processed.
+        db.session.execute(
+            insert(PendingLogEntry),
+            [
+                {
+                    "creditor_id": creditor_id,
+                    "added_at": current_ts,
+                    "object_type_hint": LogEntry.OTH_TRANSFER,
+                    "transfer_uuid": rt.transfer_uuid,
+                    "object_update_id": 1,
+                }
+                for rt in new_running_transfers
+            ],
+        )
+        db.session.execute(
+            insert(PrepareTransferSignal),
+            [
+                {
+                    "creditor_id": creditor_id,
+                    "coordinator_request_id": rt.coordinator_request_id,
+                    "debtor_id": rt.debtor_id,
+                    "recipient": rt.recipient,
+                    "locked_amount": rt.locked_amount,
+                    "final_interest_rate_ts": rt.final_interest_rate_ts,
+                    "max_commit_delay": _calc_max_commit_delay(
+                        current_ts, rt.deadline
+                    ),
+                    "inserted_at": current_ts,
+                }
+                for rt in new_running_transfers
+            ],
+        )
+
+    return {x: x not in existing_uuids for x in transfer_data_by_uuid}
+
+
 @atomic
 def cancel_running_transfer(
     creditor_id: int, transfer_uuid: UUID
@@ -219,10 +323,12 @@ def process_account_transfer_signal(
     ts: datetime,
     previous_transfer_number: int,
     retention_interval: timedelta
-) -> None:
+) -> bool:
+    # NOTE: Returns `True` if the transfer has been recorded (either
+    # now, or by an earlier call), and `False` if it has been ignored.
     current_ts = datetime.now(tz=timezone.utc)
     if (current_ts - min(ts, committed_at)) > retention_interval:
-        return
+        return False
 
     committed_transfer_query = CommittedTransfer.query.filter_by(
         debtor_id=debtor_id,
@@ -231,7 +337,7 @@ def process_account_transfer_signal(
         transfer_number=transfer_number,
     )
     if db.session.query(committed_transfer_query.exists()).scalar():
-        return
+        return True
 
     # NOTE: We must obtain a "FOR SHARE" lock here to ensure that the
     # `ledger_last_transfer_number` will not be increased by another
@@ -248,7 +354,7 @@ def process_account_transfer_signal(
     try:
         ledger_date, ledger_last_transfer_number = ledger_data_query.one()
     except exc.NoResultFound:
-        return
+        return False
 
     with db.retry_on_integrity_error():
         db.session.add(
@@ -286,6 +392,8 @@ def process_account_transfer_signal(
     ):
         ensure_pending_ledger_update(creditor_id, debtor_id)
 
+    return True
+
 
 @atomic
 def process_rejected_direct_transfer_signal(
@@ -0,0 +1,303 @@
+"""Replaying of dead-lettered messages.
+
+The messages which the consumer rejects end up in the "<queue>.XQ"
+RabbitMQ stream (see the `subscribe` command). Republishing millions
+of such messages one by one is very slow. Instead, the
+`MessageReplayer` class validates the messages again, and feeds them
+directly to the actors, executing many actors in a single database
+transaction.
+"""
+
+import time
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+from flask import Flask
+from swpt_creditors.extensions import db
+from swpt_creditors.actors import parse_message, is_responsible_for
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class ReplayStats:
+    read_count: int = 0
+    invalid_count: int = 0
+    skipped_count: int = 0
+    processed_count: int = 0
+    failed_count: int = 0
+    last_offset: Optional[int] = None
+
+    # All messages before this offset have been processed, so that the
+    # replay can be safely resumed from it.
+    resume_offset: Optional[int] = None
+    type_counts: Counter = field(default_factory=Counter)
+
+
+def get_death_time(properties) -> Optional[datetime]:
+    """Return the time at which the message has been dead-lettered."""
+
+    headers = getattr(properties, "headers", None) or {}
+    try:
+        death_time = headers["x-death"][0]["time"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+    if not isinstance(death_time, datetime):
+        return None
+
+    if death_time.tzinfo is None:
+        death_time = death_time.replace(tzinfo=timezone.utc)
+
+    return death_time
+
+
+def read_stream(
+    channel,
+    queue: str,
+    *,
+    offset,
+    prefetch_count: int = 1000,
+    idle_timeout: float = 5.0,
+) -> Iterable[Tuple[int, object, bytes]]:
+    """Read messages from a RabbitMQ stream, starting from the given
+    `offset`, until no messages arrive for `idle_timeout` seconds.
+
+    Yields (stream_offset, properties, body) tuples. The `offset` can
+    be "first", "last", "next", an integer, or a `datetime`.
+    """
+
+    channel.basic_qos(prefetch_count=prefetch_count)
+    try:
+        for method, properties, body in channel.consume(
+            queue,
+            inactivity_timeout=idle_timeout,
+            arguments={"x-stream-offset": offset},
+        ):
+            if method is None:
+                break
+
+            # NOTE: Acknowledging a message does not remove it from
+            # the stream, but is required for the flow control.
+            channel.basic_ack(method.delivery_tag)
+            headers = properties.headers or {}
+            yield headers.get("x-stream-offset"), properties, body
+    finally:
+        channel.cancel()
+
+
+class MessageReplayer:
+    """Validates messages, and passes them to the actors in batches.
+
+    Messages are distributed between a fixed number of lanes
+    (`threads`) according to the creditor ID, so that all messages
+    for a given creditor are processed sequentially, in a single
+    lane. Every lane executes the actors for up to `batch_size`
+    messages in one database transaction. If the transaction fails,
+    the messages in the batch are processed one by one.
+
+    Because the lanes work independently, the messages are not
+    processed in the order in which they have been read. The
+    `resume_offset` statistics shows the offset before which all
+    messages have been processed.
+
+    In `dry_run` mode, the messages are only validated and counted.
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        *,
+        threads: int = 1,
+        batch_size: int = 1000,
+        message_types: Optional[Set[str]] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        dry_run: bool = False,
+        log_interval: float = 10.0,
+    ):
+        assert threads > 0
+        assert batch_size > 0
+        self.app = app
+        self.batch_size = batch_size
+        self.message_types = message_types
+        self.since = since
+        self.until = until
+        self.dry_run = dry_run
+        self.log_interval = log_interval
+        self.stats = ReplayStats()
+        self.lock = threading.Lock()
+        self.started_at = self.logged_at = time.monotonic()
+        self.batches: List[list] = [[] for _ in range(threads)]
+        self.batch_offsets: List[Optional[int]] = [None] * threads
+        self.pending: List[List[Tuple[Optional[int], Future]]] = [
+            [] for _ in range(threads)
+        ]
+        self.next_offset: Optional[int] = None
+        self.executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="replay")
+            for _ in range(threads)
+        ]
+
+    def add(self, body: bytes, properties, offset=None) -> bool:
+        """Add a message for processing.
+
+        Returns `False` if the end of the requested time range has
+        been reached.
+        """
+        stats = self.stats
+        stats.read_count += 1
+        stats.last_offset = offset
+
+        death_time = get_death_time(properties)
+        if death_time is not None:
+            if self.until is not None and death_time >= self.until:
+                return False
+            if self.since is not None and death_time < self.since:
+                stats.skipped_count += 1
+                self._advance(offset)
+                return True
+
+        message_type = getattr(properties, "type", None)
+        if (
+            self.message_types is not None
+            and message_type not in self.message_types
+        ):
+            stats.skipped_count += 1
+            self._advance(offset)
+            return True
+
+        parsed_message = parse_message(body, properties)
+        if parsed_message is None:
+            stats.invalid_count += 1
+            self._advance(offset)
+            return True
+
+        message_type, actor, message_content = parsed_message
+        if not is_responsible_for(message_type, message_content):
+            stats.skipped_count += 1
+            self._advance(offset)
+            return True
+
+        stats.type_counts[message_type] += 1
+        if self.dry_run:
+            stats.processed_count += 1
+        else:
+            lane = hash(message_content["creditor_id"]) % len(self.batches)
+            batch = self.batches[lane]
+            if not batch:
+                self.batch_offsets[lane] = offset
+            batch.append((actor, message_content))
+            if len(batch) >= self.batch_size:
+                self._submit(lane)
+
+        self._advance(offset)
+        self._log_progress()
+        return True
+
+    def finish(self) -> ReplayStats:
+        """Process the remaining messages, and return the statistics."""
+
+        for lane in range(len(self.batches)):
+            if self.batches[lane]:
+                self._submit(lane)
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+        for pending in self.pending:
+            for _, future in pending:
+                future.result()
+
+        self._log_progress(force=True)
+        return self.stats
+
+    def _submit(self, lane: int) -> None:
+        batch = self.batches[lane]
+        batch_offset = self.batch_offsets[lane]
+        self.batches[lane] = []
+        self.batch_offsets[lane] = None
+        pending = self.pending[lane]
+
+        # NOTE: Do not read messages much faster than they can be
+        # processed. Every lane can have at most two batches waiting.
+        while len(pending) >= 2:
+            pending.pop(0)[1].result()
+
+        future = self.executors[lane].submit(self._process, batch)
+        pending.append((batch_offset, future))
+
+    def _advance(self, offset) -> None:
+        if offset is not None:
+            self.next_offset = offset + 1
+
+    def _calc_resume_offset(self) -> Optional[int]:
+        # NOTE: The first message in the oldest unfinished batch of
+        # each lane limits the offset from which the replay can be
+        # safely resumed.
+        offsets = [x for x in self.batch_offsets if x is not None]
+        for pending in self.pending:
+            offsets.extend(
+                x for x, f in pending if x is not None and not f.done()
+            )
+        return min(offsets) if offsets else self.next_offset
+
+    def _process(self, batch: List[Tuple[Callable, dict]]) -> None:
+        with self.app.app_context():
+            try:
+                _process_batch(batch)
+            except Exception:
+                _LOGGER.warning(
+                    "Failed to process a batch of %i messages in a single"
+                    " transaction. Processing them one by one.",
+                    len(batch),
+                    exc_info=True,
+                )
+
+                processed_count = 0
+                for actor, message_content in batch:
+                    try:
+                        actor(**message_content)
+                    except Exception:
+                        _LOGGER.exception(
+                            "Failed to process a message: %r",
+                            message_content,
+                        )
+                    else:
+                        processed_count += 1
+            else:
+                processed_count = len(batch)
+
+        with self.lock:
+            self.stats.processed_count += processed_count
+            self.stats.failed_count += len(batch) - processed_count
+
+    def _log_progress(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if force or now - self.logged_at >= self.log_interval:
+            self.logged_at = now
+            stats = self.stats
+            stats.resume_offset = self._calc_resume_offset()
+            elapsed = max(now - self.started_at, 1e-6)
+            _LOGGER.info(
+                "Replay progress: resume_offset=%s read=%i processed=%i"
+                " failed=%i invalid=%i skipped=%i rate=%.0f/s",
+                stats.resume_offset,
+                stats.read_count,
+                stats.processed_count,
+                stats.failed_count,
+                stats.invalid_count,
+                stats.skipped_count,
+                stats.read_count / elapsed,
+            )
+
+
+@db.atomic
+def _process_batch(batch: List[Tuple[Callable, dict]]) -> None:
+    # NOTE: The procedures called by the actors are atomic too, but
+    # when they are called inside an atomic block, they join the
+    # outer transaction.
+    for actor, message_content in batch:
+        actor(**message_content)
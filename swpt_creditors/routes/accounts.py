@@ -1,8 +1,8 @@
+from functools import partial
 from urllib.parse import urlsplit, urljoin
-from datetime import timedelta
 from werkzeug.routing import RequestRedirect
 from werkzeug.exceptions import NotFound, MethodNotAllowed
-from flask import current_app, redirect, url_for, request, g
+from flask import current_app, redirect, url_for, request
 from flask.views import MethodView
 from flask_smorest import abort
 from swpt_pythonlib.utils import i64_to_u64, u64_to_i64
@@ -14,6 +14,8 @@ from swpt_pythonlib.swpt_uris import (
 from swpt_creditors.schemas import (
     examples,
     DebtorIdentitySchema,
+    AccountsCreationRequestSchema,
+    AccountsCreationResultSchema,
     AccountIdentitySchema,
     AccountSchema,
     AccountConfigSchema,
@@ -29,7 +31,12 @@ from swpt_creditors.schemas import (
 )
 from swpt_creditors import procedures
 from swpt_creditors import inspect_ops
-from .common import context, ensure_creditor_permissions, Blueprint
+from .common import (
+    context,
+    ensure_creditor_permissions,
+    verify_pin,
+    Blueprint,
+)
 from .specs import DID, CID
 from . import specs
 
@@ -229,8 +236,7 @@ class AccountsEndpoint(MethodView):
             debtorId=debtorId,
         )
         try:
-            inspect_ops.allow_account_creation(creditorId, debtorId)
-            account = procedures.create_new_account(creditorId, debtorId)
+            account = inspect_ops.create_account(creditorId, debtorId)
         except inspect_ops.ForbiddenOperation:  # pragma: no cover
             abort(403)
         except procedures.CreditorDoesNotExist:
@@ -238,10 +244,72 @@ class AccountsEndpoint(MethodView):
         except procedures.AccountExists:
             return redirect(location, code=303)
 
-        inspect_ops.register_account_creation(creditorId, debtorId)
         return account, {"Location": location}
 
 
+@accounts_api.route("/<i64:creditorId>/create-accounts", parameters=[CID])
+class AccountsCreationEndpoint(MethodView):
+    @accounts_api.arguments(AccountsCreationRequestSchema)
+    @accounts_api.response(200, AccountsCreationResultSchema(context=context))
+    @accounts_api.doc(
+        operationId="createAccounts",
+        security=specs.SCOPE_ACCESS_MODIFY,
+        responses={403: specs.FORBIDDEN_OPERATION},
+    )
+    def post(self, accounts_creation_request, creditorId):
+        """Create many accounts at once.
+
+        This is equivalent to calling the `createAccount` operation
+        for each of the given debtors, but all accounts are created
+        in a single transaction. Either all of the requested accounts
+        are created, or none of them.
+
+        **Note:** This is an idempotent operation.
+
+        """
+
+        debtors = accounts_creation_request["debtors"]
+        debtor_ids = []
+        for i, debtor_identity in enumerate(debtors):
+            try:
+                debtor_ids.append(parse_debtor_uri(debtor_identity["uri"]))
+            except ValueError:
+                abort(
+                    422,
+                    errors={
+                        "json": {
+                            "debtors": {
+                                i: {"uri": ["The URI can not be recognized."]}
+                            }
+                        }
+                    },
+                )
+
+        try:
+            created = inspect_ops.create_accounts(creditorId, debtor_ids)
+        except inspect_ops.ForbiddenOperation:
+            abort(403)
+        except procedures.CreditorDoesNotExist:
+            abort(404)
+
+        return {
+            "items": [
+                {
+                    "debtor": {"uri": debtor_identity["uri"]},
+                    "account": {
+                        "uri": url_for(
+                            "accounts.AccountEndpoint",
+                            creditorId=creditorId,
+                            debtorId=debtor_id,
+                        )
+                    },
+                    "created": created[debtor_id],
+                }
+                for debtor_identity, debtor_id in zip(debtors, debtor_ids)
+            ],
+        }
+
+
 @accounts_api.route(
     "/<i64:creditorId>/accounts/<i64:debtorId>/", parameters=[CID, DID]
 )
@@ -294,11 +362,8 @@ class AccountEndpoint(MethodView):
 
         """
 
-        deleted = False
-        inspect_ops.decrement_account_number(creditorId, debtorId)
         try:
-            procedures.delete_account(creditorId, debtorId)
-            deleted = True
+            inspect_ops.delete_account(creditorId, debtorId)
         except procedures.UnsafeAccountDeletion:
             abort(403)
         except procedures.ForbiddenPegDeletion:
@@ -308,17 +373,6 @@ class AccountEndpoint(MethodView):
             procedures.AccountDoesNotExist,
         ):
             return
-        finally:
-            # NOTE: We decremented the account number before trying to
-            # delete the account. Now if the deletion has been
-            # unsuccessful, we should increment the account number
-            # again. This guarantees that in case of a crash, the
-            # difference between the recorded number of accounts and
-            # the real number of accounts will always be in users'
-            # favor.
-            deleted or inspect_ops.increment_account_number(
-                creditorId, debtorId
-            )
 
 
 @accounts_api.route(
@@ -354,26 +408,24 @@ class AccountConfigEndpoint(MethodView):
         """
 
         try:
-            inspect_ops.allow_account_reconfig(creditorId, debtorId)
-            if not g.pin_reset_mode:
-                procedures.verify_pin_value(
+            verify_pin(creditorId, account_config.get("optional_pin"))
+            config = inspect_ops.reconfig_account(
+                creditorId,
+                debtorId,
+                partial(
+                    procedures.update_account_config,
                     creditor_id=creditorId,
-                    secret=current_app.config["PIN_PROTECTION_SECRET"],
-                    pin_value=account_config.get("optional_pin"),
-                    pin_failures_reset_interval=timedelta(
-                        days=current_app.config["APP_PIN_FAILURES_RESET_DAYS"]
-                    ),
-                )
-            config = procedures.update_account_config(
-                creditor_id=creditorId,
-                debtor_id=debtorId,
-                is_scheduled_for_deletion=account_config[
-                    "is_scheduled_for_deletion"
-                ],
-                negligible_amount=account_config["negligible_amount"],
-                allow_unsafe_deletion=account_config["allow_unsafe_deletion"],
-                config_data=account_config["config_data"],
-                latest_update_id=account_config["latest_update_id"],
+                    debtor_id=debtorId,
+                    is_scheduled_for_deletion=account_config[
+                        "is_scheduled_for_deletion"
+                    ],
+                    negligible_amount=account_config["negligible_amount"],
+                    allow_unsafe_deletion=account_config[
+                        "allow_unsafe_deletion"
+                    ],
+                    config_data=account_config["config_data"],
+                    latest_update_id=account_config["latest_update_id"],
+                ),
             )
         except (inspect_ops.ForbiddenOperation, procedures.WrongPinValue):
             abort(403)
@@ -387,7 +439,6 @@ class AccountConfigEndpoint(MethodView):
                 409, errors={"json": {"latestUpdateId": ["Incorrect value."]}}
             )
 
-        inspect_ops.register_account_reconfig(creditorId, debtorId)
         return config
 
 
@@ -427,25 +478,21 @@ class AccountDisplayEndpoint(MethodView):
         """
 
         try:
-            inspect_ops.allow_account_reconfig(creditorId, debtorId)
-            if not g.pin_reset_mode:
-                procedures.verify_pin_value(
+            verify_pin(creditorId, account_display.get("optional_pin"))
+            display = inspect_ops.reconfig_account(
+                creditorId,
+                debtorId,
+                partial(
+                    procedures.update_account_display,
                     creditor_id=creditorId,
-                    secret=current_app.config["PIN_PROTECTION_SECRET"],
-                    pin_value=account_display.get("optional_pin"),
-                    pin_failures_reset_interval=timedelta(
-                        days=current_app.config["APP_PIN_FAILURES_RESET_DAYS"]
-                    ),
-                )
-            display = procedures.update_account_display(
-                creditor_id=creditorId,
-                debtor_id=debtorId,
-                debtor_name=account_display.get("optional_debtor_name"),
-                amount_divisor=account_display["amount_divisor"],
-                decimal_places=account_display["decimal_places"],
-                unit=account_display.get("optional_unit"),
-                known_debtor=account_display["known_debtor"],
-                latest_update_id=account_display["latest_update_id"],
+                    debtor_id=debtorId,
+                    debtor_name=account_display.get("optional_debtor_name"),
+                    amount_divisor=account_display["amount_divisor"],
+                    decimal_places=account_display["decimal_places"],
+                    unit=account_display.get("optional_unit"),
+                    known_debtor=account_display["known_debtor"],
+                    latest_update_id=account_display["latest_update_id"],
+                ),
             )
         except (inspect_ops.ForbiddenOperation, procedures.WrongPinValue):
             abort(403)
@@ -471,7 +518,6 @@ class AccountDisplayEndpoint(MethodView):
                 },
             )
 
-        inspect_ops.register_account_reconfig(creditorId, debtorId)
         return display
 
 
@@ -509,31 +555,27 @@ class AccountExchangeEndpoint(MethodView):
 
         optional_peg = account_exchange.get("optional_peg")
         try:
-            inspect_ops.allow_account_reconfig(creditorId, debtorId)
-            if not g.pin_reset_mode:
-                procedures.verify_pin_value(
+            verify_pin(creditorId, account_exchange.get("optional_pin"))
+            exchange = inspect_ops.reconfig_account(
+                creditorId,
+                debtorId,
+                partial(
+                    procedures.update_account_exchange,
                     creditor_id=creditorId,
-                    secret=current_app.config["PIN_PROTECTION_SECRET"],
-                    pin_value=account_exchange.get("optional_pin"),
-                    pin_failures_reset_interval=timedelta(
-                        days=current_app.config["APP_PIN_FAILURES_RESET_DAYS"]
+                    debtor_id=debtorId,
+                    policy=account_exchange.get("optional_policy"),
+                    min_principal=account_exchange["min_principal"],
+                    max_principal=account_exchange["max_principal"],
+                    peg_exchange_rate=optional_peg
+                    and optional_peg["exchange_rate"],
+                    peg_debtor_id=optional_peg
+                    and _parse_peg_account_uri(
+                        creditor_id=creditorId,
+                        base_url=request.full_path,
+                        uri=optional_peg["account"]["uri"],
                     ),
-                )
-            exchange = procedures.update_account_exchange(
-                creditor_id=creditorId,
-                debtor_id=debtorId,
-                policy=account_exchange.get("optional_policy"),
-                min_principal=account_exchange["min_principal"],
-                max_principal=account_exchange["max_principal"],
-                peg_exchange_rate=optional_peg
-                and optional_peg["exchange_rate"],
-                peg_debtor_id=optional_peg
-                and _parse_peg_account_uri(
-                    creditor_id=creditorId,
-                    base_url=request.full_path,
-                    uri=optional_peg["account"]["uri"],
+                    latest_update_id=account_exchange["latest_update_id"],
                 ),
-                latest_update_id=account_exchange["latest_update_id"],
             )
         except (inspect_ops.ForbiddenOperation, procedures.WrongPinValue):
             abort(403)
@@ -560,7 +602,6 @@ class AccountExchangeEndpoint(MethodView):
                 },
             )
 
-        inspect_ops.register_account_reconfig(creditorId, debtorId)
         return exchange
 
 
@@ -616,12 +657,16 @@ class AccountKnowledgeEndpoint(MethodView):
         """
 
         try:
-            inspect_ops.allow_account_reconfig(creditorId, debtorId)
-            knowledge = procedures.update_account_knowledge(
+            knowledge = inspect_ops.reconfig_account(
                 creditorId,
                 debtorId,
-                latest_update_id=account_knowledge["latest_update_id"],
-                data=account_knowledge["data"],
+                partial(
+                    procedures.update_account_knowledge,
+                    creditorId,
+                    debtorId,
+                    latest_update_id=account_knowledge["latest_update_id"],
+                    data=account_knowledge["data"],
+                ),
             )
         except inspect_ops.ForbiddenOperation:  # pragma: no cover
             abort(403)
@@ -632,7 +677,6 @@ class AccountKnowledgeEndpoint(MethodView):
                 409, errors={"json": {"latestUpdateId": ["Incorrect value."]}}
             )
 
-        inspect_ops.register_account_reconfig(creditorId, debtorId)
         return knowledge
 
 
@@ -1,5 +1,7 @@
+import json
+import struct
 from random import randint
-from flask import current_app, request, g
+from flask import current_app, request, g, Response, stream_with_context
 from flask.views import MethodView
 from flask_smorest import abort
 from swpt_creditors.schemas import (
@@ -7,10 +9,12 @@ from swpt_creditors.schemas import (
     CreditorSchema,
     CreditorReservationRequestSchema,
     CreditorReservationSchema,
+    CreditorsReservationRequestSchema,
     CreditorActivationRequestSchema,
     CreditorDeactivationRequestSchema,
     ObjectReferencesPageSchema,
 )
+from swpt_pythonlib.utils import i64_to_u64
 from swpt_creditors import procedures
 from swpt_creditors.schemas import type_registry, CreditorsListSchema
 from swpt_creditors.models import MIN_INT64, is_valid_creditor_id
@@ -18,6 +22,11 @@ from .common import context, path_builder, ensure_admin, Blueprint
 from .specs import CID
 from . import specs
 
+RESERVE_CHUNK_SIZE = 1000
+ENUMERATE_CHUNK_SIZE = 10000
+ENUMERATE_FAKE_CREDITOR_ID = 1234567890123456789
+NDJSON_MIMETYPE = "application/x-ndjson"
+BINARY_MIMETYPE = "application/octet-stream"
 
 admin_api = Blueprint(
     "admin",
@@ -73,6 +82,76 @@ class RandomCreditorReserveEndpoint(MethodView):
         return creditor
 
 
+@admin_api.route("/.creditors-reserve")
+class RandomCreditorsReserveEndpoint(MethodView):
+    @admin_api.arguments(CreditorsReservationRequestSchema)
+    @admin_api.response(
+        200,
+        content_type="application/json",
+        description=(
+            "An array of [CreditorReservation](#/components/schemas/"
+            "CreditorReservation) JSON objects."
+        ),
+    )
+    @admin_api.doc(
+        operationId="reserveRandomCreditors",
+        security=specs.SCOPE_ACTIVATE,
+    )
+    def post(self, creditors_reservation_request):
+        """Reserve many auto-generated creditor IDs at once.
+
+        **Note:** The reserved creditor IDs will be random valid
+        creditor IDs. All the reservations are created in a single
+        database transaction, before the response gets streamed back.
+        In the very unlikely case that the server fails to generate
+        enough unique creditor IDs, the returned array will contain
+        less than `count` items.
+
+        """
+
+        count = creditors_reservation_request["count"]
+        activate = creditors_reservation_request["activate"]
+        min_creditor_id = current_app.config["MIN_CREDITOR_ID"]
+        max_creditor_id = current_app.config["MAX_CREDITOR_ID"]
+        if not is_valid_creditor_id(
+            randint(min_creditor_id, max_creditor_id)
+        ):  # pragma: no cover
+            abort(
+                500,
+                message=(
+                    "The /.creditors-reserve endpoint does not support"
+                    " shards."
+                ),
+            )
+
+        # NOTE: The reservations must be committed before the
+        # response starts. Otherwise, an error in the middle of the
+        # stream would leave committed reservations which the client
+        # has never received.
+        rows = procedures.reserve_random_creditors(
+            count,
+            min_creditor_id=min_creditor_id,
+            max_creditor_id=max_creditor_id,
+            activate=activate,
+            chunk_size=RESERVE_CHUNK_SIZE,
+        )
+        schema = CreditorReservationSchema(context=context)
+
+        def generate_chunks():
+            yield "["
+            for i in range(0, len(rows), RESERVE_CHUNK_SIZE):
+                yield ("," if i > 0 else "") + ",".join(
+                    json.dumps(schema.dump(row))
+                    for row in rows[i:i + RESERVE_CHUNK_SIZE]
+                )
+            yield "]"
+
+        return Response(
+            stream_with_context(generate_chunks()),
+            mimetype="application/json",
+        )
+
+
 @admin_api.route("/.list")
 class CreditorsListEndpoint(MethodView):
     @admin_api.response(
@@ -143,6 +222,81 @@ class CreditorEnumerateEndpoint(MethodView):
         }
 
 
+@admin_api.route("/<i64:creditorId>/enumerate-all", parameters=[CID])
+class CreditorEnumerateAllEndpoint(MethodView):
+    @admin_api.response(
+        200,
+        content_type=NDJSON_MIMETYPE,
+        description=(
+            "A stream of [ObjectReference](#/components/schemas/Object"
+            "Reference) JSON objects, separated by newlines."
+        ),
+    )
+    @admin_api.doc(
+        operationId="enumerateAllCreditors",
+        security=specs.SCOPE_ACCESS_READONLY,
+    )
+    def get(self, creditorId):
+        """Return references to all active creditors, in one response.
+
+        The response will be streamed. Its content will be sorted by
+        creditor ID, starting from the `creditorID` specified in the
+        path. The sorting order is implementation-specific.
+
+        By default, the response will contain newline-delimited
+        `ObjectReference` JSON objects (`application/x-ndjson`). When
+        the client accepts only `application/octet-stream`, the
+        response will contain the raw creditor IDs instead, as a
+        sequence of 64-bit unsigned big-endian integers.
+
+        **Note:** This is an alternative to the paginated creditors
+        list, which allows external systems to synchronize millions
+        of creditors without issuing thousands of requests.
+
+        """
+
+        is_binary = (
+            request.accept_mimetypes.best_match(
+                [NDJSON_MIMETYPE, BINARY_MIMETYPE]
+            )
+            == BINARY_MIMETYPE
+        )
+
+        # NOTE: Calling `url_for` for every creditor would be too slow.
+        # Instead, the JSON line for a (fake) creditor is built once,
+        # and then the real creditor IDs are substituted.
+        fake_id = ENUMERATE_FAKE_CREDITOR_ID
+        fake_uri = path_builder.creditor(creditorId=fake_id)
+        line_prefix, line_suffix = json.dumps({"uri": fake_uri}).split(
+            str(i64_to_u64(fake_id))
+        )
+
+        def generate_chunks():
+            for creditor_ids in procedures.iter_creditor_ids(
+                start_from=creditorId, chunk_size=ENUMERATE_CHUNK_SIZE
+            ):
+                valid_ids = [
+                    creditor_id
+                    for creditor_id in creditor_ids
+                    if is_valid_creditor_id(creditor_id)
+                ]
+                if is_binary:
+                    yield struct.pack(
+                        f"!{len(valid_ids)}Q",
+                        *(i64_to_u64(x) for x in valid_ids),
+                    )
+                else:
+                    yield "".join(
+                        f"{line_prefix}{i64_to_u64(x)}{line_suffix}\n"
+                        for x in valid_ids
+                    )
+
+        return Response(
+            stream_with_context(generate_chunks()),
+            mimetype=BINARY_MIMETYPE if is_binary else NDJSON_MIMETYPE,
+        )
+
+
 @admin_api.route("/<i64:creditorId>/reserve", parameters=[CID])
 class CreditorReserveEndpoint(MethodView):
     @admin_api.arguments(CreditorReservationRequestSchema)
@@ -12,8 +12,10 @@ from swpt_creditors.models import (
     is_valid_creditor_id,
 )
 from swpt_creditors.schemas import type_registry
+from swpt_creditors import procedures
 
 NOT_REQUIED = "false"
+PIN_SESSION_HEADER = "Pin-Session"
 READ_ONLY_METHODS = ["GET", "HEAD", "OPTIONS"]
 
 
@@ -156,6 +158,33 @@ def calc_require_pin(pin_info: PinInfo) -> bool:
     return not g.pin_reset_mode and pin_info.is_required
 
 
+def verify_pin(creditor_id: int, pin_value: Optional[str]) -> None:
+    """Verify the PIN, unless a valid PIN session token has been sent.
+
+    Raises `procedures.WrongPinValue` or
+    `procedures.CreditorDoesNotExist` if the verification fails.
+    """
+
+    if g.pin_reset_mode:
+        return
+
+    secret = current_app.config["PIN_PROTECTION_SECRET"]
+    token = request.headers.get(PIN_SESSION_HEADER)
+    if token and procedures.verify_pin_session(
+        creditor_id, token, secret=secret
+    ):
+        return
+
+    procedures.verify_pin_value(
+        creditor_id=creditor_id,
+        secret=secret,
+        pin_value=pin_value,
+        pin_failures_reset_interval=timedelta(
+            days=current_app.config["APP_PIN_FAILURES_RESET_DAYS"]
+        ),
+    )
+
+
 class path_builder:
     def _build_committed_transfer_path(
         creditorId, debtorId, creationDate, transferNumber
@@ -1,3 +1,4 @@
+from functools import partial
 from datetime import timedelta
 from flask import current_app, request, g, redirect, url_for
 from flask.views import MethodView
@@ -11,6 +12,8 @@ from swpt_creditors.schemas import (
     AccountsListSchema,
     TransfersListSchema,
     PinInfoSchema,
+    PinSessionRequestSchema,
+    PinSessionSchema,
 )
 from swpt_creditors import procedures
 from swpt_creditors import inspect_ops
@@ -120,17 +123,20 @@ class PinInfoEndpoint(MethodView):
         """
 
         try:
-            inspect_ops.allow_pin_change(creditorId)
-            pin_info = procedures.update_pin_info(
-                creditor_id=creditorId,
-                status_name=pin_info["status_name"],
-                secret=current_app.config["PIN_PROTECTION_SECRET"],
-                new_pin_value=pin_info.get("optional_new_pin_value"),
-                latest_update_id=pin_info["latest_update_id"],
-                pin_reset_mode=g.pin_reset_mode,
-                pin_value=pin_info.get("optional_pin"),
-                pin_failures_reset_interval=timedelta(
-                    days=current_app.config["APP_PIN_FAILURES_RESET_DAYS"]
+            pin_info = inspect_ops.change_pin(
+                creditorId,
+                partial(
+                    procedures.update_pin_info,
+                    creditor_id=creditorId,
+                    status_name=pin_info["status_name"],
+                    secret=current_app.config["PIN_PROTECTION_SECRET"],
+                    new_pin_value=pin_info.get("optional_new_pin_value"),
+                    latest_update_id=pin_info["latest_update_id"],
+                    pin_reset_mode=g.pin_reset_mode,
+                    pin_value=pin_info.get("optional_pin"),
+                    pin_failures_reset_interval=timedelta(
+                        days=current_app.config["APP_PIN_FAILURES_RESET_DAYS"]
+                    ),
                 ),
             )
         except (inspect_ops.ForbiddenOperation, procedures.WrongPinValue):
@@ -142,10 +148,49 @@ class PinInfoEndpoint(MethodView):
                 409, errors={"json": {"latestUpdateId": ["Incorrect value."]}}
             )
 
-        inspect_ops.register_pin_change(creditorId)
         return pin_info
 
 
+@creditors_api.route("/<i64:creditorId>/pin-session", parameters=[CID])
+class PinSessionEndpoint(MethodView):
+    @creditors_api.arguments(PinSessionRequestSchema)
+    @creditors_api.response(200, PinSessionSchema)
+    @creditors_api.doc(
+        operationId="createPinSession",
+        security=specs.SCOPE_ACCESS_MODIFY,
+        responses={403: specs.FORBIDDEN_OPERATION},
+    )
+    def post(self, pin_session_request, creditorId):
+        """Verify creditor's PIN, and return a PIN session token.
+
+        The returned token can be sent in the `Pin-Session` request
+        header, so that subsequent potentially dangerous operations
+        do not need to verify the PIN again. This is useful for
+        clients which perform many operations in a row.
+
+        **Note:** When an incorrect PIN is supplied, repeating the
+        operation may result in the creditor's PIN being blocked.
+
+        """
+
+        try:
+            token, expires_at = procedures.create_pin_session(
+                creditor_id=creditorId,
+                secret=current_app.config["PIN_PROTECTION_SECRET"],
+                pin_value=pin_session_request.get("optional_pin"),
+                pin_failures_reset_interval=timedelta(
+                    days=current_app.config["APP_PIN_FAILURES_RESET_DAYS"]
+                ),
+                max_age_seconds=current_app.config["APP_PIN_SESSION_SECONDS"],
+            )
+        except procedures.WrongPinValue:
+            abort(403)
+        except procedures.CreditorDoesNotExist:
+            abort(404)
+
+        return {"token": token, "expires_at": expires_at}
+
+
 @creditors_api.route("/<i64:creditorId>/log", parameters=[CID])
 class LogEntriesEndpoint(MethodView):
     @creditors_api.arguments(LogPaginationParamsSchema, location="query")
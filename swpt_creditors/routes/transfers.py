@@ -1,11 +1,12 @@
-from datetime import timedelta
-from flask import redirect, url_for, request, current_app, g
+from flask import redirect, url_for, request, current_app
 from flask.views import MethodView
 from flask_smorest import abort
 from swpt_pythonlib.swpt_uris import parse_account_uri
 from swpt_creditors.schemas import (
     examples,
     TransferCreationRequestSchema,
+    TransfersCreationRequestSchema,
+    TransfersCreationResultSchema,
     TransferSchema,
     CommittedTransferSchema,
     TransferCancelationRequestSchema,
@@ -18,6 +19,7 @@ from .common import (
     context,
     parse_transfer_slug,
     ensure_creditor_permissions,
+    verify_pin,
     Blueprint,
 )
 from .specs import DID, CID, TID, TRANSFER_UUID
@@ -129,20 +131,13 @@ class TransfersEndpoint(MethodView):
             transferUuid=uuid,
         )
         try:
-            inspect_ops.allow_transfer_creation(creditorId, debtorId)
-            if not g.pin_reset_mode:
-                procedures.verify_pin_value(
-                    creditor_id=creditorId,
-                    secret=current_app.config["PIN_PROTECTION_SECRET"],
-                    pin_value=transfer_creation_request.get("optional_pin"),
-                    pin_failures_reset_interval=timedelta(
-                        days=current_app.config["APP_PIN_FAILURES_RESET_DAYS"]
-                    ),
-                )
-            transfer = procedures.initiate_running_transfer(
+            verify_pin(
+                creditorId, transfer_creation_request.get("optional_pin")
+            )
+            transfer = inspect_ops.initiate_transfer(
                 creditor_id=creditorId,
-                transfer_uuid=uuid,
                 debtor_id=debtorId,
+                transfer_uuid=uuid,
                 amount=transfer_creation_request["amount"],
                 recipient_uri=recipient_uri,
                 recipient=recipient,
@@ -169,10 +164,113 @@ class TransfersEndpoint(MethodView):
         except procedures.TransferExists:
             return redirect(location, code=303)
 
-        inspect_ops.register_transfer_creation(creditorId, debtorId)
         return transfer, {"Location": location}
 
 
+@transfers_api.route("/<i64:creditorId>/create-transfers", parameters=[CID])
+class TransfersCreationEndpoint(MethodView):
+    @transfers_api.arguments(TransfersCreationRequestSchema)
+    @transfers_api.response(
+        200, TransfersCreationResultSchema(context=context)
+    )
+    @transfers_api.doc(
+        operationId="createTransfers",
+        security=specs.SCOPE_ACCESS_MODIFY,
+        responses={
+            403: specs.FORBIDDEN_OPERATION,
+            409: specs.TRANSFER_CONFLICT,
+        },
+    )
+    def post(self, transfers_creation_request, creditorId):
+        """Initiate many transfers at once.
+
+        This is equivalent to calling the `createTransfer` operation
+        for each of the given transfers, but the PIN is verified only
+        once, and all transfers are initiated in a single
+        transaction. Either all of the requested transfers are
+        initiated, or none of them.
+
+        **Note:** This is a potentially dangerous operation which may
+        require a PIN. Also, normally this is an idempotent operation,
+        but when an incorrect PIN is supplied, repeating the operation
+        may result in the creditor's PIN being blocked.
+
+        """
+
+        transfers = []
+        for i, transfer_creation_request in enumerate(
+            transfers_creation_request["transfers"]
+        ):
+            recipient_uri = transfer_creation_request["recipient_identity"][
+                "uri"
+            ]
+            try:
+                debtorId, recipient = parse_account_uri(recipient_uri)
+            except ValueError:
+                abort(
+                    422,
+                    errors={
+                        "json": {
+                            "transfers": {
+                                i: {
+                                    "recipient": {
+                                        "uri": [
+                                            "The URI can not be recognized."
+                                        ]
+                                    }
+                                }
+                            }
+                        }
+                    },
+                )
+
+            options = transfer_creation_request["options"]
+            transfers.append(
+                dict(
+                    transfer_uuid=transfer_creation_request["transfer_uuid"],
+                    debtor_id=debtorId,
+                    amount=transfer_creation_request["amount"],
+                    recipient_uri=recipient_uri,
+                    recipient=recipient,
+                    transfer_note_format=transfer_creation_request[
+                        "transfer_note_format"
+                    ],
+                    transfer_note=transfer_creation_request["transfer_note"],
+                    final_interest_rate_ts=options["final_interest_rate_ts"],
+                    deadline=options.get("optional_deadline"),
+                    locked_amount=options["locked_amount"],
+                )
+            )
+
+        try:
+            verify_pin(
+                creditorId, transfers_creation_request.get("optional_pin")
+            )
+            created = inspect_ops.initiate_transfers(creditorId, transfers)
+        except (inspect_ops.ForbiddenOperation, procedures.WrongPinValue):
+            abort(403)
+        except procedures.CreditorDoesNotExist:
+            abort(404)
+        except procedures.UpdateConflict:
+            abort(409)
+
+        return {
+            "items": [
+                {
+                    "transfer": {
+                        "uri": url_for(
+                            "transfers.TransferEndpoint",
+                            creditorId=creditorId,
+                            transferUuid=t["transfer_uuid"],
+                        )
+                    },
+                    "created": created[t["transfer_uuid"]],
+                }
+                for t in transfers
+            ],
+        }
+
+
 @transfers_api.route(
     "/<i64:creditorId>/transfers/<uuid:transferUuid>",
     parameters=[CID, TRANSFER_UUID],
@@ -233,18 +331,10 @@ class TransferEndpoint(MethodView):
 
         """
 
-        inspect_ops.decrement_transfer_number(creditorId, transferUuid)
         try:
-            procedures.delete_running_transfer(creditorId, transferUuid)
+            inspect_ops.delete_transfer(creditorId, transferUuid)
         except procedures.TransferDoesNotExist:
-            # NOTE: We decremented the transfer number before trying
-            # to delete the running transfer, and now when we know
-            # that the transfer did not exist, we increment the
-            # transfer number again. This guarantees that in case of a
-            # crash, the difference between the recorded number of
-            # transfers and the real number of transfers will always
-            # be in users' favor.
-            inspect_ops.increment_transfer_number(creditorId, transferUuid)
+            pass
 
 
 @transfers_api.route(
@@ -73,6 +73,94 @@ class DebtorIdentitySchema(ValidateTypeMixin, Schema):
         return obj
 
 
+class AccountsCreationRequestSchema(ValidateTypeMixin, Schema):
+    type = fields.String(
+        load_default=type_registry.accounts_creation_request,
+        load_only=True,
+        metadata=dict(
+            description=TYPE_DESCRIPTION,
+            example="AccountsCreationRequest",
+        ),
+    )
+    debtors = fields.Nested(
+        DebtorIdentitySchema,
+        many=True,
+        required=True,
+        load_only=True,
+        validate=validate.Length(min=1, max=100),
+        metadata=dict(
+            description=(
+                "The debtors for which accounts should be created. Accounts"
+                " that already exist will not be changed."
+            ),
+        ),
+    )
+
+
+class AccountCreationResultSchema(Schema):
+    type = fields.Function(
+        lambda obj: type_registry.account_creation_result,
+        required=True,
+        metadata=dict(
+            type="string",
+            description=TYPE_DESCRIPTION,
+            example="AccountCreationResult",
+        ),
+    )
+    debtor = fields.Nested(
+        DebtorIdentitySchema,
+        required=True,
+        dump_only=True,
+        metadata=dict(
+            description="The identity of the debtor.",
+        ),
+    )
+    account = fields.Nested(
+        ObjectReferenceSchema,
+        required=True,
+        dump_only=True,
+        metadata=dict(
+            description="The URI of the debtor's `Account`.",
+            example={"uri": "/creditors/2/accounts/1/"},
+        ),
+    )
+    created = fields.Boolean(
+        required=True,
+        dump_only=True,
+        metadata=dict(
+            description=(
+                "Whether the account has been created by this request. This"
+                " will be `false` if the account already existed."
+            ),
+            example=True,
+        ),
+    )
+
+
+class AccountsCreationResultSchema(Schema):
+    type = fields.Function(
+        lambda obj: type_registry.accounts_creation_result,
+        required=True,
+        metadata=dict(
+            type="string",
+            description=TYPE_DESCRIPTION,
+            example="AccountsCreationResult",
+        ),
+    )
+    items = fields.Nested(
+        AccountCreationResultSchema,
+        many=True,
+        required=True,
+        dump_only=True,
+        metadata=dict(
+            description=(
+                "The results for the requested debtors, in the order in which"
+                " the debtors were given in the request."
+            ),
+        ),
+    )
+
+
 class DebtorInfoSchema(ValidateTypeMixin, Schema):
     type = fields.String(
         load_default=type_registry.debtor_info,
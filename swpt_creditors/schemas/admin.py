@@ -116,6 +116,39 @@ class CreditorReservationSchema(ValidateTypeMixin, Schema):
         return calc_reservation_deadline(obj.created_at).isoformat()
 
 
+class CreditorsReservationRequestSchema(ValidateTypeMixin, Schema):
+    type = fields.String(
+        load_default=type_registry.creditors_reservation_request,
+        load_only=True,
+        metadata=dict(
+            description=TYPE_DESCRIPTION,
+            example="CreditorsReservationRequest",
+        ),
+    )
+    count = fields.Integer(
+        required=True,
+        load_only=True,
+        validate=validate.Range(min=1, max=100000),
+        metadata=dict(
+            format="int32",
+            description="The number of creditor IDs to reserve.",
+            example=1000,
+        ),
+    )
+    activate = fields.Boolean(
+        load_default=False,
+        load_only=True,
+        metadata=dict(
+            description=(
+                "Whether the reserved creditors should be activated at once."
+                " When this is `true`, the `reservationId` fields in the"
+                " response will be `\"0\"`."
+            ),
+            example=False,
+        ),
+    )
+
+
 class CreditorActivationRequestSchema(ValidateTypeMixin, Schema):
     type = fields.String(
         load_default=type_registry.creditor_activation_request,
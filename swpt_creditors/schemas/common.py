@@ -31,16 +31,22 @@ class type_registry:
     account_identity = "AccountIdentity"
     debtor_identity = "DebtorIdentity"
     debtor_info = "DebtorInfo"
+    accounts_creation_request = "AccountsCreationRequest"
+    account_creation_result = "AccountCreationResult"
+    accounts_creation_result = "AccountsCreationResult"
     currency_peg = "CurrencyPeg"
     wallet = "Wallet"
     creditor_reservation_request = "CreditorReservationRequest"
     creditor_reservation = "CreditorReservation"
+    creditors_reservation_request = "CreditorsReservationRequest"
     creditor_activation_request = "CreditorActivationRequest"
     creditor_deactivation_request = "CreditorDeactivationRequest"
     creditor_creation_request = "CreditorCreationRequest"
     creditors_list = "CreditorsList"
     creditor = "Creditor"
     pin_info = "PinInfo"
+    pin_session_request = "PinSessionRequest"
+    pin_session = "PinSession"
     log_entries_page = "LogEntriesPage"
     log_entry = "LogEntry"
     accounts_list = "AccountsList"
@@ -55,6 +61,9 @@ class type_registry:
     ledger_entry = "LedgerEntry"
     transfers_list = "TransfersList"
     transfer_creation_request = "TransferCreationRequest"
+    transfers_creation_request = "TransfersCreationRequest"
+    transfer_creation_result = "TransferCreationResult"
+    transfers_creation_result = "TransfersCreationResult"
     transfer_cancelation_request = "TransferCancelationRequest"
     transfer = "Transfer"
     transfer_options = "TransferOptions"
@@ -151,6 +151,49 @@ class PinInfoSchema(
         return obj
 
 
+class PinSessionRequestSchema(ValidateTypeMixin, PinProtectedResourceSchema):
+    type = fields.String(
+        load_default=type_registry.pin_session_request,
+        load_only=True,
+        metadata=dict(
+            description=TYPE_DESCRIPTION,
+            example="PinSessionRequest",
+        ),
+    )
+
+
+class PinSessionSchema(Schema):
+    type = fields.Function(
+        lambda obj: type_registry.pin_session,
+        required=True,
+        metadata=dict(
+            type="string",
+            description=TYPE_DESCRIPTION,
+            example="PinSession",
+        ),
+    )
+    token = fields.String(
+        required=True,
+        dump_only=True,
+        metadata=dict(
+            description=(
+                "A token which can be sent in the `Pin-Session` request"
+                " header, instead of the PIN. The token will be accepted"
+                " until it expires, or until the PIN information gets"
+                " changed, or the PIN gets blocked."
+            ),
+        ),
+    )
+    expires_at = fields.DateTime(
+        required=True,
+        dump_only=True,
+        data_key="expiresAt",
+        metadata=dict(
+            description="The moment at which the token expires.",
+        ),
+    )
+
+
 class AccountsListSchema(PaginatedListSchema, MutableResourceSchema):
     uri = fields.String(
         required=True,
@@ -300,6 +300,94 @@ class TransferCreationRequestSchema(
             )
 
 
+class TransfersCreationRequestSchema(
+    ValidateTypeMixin, PinProtectedResourceSchema
+):
+    type = fields.String(
+        load_default=type_registry.transfers_creation_request,
+        load_only=True,
+        metadata=dict(
+            description=TYPE_DESCRIPTION,
+            example="TransfersCreationRequest",
+        ),
+    )
+    transfers = fields.Nested(
+        TransferCreationRequestSchema,
+        many=True,
+        required=True,
+        load_only=True,
+        validate=validate.Length(min=1, max=1000),
+        metadata=dict(
+            description=(
+                "The transfers that should be initiated. Note that only the"
+                " `pin` field of the request will be verified. The `pin`"
+                " fields of the individual transfers will be ignored."
+            ),
+        ),
+    )
+
+
+class TransferCreationResultSchema(Schema):
+    type = fields.Function(
+        lambda obj: type_registry.transfer_creation_result,
+        required=True,
+        metadata=dict(
+            type="string",
+            description=TYPE_DESCRIPTION,
+            example="TransferCreationResult",
+        ),
+    )
+    transfer = fields.Nested(
+        ObjectReferenceSchema,
+        required=True,
+        dump_only=True,
+        metadata=dict(
+            description="The URI of the `Transfer`.",
+            example={
+                "uri": (
+                    "/creditors/2/transfers/"
+                    "123e4567-e89b-12d3-a456-426655440000"
+                )
+            },
+        ),
+    )
+    created = fields.Boolean(
+        required=True,
+        dump_only=True,
+        metadata=dict(
+            description=(
+                "Whether the transfer has been initiated by this request. This"
+                " will be `false` if an identical transfer already existed."
+            ),
+            example=True,
+        ),
+    )
+
+
+class TransfersCreationResultSchema(Schema):
+    type = fields.Function(
+        lambda obj: type_registry.transfers_creation_result,
+        required=True,
+        metadata=dict(
+            type="string",
+            description=TYPE_DESCRIPTION,
+            example="TransfersCreationResult",
+        ),
+    )
+    items = fields.Nested(
+        TransferCreationResultSchema,
+        many=True,
+        required=True,
+        dump_only=True,
+        metadata=dict(
+            description=(
+                "The results for the requested transfers, in the order in"
+                " which the transfers were given in the request."
+            ),
+        ),
+    )
+
+
 class TransferSchema(TransferCreationRequestSchema, MutableResourceSchema):
     uri = fields.String(
         required=True,
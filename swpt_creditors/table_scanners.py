@@ -1,7 +1,18 @@
+import logging
 from typing import TypeVar, Callable
 from datetime import datetime, timedelta, timezone
 from flask import current_app
-from sqlalchemy.sql.expression import tuple_, or_, and_, false, true, null
+from sqlalchemy.sql.expression import (
+    tuple_,
+    or_,
+    and_,
+    false,
+    true,
+    null,
+    select,
+    any_,
+    bindparam,
+)
 from sqlalchemy.orm import load_only
 from sqlalchemy.dialects import postgresql
 from swpt_pythonlib.scan_table import TableScanner
@@ -29,6 +40,7 @@ T = TypeVar("T")
 atomic: Callable[[T], T] = db.atomic
 
 TD_HOUR = timedelta(hours=1)
+_LOGGER = logging.getLogger(__name__)
 ENSURE_PENDING_LEDGER_UPDATE_STATEMENT = postgresql.insert(
     PendingLedgerUpdate.__table__
 ).on_conflict_do_nothing()
@@ -50,6 +62,7 @@ class CreditorScanner(TableScanner):
 
     def __init__(self):
         super().__init__()
+        self.deleted_counts = {}
         self.inactive_interval = timedelta(
             days=current_app.config["APP_INACTIVE_CREDITOR_RETENTION_DAYS"]
         )
@@ -68,12 +81,63 @@ class CreditorScanner(TableScanner):
     @atomic
     def process_rows(self, rows):
         current_ts = datetime.now(tz=timezone.utc)
+        deleted_counts = {}
         if current_app.config["DELETE_PARENT_SHARD_RECORDS"]:
-            self._delete_parent_shard_creditors(rows, current_ts)
-        self._delete_creditors_not_activated_for_long_time(rows, current_ts)
-        self._delete_creditors_deactivated_long_time_ago(rows, current_ts)
+            deleted_counts["parent_shard"] = (
+                self._delete_parent_shard_creditors(rows, current_ts)
+            )
+        deleted_counts["not_activated"] = (
+            self._delete_creditors_not_activated_for_long_time(
+                rows, current_ts
+            )
+        )
+        deleted_counts["deactivated"] = (
+            self._delete_creditors_deactivated_long_time_ago(rows, current_ts)
+        )
+        self.deleted_counts = deleted_counts
+
+        if any(deleted_counts.values()):
+            _LOGGER.info(
+                "Deleted creditors: %s",
+                ", ".join(f"{k}={v}" for k, v in deleted_counts.items()),
+            )
+
+    def _delete_creditors(self, ids_to_delete, *conditions) -> int:
+        # NOTE: Creditors that are locked by other transactions are
+        # skipped. All the rows that belong to the deleted creditors
+        # are deleted by the database (`ON DELETE CASCADE`).
+        if not ids_to_delete:
+            return 0
 
-    def _delete_creditors_not_activated_for_long_time(self, rows, current_ts):
+        c = self.table.c
+        to_delete = (
+            select(c.creditor_id)
+            .where(
+                c.creditor_id
+                == any_(
+                    bindparam(
+                        "ids",
+                        ids_to_delete,
+                        type_=postgresql.ARRAY(db.BigInteger),
+                    )
+                ),
+                *conditions,
+            )
+            .with_for_update(skip_locked=True)
+        )
+        deleted_count = len(
+            db.session.execute(
+                self.table.delete()
+                .where(c.creditor_id.in_(to_delete))
+                .returning(c.creditor_id)
+            ).all()
+        )
+        db.session.commit()
+        return deleted_count
+
+    def _delete_creditors_not_activated_for_long_time(
+        self, rows, current_ts
+    ) -> int:
         c = self.table.c
         activated_flag = Creditor.STATUS_IS_ACTIVATED_FLAG
         inactive_cutoff_ts = current_ts - self.inactive_interval
@@ -84,26 +148,19 @@ class CreditorScanner(TableScanner):
                 and row[c.created_at] < inactive_cutoff_ts
             )
 
-        ids_to_delete = [
-            row[c.creditor_id]
-            for row in rows
-            if not_activated_for_long_time(row)
-        ]
-        if ids_to_delete:
-            to_delete = (
-                Creditor.query.filter(Creditor.creditor_id.in_(ids_to_delete))
-                .filter(Creditor.status_flags.op("&")(activated_flag) == 0)
-                .filter(Creditor.created_at < inactive_cutoff_ts)
-                .with_for_update(skip_locked=True)
-                .all()
-            )
-
-            for creditor in to_delete:
-                db.session.delete(creditor)
-
-            db.session.commit()
+        return self._delete_creditors(
+            [
+                row[c.creditor_id]
+                for row in rows
+                if not_activated_for_long_time(row)
+            ],
+            c.status_flags.op("&")(activated_flag) == 0,
+            c.created_at < inactive_cutoff_ts,
+        )
 
-    def _delete_creditors_deactivated_long_time_ago(self, rows, current_ts):
+    def _delete_creditors_deactivated_long_time_ago(
+        self, rows, current_ts
+    ) -> int:
         c = self.table.c
         deactivated_flag = Creditor.STATUS_IS_DEACTIVATED_FLAG
         deactivated_cutoff_date = (
@@ -116,31 +173,20 @@ class CreditorScanner(TableScanner):
                 or row[c.deactivation_date] < deactivated_cutoff_date
             )
 
-        ids_to_delete = [
-            row[c.creditor_id]
-            for row in rows
-            if deactivated_long_time_ago(row)
-        ]
-        if ids_to_delete:
-            to_delete = (
-                Creditor.query.filter(Creditor.creditor_id.in_(ids_to_delete))
-                .filter(Creditor.status_flags.op("&")(deactivated_flag) != 0)
-                .filter(
-                    or_(
-                        Creditor.deactivation_date == null(),
-                        Creditor.deactivation_date < deactivated_cutoff_date,
-                    ),
-                )
-                .with_for_update(skip_locked=True)
-                .all()
-            )
-
-            for creditor in to_delete:
-                db.session.delete(creditor)
-
-            db.session.commit()
+        return self._delete_creditors(
+            [
+                row[c.creditor_id]
+                for row in rows
+                if deactivated_long_time_ago(row)
+            ],
+            c.status_flags.op("&")(deactivated_flag) != 0,
+            or_(
+                c.deactivation_date == null(),
+                c.deactivation_date < deactivated_cutoff_date,
+            ),
+        )
 
-    def _delete_parent_shard_creditors(self, rows, current_ts):
+    def _delete_parent_shard_creditors(self, rows, current_ts) -> int:
         c = self.table.c
 
         def belongs_to_parent_shard(row) -> bool:
@@ -148,20 +194,13 @@ class CreditorScanner(TableScanner):
                 row[c.creditor_id]
             ) and is_valid_creditor_id(row[c.creditor_id], match_parent=True)
 
-        ids_to_delete = [
-            row[c.creditor_id] for row in rows if belongs_to_parent_shard(row)
-        ]
-        if ids_to_delete:
-            to_delete = (
-                Creditor.query.filter(Creditor.creditor_id.in_(ids_to_delete))
-                .with_for_update(skip_locked=True)
-                .all()
-            )
-
-            for creditor in to_delete:
-                db.session.delete(creditor)
-
-            db.session.commit()
+        return self._delete_creditors(
+            [
+                row[c.creditor_id]
+                for row in rows
+                if belongs_to_parent_shard(row)
+            ]
+        )
 
 
 class LogEntryScanner(TableScanner):
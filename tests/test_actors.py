@@ -1,5 +1,9 @@
+import asyncio
+import threading
+import time
 from datetime import datetime, date, timezone
 import pytest
+from unittest.mock import Mock
 from swpt_pythonlib.rabbitmq import MessageProperties
 
 D_ID = -1
@@ -211,3 +215,345 @@ def test_consumer(db_session, actors):
         )
         is True
     )
+
+
+def test_consumer_ordered_dispatch(db_session, actors):
+    consumer = actors.SmpConsumer(ordered_dispatch=True, workers=2)
+    assert consumer.dispatcher.executor._max_workers == 2
+
+    props = MessageProperties(
+        content_type="application/json", type="AccountPurge"
+    )
+    assert consumer.process_message(b"{}", props) is False
+    with pytest.raises(
+        RuntimeError, match="The agent is not responsible for this creditor."
+    ):
+        consumer.process_message(
+            b"""
+        {
+          "type": "AccountPurge",
+          "debtor_id": 1,
+          "creditor_id": 2,
+          "creation_date": "2098-12-31",
+          "ts": "2099-12-31T00:00:00+00:00"
+        }
+        """,
+            props,
+        )
+
+    for _ in range(2):
+        assert (
+            consumer.process_message(
+                b"""
+        {
+          "type": "AccountPurge",
+          "debtor_id": 1,
+          "creditor_id": 4294967296,
+          "creation_date": "2098-12-31",
+          "ts": "2099-12-31T00:00:00+00:00"
+        }
+        """,
+                props,
+            )
+            is True
+        )
+    assert consumer.stats.count == 2
+    consumer.dispatcher.shutdown()
+
+
+def test_ordered_dispatcher(app, actors):
+    stats = actors.ProcessingStats()
+    dispatcher = actors.OrderedDispatcher(3, stats)
+    lock = threading.Lock()
+    running = set()
+    overlapping = []
+    processed = {}
+    release = threading.Event()
+
+    def actor(key, i):
+        with lock:
+            if key in running:
+                overlapping.append(key)
+            running.add(key)
+        time.sleep(0.001)
+        with lock:
+            running.remove(key)
+            processed.setdefault(key, []).append(i)
+
+    def slow_actor(key, i):
+        release.wait()
+        actor(key, i)
+
+    def failing_actor(key):
+        raise ValueError(key)
+
+    # A slow account does not stall the other accounts.
+    slow_future = dispatcher.dispatch(
+        (C_ID, -1), slow_actor, {"key": (C_ID, -1), "i": 0}
+    )
+    keys = [(C_ID, i % 5) for i in range(30)]
+    futures = [
+        dispatcher.dispatch(key, actor, {"key": key, "i": i})
+        for i, key in enumerate(keys)
+    ]
+    for future in futures:
+        future.result(timeout=10.0)
+    assert not slow_future.done()
+    release.set()
+    slow_future.result(timeout=10.0)
+
+    assert overlapping == []
+    assert processed[(C_ID, -1)] == [0]
+    for k in range(5):
+        assert processed[(C_ID, k)] == list(range(k, 30, 5))
+    assert stats.count == 31
+
+    with pytest.raises(ValueError):
+        dispatcher.dispatch(
+            (C_ID, 0), failing_actor, {"key": (C_ID, 0)}
+        ).result()
+
+    dispatcher.shutdown()
+    assert dispatcher.lanes == {}
+
+
+ACCOUNT_PURGE_BODY = b"""
+{
+  "type": "AccountPurge",
+  "debtor_id": 1,
+  "creditor_id": 4294967296,
+  "creation_date": "2098-12-31",
+  "ts": "2099-12-31T00:00:00+00:00"
+}
+"""
+
+
+def _run_async_consumer(consumer, messages):
+    consumer.loop = asyncio.new_event_loop()
+    consumer.connection = Mock(is_closing=False, is_closed=False)
+    consumer.channel = Mock(is_open=True)
+
+    async def process_messages():
+        for delivery_tag, (body, props) in enumerate(messages):
+            consumer._on_message(
+                consumer.channel, Mock(delivery_tag=delivery_tag), props, body
+            )
+        while consumer.in_flight > 0:
+            await asyncio.sleep(0.001)
+
+    try:
+        consumer.loop.run_until_complete(process_messages())
+    finally:
+        consumer.loop.close()
+
+
+def test_async_consumer(app, db_session, actors):
+    consumer = actors.AsyncSmpConsumer(
+        app, url="amqp://", queue="test", threads=2, prefetch_count=10
+    )
+    props = MessageProperties(
+        content_type="application/json", type="AccountPurge"
+    )
+    _run_async_consumer(
+        consumer,
+        [(b"{}", props), (ACCOUNT_PURGE_BODY, props), (b"body", props)],
+    )
+    consumer.channel.basic_ack.assert_called_once_with(1)
+    assert consumer.channel.basic_reject.call_count == 2
+    assert consumer.error is None
+    assert not consumer.stopping
+
+    invalid_creditor_body = ACCOUNT_PURGE_BODY.replace(b"4294967296", b"2")
+    _run_async_consumer(consumer, [(invalid_creditor_body, props)])
+    assert isinstance(consumer.error, RuntimeError)
+    assert consumer.stopping
+    consumer.connection.close.assert_called_once()
+    consumer.executor.shutdown()
+
+
+def test_recent_keys_cache(actors):
+    cache = actors.RecentKeysCache(2, name="test", log_interval=0.0)
+    assert cache.hit_ratio == 0.0
+    assert not cache.contains(1)
+    cache.add(1)
+    cache.add(2)
+    assert cache.contains(1)
+    cache.add(3)
+    assert not cache.contains(2)
+    assert cache.contains(1)
+    assert cache.contains(3)
+    assert cache.lookups == 5
+    assert cache.hits == 3
+    assert cache.hit_ratio == 0.6
+
+
+def test_account_transfer_duplicates_filter(
+    app, monkeypatch, mocker, db_session, actors
+):
+    duplicates_filter = actors.RecentKeysCache(100, name="test")
+    monkeypatch.setitem(
+        app.extensions, "transfers_duplicates_filter", duplicates_filter
+    )
+    process_account_transfer_signal = mocker.patch(
+        "swpt_creditors.procedures.process_account_transfer_signal",
+        return_value=True,
+    )
+    params = dict(
+        debtor_id=D_ID,
+        creditor_id=C_ID,
+        creation_date=date.fromisoformat("2020-01-02"),
+        transfer_number=666,
+        coordinator_type="direct",
+        sender="666",
+        recipient=str(C_ID),
+        acquired_amount=1000,
+        transfer_note_format="json",
+        transfer_note='{"message": "test"}',
+        committed_at=datetime.fromisoformat("2019-10-01T00:00:00+00:00"),
+        principal=1000,
+        ts=datetime.fromisoformat("2000-01-01T00:00:00+00:00"),
+        previous_transfer_number=0,
+    )
+    actors._on_account_transfer_signal(**params)
+    actors._on_account_transfer_signal(**params)
+    process_account_transfer_signal.assert_called_once()
+
+    process_account_transfer_signal.return_value = False
+    params["transfer_number"] = 667
+    actors._on_account_transfer_signal(**params)
+    actors._on_account_transfer_signal(**params)
+    assert process_account_transfer_signal.call_count == 3
+    assert duplicates_filter.hits == 1
+
+
+def test_prefetch_controller(actors):
+    c = actors.PrefetchController(
+        threads=2, initial_window=4, max_window=10, max_queue_seconds=1.0
+    )
+    assert c.window == 4
+    assert c.adjust() == 4
+
+    # The window is full, and the worker threads are starving.
+    c.observe_in_flight(4)
+    c.record(0.010, 0.001)
+    assert c.adjust() == 6
+    c.observe_in_flight(6)
+    c.record(0.010, 0.001)
+    assert c.adjust() == 8
+    c.observe_in_flight(8)
+    c.record(0.010, 0.001)
+    assert c.adjust() == 10
+    c.observe_in_flight(10)
+    c.record(0.010, 0.001)
+    assert c.adjust() == 10
+
+    # The window is not full.
+    c.observe_in_flight(5)
+    c.record(0.010, 0.001)
+    assert c.adjust() == 10
+
+    # Messages wait too long for a free worker thread.
+    c.record(0.010, 0.050)
+    assert c.adjust() == 7
+    c.record(1.0, 1.5)
+    assert c.adjust() == 5
+
+    # The database connection pool is exhausted.
+    assert c.adjust(is_db_pool_exhausted=True) == 2
+    assert c.paused
+    assert c.adjust(is_db_pool_exhausted=True) == 1
+    assert c.adjust(is_db_pool_exhausted=True) == 1
+    assert c.adjust() == 1
+    assert not c.paused
+
+
+def test_is_db_pool_exhausted(actors):
+    from sqlalchemy.pool import QueuePool, NullPool
+
+    def creator():
+        return Mock()
+
+    assert not actors._is_db_pool_exhausted(NullPool(creator))
+    assert not actors._is_db_pool_exhausted(
+        QueuePool(creator, pool_size=0)
+    )
+    assert not actors._is_db_pool_exhausted(
+        QueuePool(creator, pool_size=1, max_overflow=-1)
+    )
+    pool = QueuePool(creator, pool_size=1, max_overflow=1)
+    c1 = pool.connect()
+    assert not actors._is_db_pool_exhausted(pool)
+    c2 = pool.connect()
+    assert actors._is_db_pool_exhausted(pool)
+    c1.close()
+    assert not actors._is_db_pool_exhausted(pool)
+    c2.close()
+
+
+def test_async_consumer_adaptive_prefetch(mocker, app, db_session, actors):
+    consumer = actors.AsyncSmpConsumer(
+        app,
+        url="amqp://",
+        queue="test",
+        threads=1,
+        prefetch_count=1,
+        adaptive_prefetch=True,
+        max_prefetch_count=5,
+        min_restart_interval=0.0,
+    )
+    props = MessageProperties(
+        content_type="application/json", type="AccountPurge"
+    )
+    for _ in range(3):
+        _run_async_consumer(consumer, [(ACCOUNT_PURGE_BODY, props)])
+    assert consumer.controller.count == 3
+    assert consumer.controller.is_window_full
+
+    consumer.loop = Mock()
+    consumer.consumer_tag = "tag"
+    consumer._adjust_prefetch()
+    assert consumer.prefetch_count == 2
+    consumer.channel.basic_cancel.assert_called_once_with("tag")
+    consumer.channel.basic_qos.assert_called_once_with(
+        prefetch_count=2, callback=consumer._on_qos_ok
+    )
+    consumer._on_qos_ok(None)
+    consumer.channel.basic_consume.assert_called_once()
+
+    # The window has grown, but not enough to restart the consumer.
+    consumer.controller.observe_in_flight(2)
+    consumer.controller.record(0.010, 0.001)
+    consumer._adjust_prefetch()
+    assert consumer.controller.window == 3
+    assert consumer.prefetch_count == 2
+    consumer.channel.basic_qos.assert_called_once()
+    consumer.channel.basic_cancel.assert_called_once()
+
+    # The consumer is paused as soon as a message arrives while the
+    # database connection pool is exhausted.
+    is_db_pool_exhausted = mocker.patch.object(
+        consumer, "_is_db_pool_exhausted", return_value=True
+    )
+    consumer._on_message(
+        consumer.channel, Mock(delivery_tag=1), props, ACCOUNT_PURGE_BODY
+    )
+    assert consumer.controller.paused
+    assert consumer.consumer_tag is None
+    assert consumer.channel.basic_cancel.call_count == 2
+    consumer._adjust_prefetch()
+    assert consumer.controller.paused
+    assert consumer.channel.basic_cancel.call_count == 2
+    consumer.channel.basic_qos.assert_called_once()
+
+    # The pool is available again.
+    is_db_pool_exhausted.return_value = False
+    consumer._adjust_prefetch()
+    assert not consumer.controller.paused
+    assert consumer.prefetch_count == 1
+    consumer.channel.basic_qos.assert_called_with(
+        prefetch_count=1, callback=consumer._on_qos_ok
+    )
+    consumer._on_qos_ok(None)
+    assert consumer.channel.basic_consume.call_count == 2
+    assert consumer.loop.call_later.call_count == 4
+    consumer.executor.shutdown()
@@ -0,0 +1,268 @@
+import time
+import pytest
+from .test_models import _get_sample_signals
+
+
+def _measure(f, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+@pytest.mark.slow
+def test_signal_message_encoding_speed(app, current_ts):
+    for signal in _get_sample_signals(current_ts):
+        model = type(signal)
+        signals = [signal] * 2000
+        encoder = model.get_message_encoder()
+
+        old = _measure(lambda: [s._create_message() for s in signals])
+        new = _measure(lambda: encoder.encode_messages(signals))
+        print(
+            f"\n{model.__name__}: "
+            f"{old * 1e6 / len(signals):.1f}us -> "
+            f"{new * 1e6 / len(signals):.1f}us per message"
+        )
+        assert [m.body for m in encoder.encode_messages(signals[:1])] == [
+            signals[0]._create_message().body
+        ]
+
+
+@pytest.mark.slow
+def test_async_consumer_speed(app, db_session):
+    from concurrent.futures import ThreadPoolExecutor
+    from swpt_pythonlib.rabbitmq import MessageProperties
+    from swpt_creditors import actors
+    from .test_actors import ACCOUNT_PURGE_BODY, _run_async_consumer
+
+    # NOTE: Both consumers execute the actors synchronously, in the
+    # same number of worker threads, so the database concurrency is
+    # the same. This only measures the overhead of passing the
+    # messages through the asyncio event loop.
+    threads = 4
+    props = MessageProperties(
+        content_type="application/json", type="AccountPurge"
+    )
+    messages = [(ACCOUNT_PURGE_BODY, props)] * 1000
+
+    # The threaded consumer: every thread processes one message at a
+    # time.
+    consumer = actors.SmpConsumer()
+
+    def process_message(message):
+        with app.app_context():
+            return consumer.process_message(*message)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        started_at = time.perf_counter()
+        assert all(executor.map(process_message, messages))
+        threaded = time.perf_counter() - started_at
+
+    # The asyncio consumer: all messages are in flight, and are
+    # processed by a pool of worker threads.
+    async_consumer = actors.AsyncSmpConsumer(
+        app,
+        url="amqp://",
+        queue="test",
+        threads=threads,
+        prefetch_count=len(messages),
+    )
+    started_at = time.perf_counter()
+    _run_async_consumer(async_consumer, messages)
+    asynchronous = time.perf_counter() - started_at
+    async_consumer.executor.shutdown()
+    assert async_consumer.channel.basic_ack.call_count == len(messages)
+
+    print(
+        f"\nthreaded: {len(messages) / threaded:.0f} messages/s, "
+        f"asyncio: {len(messages) / asynchronous:.0f} messages/s"
+    )
+
+
+@pytest.mark.slow
+def test_compiled_schema_speed():
+    import random
+    from swpt_creditors.actors import _MESSAGE_TYPES, _COMPILED_SCHEMAS
+    from .test_fast_schemas import ExampleSchema, _generate_message
+    from swpt_creditors.fast_schemas import CompiledSchema
+
+    schemas = [("Example", ExampleSchema(), None)] + [
+        (message_type, schema, _COMPILED_SCHEMAS[message_type])
+        for message_type, (schema, _) in _MESSAGE_TYPES.items()
+    ]
+    rnd = random.Random(0)
+    for message_type, schema, compiled_schema in schemas:
+        compiled_schema = compiled_schema or CompiledSchema(schema)
+        messages = []
+        for _ in range(20000):
+            message = _generate_message(rnd, schema, message_type)
+            try:
+                schema.load(message)
+            except Exception:
+                continue
+            messages.append(message)
+        if not messages:
+            continue
+
+        old = _measure(lambda: [schema.load(m) for m in messages])
+        new = _measure(lambda: [compiled_schema.load(m) for m in messages])
+        print(
+            f"\n{message_type}: "
+            f"{old * 1e6 / len(messages):.1f}us -> "
+            f"{new * 1e6 / len(messages):.1f}us per message"
+        )
+
+
+@pytest.mark.slow
+def test_full_cycle_speed(app, db_session):
+    from uuid import uuid4
+    from swpt_creditors import procedures as p
+    from swpt_creditors.fake_authority import FakeAccountingAuthority
+    from .test_fake_authority import C_ID, D_ID, _create_creditor
+
+    n = 100
+    authority = FakeAccountingAuthority(app, initial_principal=1000000)
+    started_at = time.perf_counter()
+    for i in range(n):
+        _create_creditor(C_ID + i)
+        p.create_new_account(C_ID + i, D_ID)
+    authority.run_until_idle()
+    accounts_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    for i in range(n):
+        p.initiate_running_transfer(
+            creditor_id=C_ID + i,
+            transfer_uuid=uuid4(),
+            debtor_id=D_ID,
+            amount=1000,
+            recipient_uri="swpt:18446744073709551615/0",
+            recipient=str(C_ID + (i + 1) % n),
+            transfer_note_format="",
+            transfer_note="",
+        )
+    authority.run_until_idle()
+    transfers_seconds = time.perf_counter() - started_at
+
+    print(
+        f"\naccounts: {n / accounts_seconds:.0f}/s, "
+        f"transfers: {n / transfers_seconds:.0f}/s"
+    )
+    for stage, s in sorted(authority.get_latency_stats().items()):
+        print(f"{stage}: avg={1000 * s.avg_seconds:.1f}ms")
+    for stage, seconds in authority.stage_seconds.items():
+        print(f"{stage}: {seconds:.3f}s")
+
+
+@pytest.mark.slow
+def test_process_pending_log_entries_speed(app, db_session, current_ts):
+    from swpt_creditors import procedures as p
+    from swpt_creditors.extensions import db
+    from swpt_creditors.procedures.creditors import (
+        _process_pending_log_entries_one_by_one,
+    )
+    from .test_fake_authority import C_ID, _create_creditor
+    from .test_procedures import _add_sample_pending_log_entries
+
+    _create_creditor(C_ID)
+
+    def add_pending_log_entries():
+        for _ in range(125):
+            _add_sample_pending_log_entries(C_ID, current_ts)
+
+    def measure(f):
+        seconds = 0.0
+        for _ in range(5):
+            add_pending_log_entries()
+            started_at = time.perf_counter()
+            f(C_ID)
+            db.session.commit()
+            seconds += time.perf_counter() - started_at
+        return seconds / 5
+
+    old = measure(db.atomic(_process_pending_log_entries_one_by_one))
+    new = measure(p.process_pending_log_entries)
+    print(f"\n1000 pending log entries: {old:.3f}s -> {new:.3f}s")
+
+
+@pytest.mark.slow
+def test_log_entry_id_allocation_contention(app, db_session, current_ts):
+    from concurrent.futures import ThreadPoolExecutor
+    from swpt_creditors import procedures as p
+    from swpt_creditors import models as m
+    from swpt_creditors.extensions import db
+    from swpt_creditors.procedures.creditors import (
+        _process_pending_log_entries_one_by_one,
+    )
+    from .test_fake_authority import C_ID, _create_creditor
+
+    # Many writers add entries to the log of a single creditor.
+    threads = 8
+    n = 200
+    _create_creditor(C_ID)
+
+    def measure(process_func):
+        def write(i):
+            with app.app_context():
+                db.session.add(
+                    m.PendingLogEntry(
+                        creditor_id=C_ID,
+                        added_at=current_ts,
+                        object_type_hint=m.LogEntry.OTH_ACCOUNT_LEDGER,
+                        debtor_id=i,
+                        object_update_id=1,
+                    )
+                )
+                db.session.commit()
+                process_func(C_ID)
+                db.session.commit()
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(write, range(n)))
+        return time.perf_counter() - started_at
+
+    old = measure(db.atomic(_process_pending_log_entries_one_by_one))
+    new = measure(p.process_pending_log_entries)
+    entry_ids = [
+        e.entry_id
+        for e in m.LogEntry.query.filter_by(creditor_id=C_ID)
+        .order_by(m.LogEntry.entry_id)
+        .all()
+    ]
+    first_id = entry_ids[0]
+    assert entry_ids == list(range(first_id, first_id + len(entry_ids)))
+    print(
+        f"\n{threads} writers: {n / old:.0f}/s -> {n / new:.0f}/s"
+        " log entries"
+    )
+
+
+@pytest.mark.slow
+def test_inspected_operations_speed(app, db_session):
+    from swpt_creditors import procedures as p
+    from swpt_creditors import inspect_ops
+    from .test_fake_authority import C_ID, _create_creditor
+
+    n = 200
+    _create_creditor(C_ID)
+
+    def create_accounts_separately():
+        # Three transactions per account: the DoS check, the
+        # operation, and the update of the usage stats.
+        for debtor_id in range(1, n + 1):
+            inspect_ops.allow_account_creation(C_ID, debtor_id)
+            p.create_new_account(C_ID, debtor_id)
+            inspect_ops.register_account_creation(C_ID, debtor_id)
+
+    def create_accounts_combined():
+        for debtor_id in range(n + 1, 2 * n + 1):
+            inspect_ops.create_account(C_ID, debtor_id)
+
+    old = _measure(create_accounts_separately, repeat=1)
+    new = _measure(create_accounts_combined, repeat=1)
+    assert len(p.get_account_debtor_ids(C_ID, count=3 * n)) == 2 * n
+    print(f"\naccount creations: {n / old:.0f}/s -> {n / new:.0f}/s")
@@ -0,0 +1,123 @@
+import io
+import os
+import time
+import pytest
+from datetime import datetime, timezone
+from swpt_pythonlib.rabbitmq import MessageProperties
+from swpt_creditors.capture import (
+    MAGIC,
+    CapturedMessage,
+    TrafficRecorder,
+    read_captured_messages,
+    replay_captured_messages,
+)
+
+ACCOUNT_PURGE_BODY = b"""
+{
+  "type": "AccountPurge",
+  "debtor_id": 1,
+  "creditor_id": 4294967296,
+  "creation_date": "2098-12-31",
+  "ts": "2099-12-31T00:00:00+00:00"
+}
+"""
+
+
+def test_traffic_recorder(tmp_path):
+    path = str(tmp_path / "traffic-{pid}.smpcap")
+    recorder = TrafficRecorder(path, flush_interval=1000.0)
+    assert recorder.path == path.replace("{pid}", str(os.getpid()))
+    recorder.record(
+        b"body1",
+        MessageProperties(
+            content_type="application/json",
+            type="AccountPurge",
+            headers={
+                "x-death": [
+                    {"time": datetime(2020, 1, 1, tzinfo=timezone.utc)}
+                ]
+            },
+        ),
+    )
+    recorder.record(b"", MessageProperties())
+    with open(recorder.path, "rb") as f:
+        assert f.read() == MAGIC
+
+    recorder.close()
+    recorder.close()
+    with open(recorder.path, "rb") as f:
+        messages = list(read_captured_messages(f))
+    assert len(messages) == 2
+    assert messages[0].type == "AccountPurge"
+    assert messages[0].content_type == "application/json"
+    assert messages[0].headers == {
+        "x-death": [{"time": "2020-01-01 00:00:00+00:00"}]
+    }
+    assert messages[0].body == b"body1"
+    assert messages[0].timestamp <= messages[1].timestamp
+    assert messages[1] == CapturedMessage(
+        messages[1].timestamp, "", "", {}, b""
+    )
+
+    # Appending to an existing file.
+    recorder = TrafficRecorder(path, buffer_size=1)
+    assert recorder.path == path.replace("{pid}", str(os.getpid()))
+    recorder.record(b"body3", MessageProperties(type="AccountPurge"))
+    with open(recorder.path, "rb") as f:
+        data = f.read()
+    recorder.close()
+    assert [m.body for m in read_captured_messages(io.BytesIO(data))] == [
+        b"body1",
+        b"",
+        b"body3",
+    ]
+
+    # A truncated last record is ignored.
+    truncated = io.BytesIO(data[:-1])
+    assert len(list(read_captured_messages(truncated))) == 2
+
+    with pytest.raises(ValueError):
+        list(read_captured_messages(io.BytesIO(b"invalid")))
+
+
+def test_traffic_recorder_idle_flush(tmp_path):
+    path = str(tmp_path / "traffic.smpcap")
+    recorder = TrafficRecorder(path, flush_interval=0.01)
+    assert recorder.path == f"{path}.{os.getpid()}"
+    recorder.record(b"body", MessageProperties())
+
+    # The record is written without recording other messages.
+    for _ in range(500):
+        with open(recorder.path, "rb") as f:
+            if len(list(read_captured_messages(f))) == 1:
+                break
+        time.sleep(0.01)
+    else:  # pragma: no cover
+        assert False, "The record has not been written."
+    recorder.close()
+
+
+def test_replay_captured_messages(app, db_session):
+    messages = [
+        CapturedMessage(
+            1000.0, "AccountPurge", "application/json", {}, ACCOUNT_PURGE_BODY
+        ),
+        CapturedMessage(1000.1, "AccountPurge", "application/json", {}, b"{}"),
+        CapturedMessage(
+            1000.2,
+            "AccountPurge",
+            "application/json",
+            {},
+            ACCOUNT_PURGE_BODY.replace(b"4294967296", b"2"),
+        ),
+    ]
+    stats = replay_captured_messages(app, messages, speed=0.0, threads=2)
+    assert stats.count == 3
+    assert stats.rejected_count == 1
+    assert stats.error_count == 1
+
+    stats = replay_captured_messages(app, messages[:2], speed=2.0)
+    assert stats.count == 2
+    assert stats.rejected_count == 1
+    assert stats.error_count == 0
+    assert stats.elapsed_seconds >= 0.05
@@ -1,3 +1,4 @@
+import json
 import pytest
 import sqlalchemy
 from unittest.mock import Mock
@@ -120,6 +121,82 @@ def test_process_log_additions(app, db_session, current_ts):
     assert len(entries2) > len(entries1)
 
 
+def test_process_log_additions_batch(app, db_session, current_ts):
+    for i in range(5):
+        creditor_id = C_ID + i
+        _create_new_creditor(creditor_id, activate=True)
+        p.create_new_account(creditor_id, D_ID)
+        p.update_account_config(
+            creditor_id=creditor_id,
+            debtor_id=D_ID,
+            is_scheduled_for_deletion=True,
+            negligible_amount=1e30,
+            allow_unsafe_deletion=False,
+            config_data="",
+            latest_update_id=(
+                p.get_account_config(
+                    creditor_id, D_ID
+                ).config_latest_update_id
+                + 1
+            ),
+        )
+    assert len(p.get_creditors_with_pending_log_entries()) == 5
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=[
+            "swpt_creditors",
+            "process_log_additions",
+            "--wait=0",
+            "--batch-size=2",
+            "--quit-early",
+        ]
+    )
+    assert result.exit_code == 0
+    assert not result.output
+    assert len(p.get_creditors_with_pending_log_entries()) == 0
+
+
+def test_batch_size_controller():
+    from swpt_creditors.cli import BatchSizeController
+
+    controller = BatchSizeController(100)
+    assert controller.size == 100
+    controller.record(0)
+    assert controller.size == 100
+    controller.record(3)
+    assert controller.size == 50
+    controller.record(0)
+    assert controller.size == 56
+    for _ in range(10):
+        controller.record(1)
+    assert controller.size == 1
+    for _ in range(100):
+        controller.record(0)
+    assert controller.size == 100
+
+
+def test_process_creditor_purges(app, db_session, current_ts):
+    _create_new_creditor(C_ID, activate=True)
+    p.create_new_account(C_ID, D_ID)
+    p.deactivate_creditor(C_ID)
+    assert len(m.Account.query.all()) == 1
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=[
+            "swpt_creditors",
+            "process_creditor_purges",
+            "--wait=0",
+            "--quit-early",
+        ]
+    )
+    assert result.exit_code == 0
+    assert not result.output
+    assert len(m.Account.query.all()) == 0
+    assert p.get_pending_creditor_purges() == []
+
+
 def test_consume_messages(app):
     runner = app.test_cli_runner()
     result = runner.invoke(
@@ -241,6 +318,81 @@ def test_delete_parent_creditors(app, db_session, current_ts):
     app.config["SHARDING_REALM"] = orig_sharding_realm
 
 
+def test_scan_creditors_deleted_counts(
+    monkeypatch, app, db_session, current_ts
+):
+    from swpt_creditors.table_scanners import CreditorScanner
+
+    monkeypatch.setitem(app.config, "SHARDING_REALM", ShardingRealm("1.#"))
+    monkeypatch.setitem(app.config, "DELETE_PARENT_SHARD_RECORDS", True)
+    valid_ids = [
+        C_ID + i for i in range(100) if m.is_valid_creditor_id(C_ID + i)
+    ]
+    parent_shard_ids = [
+        C_ID + i
+        for i in range(100)
+        if not m.is_valid_creditor_id(C_ID + i)
+        and m.is_valid_creditor_id(C_ID + i, match_parent=True)
+    ]
+    not_activated_id, deactivated_id, kept_id = valid_ids[:3]
+    parent_shard_id = parent_shard_ids[0]
+
+    _create_new_creditor(not_activated_id, activate=False)
+    for creditor_id in [deactivated_id, kept_id, parent_shard_id]:
+        _create_new_creditor(creditor_id, activate=True)
+        p.create_new_account(creditor_id, D_ID)
+    p.deactivate_creditor(deactivated_id)
+    m.Creditor.query.filter_by(creditor_id=not_activated_id).update(
+        {
+            "created_at": current_ts - timedelta(days=3000),
+        }
+    )
+    m.Creditor.query.filter_by(creditor_id=deactivated_id).update(
+        {
+            "created_at": current_ts - timedelta(days=3000),
+            "deactivation_date": (current_ts - timedelta(days=3000)).date(),
+        }
+    )
+    db.session.commit()
+    assert len(m.Account.query.all()) == 3
+    assert len(m.PinInfo.query.all()) == 2
+
+    deleted_counts = {}
+    process_rows = CreditorScanner.process_rows
+
+    def process_rows_and_count_deleted(self, rows):
+        process_rows(self, rows)
+        for k, v in self.deleted_counts.items():
+            deleted_counts[k] = deleted_counts.get(k, 0) + v
+
+    monkeypatch.setattr(
+        CreditorScanner, "process_rows", process_rows_and_count_deleted
+    )
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=[
+            "swpt_creditors",
+            "scan_creditors",
+            "--days",
+            "0.000001",
+            "--quit-early",
+        ]
+    )
+    assert result.exit_code == 0
+    assert deleted_counts == {
+        "parent_shard": 1,
+        "not_activated": 1,
+        "deactivated": 1,
+    }
+
+    # The rows that belong to the deleted creditors are deleted by
+    # the database (`ON DELETE CASCADE`).
+    assert [c.creditor_id for c in m.Creditor.query.all()] == [kept_id]
+    assert [a.creditor_id for a in m.Account.query.all()] == [kept_id]
+    assert [a.creditor_id for a in m.AccountData.query.all()] == [kept_id]
+    assert [i.creditor_id for i in m.PinInfo.query.all()] == [kept_id]
+
+
 def test_scan_accounts(app, db_session, current_ts):
     _create_new_creditor(C_ID, activate=True)
     p.create_new_account(C_ID, 2)
@@ -506,6 +658,283 @@ def test_flush_messages(mocker, app, db_session):
     assert len(m.FinalizeTransferSignal.query.all()) == 0
 
 
+def test_flush_messages_bulk(mocker, app, db_session):
+    publisher = mocker.patch("swpt_creditors.models.common.publisher")
+    for i in range(3):
+        db.session.add(
+            m.FinalizeTransferSignal(
+                creditor_id=C_ID,
+                debtor_id=D_ID,
+                transfer_id=666 + i,
+                coordinator_id=C_ID,
+                coordinator_request_id=777 + i,
+                committed_amount=0,
+                transfer_note_format="",
+                transfer_note="",
+            )
+        )
+    db.session.commit()
+    assert len(m.FinalizeTransferSignal.query.all()) == 3
+
+    assert m.FinalizeTransferSignal.flush_bulk() == 3
+    assert len(m.FinalizeTransferSignal.query.all()) == 0
+    messages = [
+        message
+        for call in publisher.publish_messages.call_args_list
+        for message in call.args[0]
+    ]
+    assert len(messages) == 3
+    assert all(message.mandatory for message in messages)
+    assert sorted(
+        message.properties.headers["creditor-id"] for message in messages
+    ) == [C_ID] * 3
+
+    assert m.FinalizeTransferSignal.flush_bulk() == 0
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        args=[
+            "swpt_creditors",
+            "flush_messages",
+            "FinalizeTransferSignal",
+            "--bulk",
+            "--wait",
+            "0.1",
+            "--quit-early",
+        ]
+    )
+    assert result.exit_code == 1
+
+
+class StandInPublisher:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.messages = []
+
+    def publish_messages(self, messages):
+        if self.fail:
+            raise RuntimeError("publishing failed")
+        self.messages.extend(messages)
+
+
+def test_flush_messages_pipelined(app, db_session):
+    for i in range(5):
+        db.session.add(
+            m.FinalizeTransferSignal(
+                creditor_id=C_ID,
+                debtor_id=D_ID,
+                transfer_id=666 + i,
+                coordinator_id=C_ID,
+                coordinator_request_id=777 + i,
+                committed_amount=0,
+                transfer_note_format="",
+                transfer_note="",
+            )
+        )
+    db.session.commit()
+    burst_count_key = "APP_FLUSH_FINALIZE_TRANSFERS_BURST_COUNT"
+    burst_count = app.config[burst_count_key]
+    app.config[burst_count_key] = 2
+    try:
+        failing_publisher = StandInPublisher(fail=True)
+        with pytest.raises(RuntimeError):
+            m.FinalizeTransferSignal.flush_pipelined(
+                message_publisher=failing_publisher
+            )
+        assert len(m.FinalizeTransferSignal.query.all()) == 5
+        db.session.commit()
+
+        publisher = StandInPublisher()
+        assert (
+            m.FinalizeTransferSignal.flush_pipelined(
+                message_publisher=publisher
+            )
+            == 5
+        )
+        assert len(m.FinalizeTransferSignal.query.all()) == 0
+        assert sorted(
+            message.properties.headers["coordinator-id"]
+            for message in publisher.messages
+        ) == [C_ID] * 5
+        assert (
+            m.FinalizeTransferSignal.flush_pipelined(
+                message_publisher=publisher
+            )
+            == 0
+        )
+    finally:
+        app.config[burst_count_key] = burst_count
+
+
+def test_flush_scheduler(mocker, app, db_session, current_ts):
+    from swpt_creditors.flushing import FlushScheduler
+
+    publisher = mocker.patch("swpt_creditors.models.common.publisher")
+    for i in range(3):
+        db.session.add(
+            m.UpdatedFlagsSignal(
+                creditor_id=C_ID,
+                debtor_id=D_ID - i,
+                update_id=1,
+                config_flags=0,
+                ts=current_ts,
+            )
+        )
+    db.session.add(
+        m.FinalizeTransferSignal(
+            creditor_id=C_ID,
+            debtor_id=D_ID,
+            transfer_id=666,
+            coordinator_id=C_ID,
+            coordinator_request_id=777,
+            committed_amount=0,
+            transfer_note_format="",
+            transfer_note="",
+        )
+    )
+    db.session.commit()
+
+    burst_count_key = "APP_FLUSH_UPDATED_FLAGS_BURST_COUNT"
+    burst_count = app.config[burst_count_key]
+    app.config[burst_count_key] = 1
+    try:
+        scheduler = FlushScheduler(
+            [m.UpdatedFlagsSignal, m.FinalizeTransferSignal],
+            default_period=10.0,
+            bulk=True,
+        )
+        assert scheduler.models == [
+            m.FinalizeTransferSignal,
+            m.UpdatedFlagsSignal,
+        ]
+        assert scheduler.flush_due() == 4
+        stats = scheduler.stats[m.UpdatedFlagsSignal]
+        assert stats.sent_count == 3
+        assert stats.burst_count == 4
+        assert stats.max_delay_seconds >= 0.0
+        assert not stats.has_backlog
+        assert scheduler.flush_due() == 0
+        assert 9.0 < scheduler.get_wait_seconds() <= 10.0
+    finally:
+        app.config[burst_count_key] = burst_count
+
+    message_types = [
+        message.properties.type
+        for call in publisher.publish_messages.call_args_list
+        for message in call.args[0]
+    ]
+    assert message_types == ["FinalizeTransfer"] + ["UpdatedFlags"] * 3
+    assert len(m.UpdatedFlagsSignal.query.all()) == 0
+    assert len(m.FinalizeTransferSignal.query.all()) == 0
+
+
+def test_flush_scheduler_preemption(
+    mocker, monkeypatch, app, db_session, current_ts
+):
+    from swpt_creditors.flushing import FlushScheduler
+
+    publisher = mocker.patch("swpt_creditors.models.common.publisher")
+    for i in range(3):
+        db.session.add(
+            m.UpdatedFlagsSignal(
+                creditor_id=C_ID,
+                debtor_id=D_ID - i,
+                update_id=1,
+                config_flags=0,
+                ts=current_ts,
+            )
+        )
+    db.session.commit()
+
+    monkeypatch.setitem(app.config, "APP_FLUSH_UPDATED_FLAGS_BURST_COUNT", 1)
+    monkeypatch.setitem(
+        app.config, "APP_FLUSH_FINALIZE_TRANSFERS_PERIOD", 1e-9
+    )
+    scheduler = FlushScheduler(
+        [m.UpdatedFlagsSignal, m.FinalizeTransferSignal],
+        default_period=10.0,
+        bulk=True,
+    )
+    flush_model = scheduler._flush_model
+    flushed_models = []
+
+    def flush_model_and_insert(model):
+        result = flush_model(model)
+        flushed_models.append(model)
+        if flushed_models.count(m.UpdatedFlagsSignal) == 1:
+            # A high-priority signal arrives while the backlog of
+            # low-priority signals is being flushed.
+            db.session.add(
+                m.FinalizeTransferSignal(
+                    creditor_id=C_ID,
+                    debtor_id=D_ID,
+                    transfer_id=666,
+                    coordinator_id=C_ID,
+                    coordinator_request_id=777,
+                    committed_amount=0,
+                    transfer_note_format="",
+                    transfer_note="",
+                )
+            )
+            db.session.commit()
+        return result
+
+    mocker.patch.object(
+        scheduler, "_flush_model", side_effect=flush_model_and_insert
+    )
+    assert scheduler.flush_due() == 4
+    assert scheduler.stats[m.UpdatedFlagsSignal].burst_count == 4
+
+    message_types = [
+        message.properties.type
+        for call in publisher.publish_messages.call_args_list
+        for message in call.args[0]
+    ]
+    assert message_types == [
+        "UpdatedFlags",
+        "FinalizeTransfer",
+        "UpdatedFlags",
+        "UpdatedFlags",
+    ]
+    assert len(m.UpdatedFlagsSignal.query.all()) == 0
+    assert len(m.FinalizeTransferSignal.query.all()) == 0
+
+
+def test_flush_messages_coalesce(mocker, app, db_session, current_ts):
+    publisher = mocker.patch("swpt_creditors.models.common.publisher")
+    for debtor_id, update_id in [(D_ID, 1), (D_ID, 3), (D_ID, 2), (666, 1)]:
+        db.session.add(
+            m.UpdatedLedgerSignal(
+                creditor_id=C_ID,
+                debtor_id=debtor_id,
+                update_id=update_id,
+                account_id=str(C_ID),
+                creation_date=date(2020, 1, 1),
+                principal=update_id * 1000,
+                last_transfer_number=update_id,
+                ts=current_ts,
+            )
+        )
+    db.session.commit()
+
+    app.config["APP_FLUSH_COALESCE"] = True
+    try:
+        assert m.UpdatedLedgerSignal.flush_bulk() == 4
+    finally:
+        app.config["APP_FLUSH_COALESCE"] = False
+
+    assert len(m.UpdatedLedgerSignal.query.all()) == 0
+    messages = [
+        message
+        for call in publisher.publish_messages.call_args_list
+        for message in call.args[0]
+    ]
+    assert sorted(
+        (data["debtor_id"], data["update_id"])
+        for data in (json.loads(message.body) for message in messages)
+    ) == [(D_ID, 3), (666, 1)]
+
+
 def test_alembic_current_head(app, request, capfd):
     if request.config.option.capture != "no":
         pytest.skip("needs to be run with --capture=no")
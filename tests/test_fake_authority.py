@@ -0,0 +1,93 @@
+from uuid import UUID
+from swpt_creditors import procedures as p
+from swpt_creditors import models as m
+from swpt_creditors.fake_authority import FakeAccountingAuthority
+
+D_ID = -1
+C_ID = 4294967296
+TEST_UUID = UUID("123e4567-e89b-12d3-a456-426655440000")
+
+
+def _create_creditor(creditor_id):
+    creditor = p.reserve_creditor(creditor_id)
+    p.activate_creditor(creditor_id, str(creditor.reservation_id))
+
+
+def _get_account_data(creditor_id):
+    return m.AccountData.query.filter_by(
+        creditor_id=creditor_id, debtor_id=D_ID
+    ).one()
+
+
+def test_fake_authority(app, db_session):
+    authority = FakeAccountingAuthority(app, initial_principal=5000)
+    for creditor_id in [C_ID, C_ID + 1]:
+        _create_creditor(creditor_id)
+        p.create_new_account(creditor_id, D_ID)
+
+    assert authority.run_until_idle() > 1
+    assert len(authority.accounts) == 2
+    for creditor_id in [C_ID, C_ID + 1]:
+        data = _get_account_data(creditor_id)
+        assert data.has_server_account
+        assert data.is_config_effectual
+        assert data.principal == 5000
+        assert data.ledger_principal == 5000
+        assert data.ledger_last_transfer_number == 1
+
+    p.initiate_running_transfer(
+        creditor_id=C_ID,
+        transfer_uuid=TEST_UUID,
+        debtor_id=D_ID,
+        amount=1000,
+        recipient_uri=f"swpt:18446744073709551615/{C_ID + 1}",
+        recipient=str(C_ID + 1),
+        transfer_note_format="",
+        transfer_note="",
+    )
+    authority.run_until_idle()
+    rt = p.get_running_transfer(C_ID, TEST_UUID)
+    assert rt.is_finalized
+    assert rt.error_code is None
+    assert not authority.prepared_transfers
+    assert _get_account_data(C_ID).ledger_principal == 4000
+    assert _get_account_data(C_ID + 1).ledger_principal == 6000
+    assert len(m.CommittedTransfer.query.all()) == 4
+    assert m.PendingLogEntry.query.count() == 0
+
+    stats = authority.get_latency_stats()
+    assert stats["ConfigureAccount->AccountUpdate"].count == 4
+    assert stats["PrepareTransfer->PreparedTransfer"].count == 1
+    assert stats["FinalizeTransfer->FinalizedTransfer"].count == 1
+    assert stats["FinalizeTransfer->AccountTransfer"].count == 2
+    assert all(s.max_seconds >= s.avg_seconds >= 0.0 for s in stats.values())
+    assert set(authority.stage_seconds) == {
+        "flush_signals",
+        "deliver_responses",
+        "process_ledger_updates",
+        "process_log_additions",
+    }
+
+
+def test_fake_authority_rejected_transfer(app, db_session):
+    authority = FakeAccountingAuthority(app)
+    _create_creditor(C_ID)
+    p.create_new_account(C_ID, D_ID)
+    authority.run_until_idle()
+
+    p.initiate_running_transfer(
+        creditor_id=C_ID,
+        transfer_uuid=TEST_UUID,
+        debtor_id=D_ID,
+        amount=1000,
+        recipient_uri="swpt:18446744073709551615/666",
+        recipient="666",
+        transfer_note_format="",
+        transfer_note="",
+    )
+    authority.run_until_idle()
+    rt = p.get_running_transfer(C_ID, TEST_UUID)
+    assert rt.is_finalized
+    assert rt.error_code == "RECIPIENT_IS_UNREACHABLE"
+    stats = authority.get_latency_stats()
+    assert stats["PrepareTransfer->RejectedTransfer"].count == 1
@@ -0,0 +1,221 @@
+import math
+import random
+import pytest
+from datetime import datetime, date, timezone
+from marshmallow import Schema, ValidationError, fields, validate
+from marshmallow import validates, validates_schema, post_load, EXCLUDE
+from swpt_creditors.fast_schemas import CompiledSchema
+
+MIN_INT64 = -1 << 63
+MAX_INT64 = (1 << 63) - 1
+
+
+class ExampleSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    type = fields.String(required=True)
+    amount = fields.Integer(
+        required=True, validate=validate.Range(min=0, max=MAX_INT64)
+    )
+    rate = fields.Float(required=True)
+    note = fields.String(
+        load_default="", validate=validate.Length(max=10), data_key="n"
+    )
+    ts = fields.DateTime(required=True)
+    creation_date = fields.Date(allow_none=True)
+    flags = fields.Integer(strict=True, load_default=lambda: 0)
+
+    @validates("type")
+    def validate_type(self, value, **kwargs):
+        if value != "Example":
+            raise ValidationError("Invalid type.")
+
+    @validates_schema
+    def validate_note(self, data, **kwargs):
+        if data["amount"] == 0 and data["note"] != "":
+            raise ValidationError("A note is not allowed.")
+
+    @post_load
+    def add_total(self, data, **kwargs):
+        data["total"] = data["amount"] + data["flags"]
+        return data
+
+
+def _load(load, data):
+    try:
+        return "ok", load(data)
+    except ValidationError as e:
+        return "error", e.normalized_messages()
+
+
+def _get_range(field):
+    for validator in field.validators:
+        if isinstance(validator, validate.Range):
+            return validator.min, validator.max
+    return None, None
+
+
+def _generate_value(rnd, field, message_type):
+    if isinstance(field, fields.Constant):
+        return field.constant
+    if isinstance(field, fields.Integer):
+        min_value, max_value = _get_range(field)
+        min_value = MIN_INT64 if min_value is None else min_value
+        max_value = MAX_INT64 if max_value is None else max_value
+        return rnd.choice(
+            [
+                min_value,
+                max_value,
+                0 if min_value <= 0 <= max_value else min_value,
+                rnd.randint(min_value, max_value),
+            ]
+        )
+    if isinstance(field, fields.Float):
+        return rnd.choice([0.0, 1.5, -3.0, 1e30, 5])
+    if isinstance(field, fields.Date):
+        return rnd.choice(["2020-01-01", "1970-12-31"])
+    if isinstance(field, fields.DateTime):
+        return rnd.choice(
+            [
+                "2099-12-31T00:00:00+00:00",
+                "2020-01-01T12:30:15.123456Z",
+                datetime.now(tz=timezone.utc).isoformat(),
+            ]
+        )
+    if isinstance(field, fields.Boolean):
+        return rnd.choice([True, False])
+    if isinstance(field, fields.String):
+        return rnd.choice(
+            [
+                message_type,
+                "",
+                "1",
+                "abc",
+                "Привет!",
+                "https://example.com/debtors/1/",
+                "text/plain",
+                "0" * 64,
+                "swpt:1/2",
+            ]
+        )
+    return None
+
+
+_INVALID_VALUES = [
+    None,
+    True,
+    False,
+    "",
+    "1",
+    "not a date",
+    "2020-13-01",
+    1.5,
+    float("nan"),
+    float("inf"),
+    -1,
+    1 << 64,
+    -(1 << 64),
+    1e400,
+    [],
+    {},
+    "x" * 1000,
+]
+
+
+def _generate_message(rnd, schema, message_type):
+    message = {}
+    for field_name, field in schema.load_fields.items():
+        data_key = field.data_key or field_name
+        if rnd.random() < 0.97:
+            message[data_key] = _generate_value(rnd, field, message_type)
+
+    for _ in range(rnd.choice([0, 0, 0, 1, 2])):
+        mutation = rnd.random()
+        keys = list(message)
+        if mutation < 0.3 and keys:
+            del message[rnd.choice(keys)]
+        elif mutation < 0.8 and keys:
+            message[rnd.choice(keys)] = rnd.choice(_INVALID_VALUES)
+        else:
+            message[rnd.choice(["unknown", "extra"])] = rnd.choice(
+                _INVALID_VALUES
+            )
+    return message
+
+
+def _fuzz(schema, message_type, count, seed=0):
+    rnd = random.Random(seed)
+    compiled_schema = CompiledSchema(schema)
+    accepted = 0
+    for _ in range(count):
+        message = _generate_message(rnd, schema, message_type)
+        expected = _load(schema.load, message)
+        actual = _load(compiled_schema.load, message)
+        if expected[0] == "ok" and actual[0] == "ok":
+            # NOTE: NaN values are not equal to themselves.
+            assert repr(actual) == repr(expected), message
+        else:
+            assert actual == expected, message
+        accepted += expected[0] == "ok"
+    return accepted
+
+
+def test_compiled_example_schema():
+    schema = ExampleSchema()
+    compiled_schema = CompiledSchema(schema)
+    assert compiled_schema.is_compiled
+    data = {
+        "type": "Example",
+        "amount": 5,
+        "rate": 1,
+        "n": "note",
+        "ts": "2099-12-31T00:00:00+00:00",
+        "unknown": 1,
+    }
+    result = compiled_schema._load(data)
+    assert result == schema.load(data)
+    assert result == {
+        "type": "Example",
+        "amount": 5,
+        "rate": 1.0,
+        "note": "note",
+        "ts": datetime(2099, 12, 31, tzinfo=timezone.utc),
+        "flags": 0,
+        "total": 5,
+    }
+    assert type(result["rate"]) is float
+
+    data["creation_date"] = "2020-01-02"
+    assert compiled_schema._load(data)["creation_date"] == date(2020, 1, 2)
+
+    for invalid_data in [
+        [],
+        dict(data, type="Other"),
+        dict(data, amount=-1),
+        dict(data, amount=True),
+        dict(data, amount="5"),
+        dict(data, rate=math.nan),
+        dict(data, n="x" * 11),
+        dict(data, amount=0),
+        dict(data, ts="invalid"),
+        dict(data, flags=None),
+    ]:
+        with pytest.raises(Exception):
+            compiled_schema._load(invalid_data)
+
+    # Non-strict integer fields accept strings, but the compiled code
+    # path leaves them to marshmallow.
+    assert compiled_schema.load(dict(data, amount="5"))["amount"] == 5
+    with pytest.raises(ValidationError):
+        compiled_schema.load(dict(data, amount=-1))
+
+    assert _fuzz(schema, "Example", 3000) > 100
+
+
+def test_compiled_message_schemas():
+    from swpt_creditors.actors import _MESSAGE_TYPES, _COMPILED_SCHEMAS
+
+    for message_type, (schema, _) in _MESSAGE_TYPES.items():
+        assert _COMPILED_SCHEMAS[message_type].schema is schema
+        _fuzz(schema, message_type, 1000)
@@ -1,4 +1,7 @@
+from uuid import UUID
 from swpt_creditors import inspect_ops
+from swpt_creditors.extensions import db
+from swpt_creditors import procedures as p
 import pytest
 
 D_ID = -1
@@ -22,3 +25,175 @@ def test_forbidden_operations(app):
 
     with pytest.raises(inspect_ops.ForbiddenOperation):
         inspect_ops.allow_account_reconfig(C_ID, D_ID)
+
+
+def test_inspected_operations(app, db_session, monkeypatch):
+    monkeypatch.setitem(app.config, "APP_MAX_CREDITOR_ACCOUNTS", 1)
+    monkeypatch.setitem(app.config, "APP_MAX_CREDITOR_TRANSFERS", 1)
+    monkeypatch.setitem(app.config, "APP_MAX_CREDITOR_RECONFIGS", 3)
+    monkeypatch.setitem(app.config, "APP_MAX_CREDITOR_INITIATIONS", 1000)
+    creditor = p.reserve_creditor(C_ID)
+    p.activate_creditor(C_ID, str(creditor.reservation_id))
+
+    account = inspect_ops.create_account(C_ID, D_ID)
+    assert account.debtor_id == D_ID
+    with pytest.raises(inspect_ops.ForbiddenOperation):
+        inspect_ops.create_account(C_ID, 1)
+    assert not p.has_account(C_ID, 1)
+
+    # The account number must not change when the deletion fails.
+    with pytest.raises(p.AccountDoesNotExist):
+        inspect_ops.delete_account(C_ID, 1)
+    with pytest.raises(inspect_ops.ForbiddenOperation):
+        inspect_ops.allow_account_creation(C_ID, 1)
+    inspect_ops.delete_account(C_ID, D_ID)
+    assert inspect_ops.create_accounts(C_ID, [D_ID, D_ID]) == {D_ID: True}
+
+    assert inspect_ops.reconfig_account(C_ID, D_ID, lambda: 42) == 42
+    with pytest.raises(inspect_ops.ForbiddenOperation):
+        inspect_ops.reconfig_account(C_ID, D_ID, lambda: 42)
+
+    transfer_uuid = UUID("123e4567-e89b-12d3-a456-426655440000")
+    transfer = inspect_ops.initiate_transfer(
+        creditor_id=C_ID,
+        debtor_id=D_ID,
+        transfer_uuid=transfer_uuid,
+        amount=1000,
+        recipient_uri="swpt:18446744073709551615/666",
+        recipient="666",
+        transfer_note_format="",
+        transfer_note="",
+    )
+    assert transfer.transfer_uuid == transfer_uuid
+    with pytest.raises(inspect_ops.ForbiddenOperation):
+        inspect_ops.allow_transfer_creation(C_ID, D_ID)
+
+    # The transfer number must not change when the deletion fails.
+    with pytest.raises(p.TransferDoesNotExist):
+        inspect_ops.delete_transfer(
+            C_ID, UUID("123e4567-e89b-12d3-a456-426655440001")
+        )
+    with pytest.raises(inspect_ops.ForbiddenOperation):
+        inspect_ops.allow_transfer_creation(C_ID, D_ID)
+    inspect_ops.delete_transfer(C_ID, transfer_uuid)
+    inspect_ops.allow_transfer_creation(C_ID, D_ID)
+
+
+def test_token_buckets():
+    buckets = inspect_ops.TokenBuckets(
+        max_reconfigs=2,
+        max_initiations=1,
+        clear_hours=1000.0,
+        flush_seconds=1000.0,
+        max_creditors=2,
+    )
+    assert buckets.try_consume(inspect_ops.RECONFIGS, C_ID, 3)
+    assert buckets.try_consume(inspect_ops.RECONFIGS, C_ID)
+    assert not buckets.try_consume(inspect_ops.RECONFIGS, C_ID)
+    assert buckets.try_consume(inspect_ops.RECONFIGS, C_ID + 1, 4)
+    assert not buckets.try_consume(inspect_ops.INITIATIONS, C_ID, 3)
+    assert buckets.try_consume(inspect_ops.INITIATIONS, C_ID, 2)
+    assert not buckets.try_consume(inspect_ops.INITIATIONS, C_ID)
+
+    # Forgotten buckets are full again.
+    assert buckets.try_consume(inspect_ops.INITIATIONS, C_ID + 2, 2)
+    assert buckets.try_consume(inspect_ops.INITIATIONS, C_ID + 3, 2)
+    assert buckets.try_consume(inspect_ops.RECONFIGS, C_ID, 4)
+
+    assert not buckets.try_consume(inspect_ops.INITIATIONS, C_ID + 3)
+    buckets.refund(inspect_ops.INITIATIONS, C_ID + 3, 5)
+    assert buckets.try_consume(inspect_ops.INITIATIONS, C_ID + 3, 2)
+    assert not buckets.try_consume(inspect_ops.INITIATIONS, C_ID + 3)
+    buckets.refund(inspect_ops.INITIATIONS, C_ID + 4)
+    assert len(buckets.buckets) == 4
+
+    assert buckets.can_add_reconfigs(C_ID)
+    assert buckets.add_reconfigs(C_ID)
+    assert buckets.add_reconfigs(C_ID, 2)
+    assert buckets.add_reconfigs(C_ID + 1)
+    assert buckets.can_add_reconfigs(C_ID)
+    assert not buckets.can_add_reconfigs(C_ID + 2)
+    assert not buckets.add_reconfigs(C_ID + 2)
+    assert buckets.add_reconfigs(C_ID)
+    reconfigs = buckets.take_reconfigs(1)
+    assert len(reconfigs) == 1
+    reconfigs.update(buckets.take_reconfigs(10))
+    assert reconfigs == {C_ID: 4, C_ID + 1: 1}
+    assert buckets.take_reconfigs(10) == {}
+    assert buckets.add_reconfigs(C_ID)
+    buckets.restore_reconfigs(reconfigs)
+    assert buckets.take_reconfigs(10) == {C_ID: 5, C_ID + 1: 1}
+
+
+def test_inspected_operations_with_token_buckets(app, db_session, monkeypatch):
+    monkeypatch.setitem(app.config, "APP_CREDITOR_DOS_BUCKETS", True)
+    monkeypatch.setitem(
+        app.config, "APP_CREDITOR_DOS_BUCKETS_FLUSH_SECONDS", 1000.0
+    )
+    monkeypatch.setitem(app.config, "APP_MAX_CREDITOR_ACCOUNTS", 1000)
+    monkeypatch.setitem(app.config, "APP_MAX_CREDITOR_RECONFIGS", 3)
+    monkeypatch.setitem(
+        app.extensions, inspect_ops.TOKEN_BUCKETS_EXTENSION, None
+    )
+    creditor = p.reserve_creditor(C_ID)
+    p.activate_creditor(C_ID, str(creditor.reservation_id))
+
+    # The bucket holds 6 tokens. Only registered operations are charged.
+    inspect_ops.create_account(C_ID, D_ID)
+    with pytest.raises(p.AccountExists):
+        inspect_ops.create_account(C_ID, D_ID)
+    assert inspect_ops.create_accounts(C_ID, [D_ID, D_ID, 1]) == {
+        D_ID: False,
+        1: True,
+    }
+    assert not p.is_account_reconfig_allowed(C_ID, 2)
+    assert p.is_account_reconfig_allowed(C_ID, 3)
+    inspect_ops.reconfig_account(C_ID, D_ID, lambda: None)
+
+    # The reconfig is written to the database only when flushed.
+    assert p.is_account_reconfig_allowed(C_ID, 3)
+    assert inspect_ops.flush_reconfigs() == 1
+    assert not p.is_account_reconfig_allowed(C_ID, 3)
+    assert inspect_ops.flush_reconfigs() == 0
+
+    # The bucket still has tokens, but the database says no.
+    with pytest.raises(inspect_ops.ForbiddenOperation):
+        inspect_ops.reconfig_account(C_ID, D_ID, lambda: None)
+
+    def conflict():
+        raise p.UpdateConflict()
+
+    monkeypatch.setitem(app.config, "APP_MAX_CREDITOR_RECONFIGS", 1000)
+    with pytest.raises(p.UpdateConflict):
+        inspect_ops.reconfig_account(C_ID, D_ID, conflict)
+
+    # Once the bucket is empty, the database is not consulted at all.
+    for _ in range(3):
+        inspect_ops.allow_account_reconfig(C_ID, D_ID)
+    with pytest.raises(inspect_ops.ForbiddenOperation):
+        inspect_ops.allow_account_reconfig(C_ID, D_ID)
+
+
+def test_reconfigs_are_accumulated_after_commit(app, db_session, monkeypatch):
+    monkeypatch.setitem(app.config, "APP_CREDITOR_DOS_BUCKETS", True)
+    monkeypatch.setitem(
+        app.config, "APP_CREDITOR_DOS_BUCKETS_FLUSH_SECONDS", 1000.0
+    )
+    monkeypatch.setitem(
+        app.extensions, inspect_ops.TOKEN_BUCKETS_EXTENSION, None
+    )
+    creditor = p.reserve_creditor(C_ID)
+    p.activate_creditor(C_ID, str(creditor.reservation_id))
+    p.create_new_account(C_ID, D_ID)
+
+    @db.atomic
+    def reconfig_and_fail():
+        inspect_ops.reconfig_account(C_ID, D_ID, lambda: None)
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        reconfig_and_fail()
+    assert inspect_ops.flush_reconfigs() == 0
+
+    inspect_ops.reconfig_account(C_ID, D_ID, lambda: None)
+    assert inspect_ops.flush_reconfigs() == 1
@@ -1,4 +1,4 @@
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, date, timezone, timedelta
 from swpt_creditors import models as m
 
 
@@ -57,3 +57,119 @@ def test_log_entry(db_session, current_ts):
     assert le.is_created
     le.is_deleted = True
     assert not le.is_created
+
+
+def _get_sample_signals(current_ts):
+    creditor_id = 4294967296 + 5
+    return [
+        m.ConfigureAccountSignal(
+            creditor_id=creditor_id,
+            debtor_id=-3,
+            ts=current_ts,
+            seqnum=1,
+            negligible_amount=1e-5,
+            config_data='ü"\n\x00',
+            config_flags=0,
+        ),
+        m.PrepareTransferSignal(
+            creditor_id=creditor_id,
+            coordinator_request_id=2,
+            debtor_id=3,
+            recipient="recipient",
+            locked_amount=5,
+            final_interest_rate_ts=current_ts,
+            max_commit_delay=9,
+            inserted_at=current_ts,
+        ),
+        m.FinalizeTransferSignal(
+            creditor_id=creditor_id,
+            signal_id=1,
+            debtor_id=3,
+            transfer_id=4,
+            coordinator_id=creditor_id,
+            coordinator_request_id=7,
+            committed_amount=0,
+            transfer_note_format="",
+            transfer_note="Привет!",
+            inserted_at=current_ts,
+        ),
+        m.UpdatedLedgerSignal(
+            creditor_id=creditor_id,
+            debtor_id=3,
+            update_id=1,
+            creation_date=date(2020, 1, 1),
+            account_id="account",
+            principal=-1,
+            last_transfer_number=2,
+            ts=current_ts,
+        ),
+        m.UpdatedPolicySignal(
+            creditor_id=creditor_id,
+            debtor_id=3,
+            update_id=1,
+            policy_name=None,
+            min_principal=0,
+            max_principal=10,
+            peg_exchange_rate=None,
+            peg_debtor_id=None,
+            ts=current_ts,
+        ),
+        m.UpdatedPolicySignal(
+            creditor_id=creditor_id,
+            debtor_id=3,
+            update_id=2,
+            policy_name="conservative",
+            min_principal=0,
+            max_principal=10,
+            peg_exchange_rate=1.5,
+            peg_debtor_id=5,
+            ts=current_ts,
+        ),
+        m.UpdatedFlagsSignal(
+            creditor_id=creditor_id,
+            debtor_id=3,
+            update_id=1,
+            config_flags=3,
+            ts=current_ts,
+        ),
+        m.RejectedConfigSignal(
+            creditor_id=1,
+            debtor_id=3,
+            signal_id=1,
+            config_ts=current_ts,
+            config_seqnum=1,
+            config_flags=0,
+            config_data="",
+            negligible_amount=0.1,
+            rejection_code="INVALID_CONFIGURATION",
+            inserted_at=current_ts,
+        ),
+    ]
+
+
+def test_signal_message_encoder(app, current_ts):
+    for signal in _get_sample_signals(current_ts):
+        encoder = type(signal).get_message_encoder()
+        assert type(signal).get_message_encoder() is encoder
+        expected = signal._create_message()
+        messages = encoder.encode_messages([signal, signal])
+        assert len(messages) == 2
+        message = messages[0]
+        assert messages[1].properties is not message.properties
+        assert messages[1].properties.headers is not message.properties.headers
+        assert encoder.properties_template.headers is None
+        assert message.body == expected.body
+        assert message.exchange == expected.exchange
+        assert message.routing_key == expected.routing_key
+        assert message.mandatory == expected.mandatory
+        assert message.properties.type == expected.properties.type
+        assert message.properties.headers == expected.properties.headers
+        assert (
+            message.properties.delivery_mode
+            == expected.properties.delivery_mode
+        )
+        assert message.properties.app_id == expected.properties.app_id
+        assert (
+            message.properties.content_type
+            == expected.properties.content_type
+        )
@@ -1,5 +1,6 @@
 import pytest
 import time
+import sqlalchemy
 from datetime import date, timedelta, datetime, timezone
 from uuid import UUID
 from swpt_pythonlib.utils import i64_to_u64
@@ -62,6 +63,71 @@ def test_activate_new_creditor(db_session):
         p.reserve_creditor(C_ID)
 
 
+def test_iter_creditor_ids(db_session):
+    for creditor_id in [C_ID, C_ID + 1, C_ID + 2, C_ID + 3]:
+        creditor = p.reserve_creditor(creditor_id)
+        if creditor_id != C_ID + 2:
+            p.activate_creditor(creditor_id, str(creditor.reservation_id))
+
+    chunks = list(p.iter_creditor_ids(C_ID, chunk_size=2))
+    assert chunks == [[C_ID, C_ID + 1], [C_ID + 3]]
+    db.session.commit()
+
+    assert list(p.iter_creditor_ids(C_ID + 2)) == [[C_ID + 3]]
+    db.session.commit()
+    assert list(p.iter_creditor_ids(C_ID + 4)) == []
+    db.session.commit()
+
+
+def test_reserve_creditors(db_session, current_ts):
+    p.reserve_creditor(C_ID)
+    db.session.add(
+        LogEntry(
+            creditor_id=C_ID + 1,
+            entry_id=5,
+            object_type="Test",
+            object_uri="/test",
+            object_update_id=1,
+            added_at=current_ts,
+        )
+    )
+    db.session.commit()
+    assert p.reserve_creditors([]) == []
+
+    rows = p.reserve_creditors([C_ID, C_ID + 1, C_ID + 2, C_ID + 2])
+    assert sorted(row.creditor_id for row in rows) == [C_ID + 1, C_ID + 2]
+    assert all(row.reservation_id is not None for row in rows)
+    assert all(row.created_at is not None for row in rows)
+    assert Creditor.query.filter_by(creditor_id=C_ID + 1).one(
+    ).last_log_entry_id == 6
+    assert Creditor.query.filter_by(creditor_id=C_ID + 2).one(
+    ).last_log_entry_id == 0
+    assert not p.get_active_creditor(C_ID + 1)
+
+    rows = p.reserve_creditors([C_ID + 2, C_ID + 3], activate=True)
+    assert [row.creditor_id for row in rows] == [C_ID + 3]
+    assert rows[0].reservation_id is None
+    assert p.get_active_creditor(C_ID + 3)
+    assert p.get_pin_info(C_ID + 3)
+    assert not p.get_pin_info(C_ID + 2)
+
+
+def test_reserve_random_creditors(db_session):
+    rows = p.reserve_random_creditors(
+        5,
+        min_creditor_id=C_ID,
+        max_creditor_id=C_ID + 1000,
+        activate=True,
+        chunk_size=2,
+    )
+    assert len(rows) == 5
+    creditor_ids = {row.creditor_id for row in rows}
+    assert len(creditor_ids) == 5
+    assert all(C_ID <= x <= C_ID + 1000 for x in creditor_ids)
+    assert all(p.get_active_creditor(x) for x in creditor_ids)
+    assert len(Creditor.query.all()) == 5
+
+
 def test_create_account(creditor):
     with pytest.raises(p.CreditorDoesNotExist):
         p.create_new_account(666, D_ID)
@@ -72,14 +138,108 @@ def test_create_account(creditor):
     assert account.debtor_id == D_ID
 
 
+def test_create_accounts(creditor):
+    with pytest.raises(p.CreditorDoesNotExist):
+        p.create_new_accounts(666, [D_ID])
+
+    p.create_new_account(C_ID, D_ID)
+    creditor = p.get_active_creditor(C_ID)
+    last_log_entry_id = creditor.last_log_entry_id
+    accounts_list_latest_update_id = creditor.accounts_list_latest_update_id
+    assert p.create_new_accounts(C_ID, [1, D_ID, 2, 1]) == {
+        1: True,
+        D_ID: False,
+        2: True,
+    }
+    assert p.create_new_accounts(C_ID, []) == {}
+    assert sorted(p.get_account_debtor_ids(C_ID, count=10)) == [D_ID, 1, 2]
+    signals = ConfigureAccountSignal.query.all()
+    assert sorted(s.debtor_id for s in signals) == [D_ID, 1, 2]
+    assert all(s.seqnum == 0 for s in signals)
+
+    account = p.get_account(C_ID, 1)
+    assert account.data.ledger_last_entry_id == 1
+    assert account.knowledge.data == {}
+    assert account.display.debtor_name is None
+    assert account.exchange.policy is None
+
+    creditor = p.get_active_creditor(C_ID)
+    assert creditor.last_log_entry_id == last_log_entry_id + 3
+    assert (
+        creditor.accounts_list_latest_update_id
+        == accounts_list_latest_update_id + 1
+    )
+    log_entries = (
+        models.LogEntry.query.filter(
+            models.LogEntry.creditor_id == C_ID,
+            models.LogEntry.entry_id > last_log_entry_id,
+        )
+        .order_by(models.LogEntry.entry_id)
+        .all()
+    )
+    assert [e.object_type for e in log_entries] == [
+        "Account",
+        "Account",
+        "AccountsList",
+    ]
+    assert log_entries[0].object_uri == "/creditors/4294967296/accounts/1/"
+    assert log_entries[0].object_update_id == account.latest_update_id
+    assert (
+        log_entries[2].object_update_id
+        == creditor.accounts_list_latest_update_id
+    )
+
+
 def test_deactivate_creditor(account):
     assert p.get_active_creditor(C_ID)
     assert len(models.Account.query.all()) == 1
     assert len(models.PinInfo.query.all()) == 1
     p.deactivate_creditor(C_ID)
     assert p.get_active_creditor(C_ID) is None
-    assert len(models.Account.query.all()) == 0
     assert len(models.PinInfo.query.all()) == 0
+    assert p.get_pending_creditor_purges() == [(C_ID,)]
+    assert p.process_pending_creditor_purge(C_ID, burst_count=1000)
+    assert len(models.Account.query.all()) == 0
+    assert p.get_pending_creditor_purges() == []
+
+    p.deactivate_creditor(C_ID)
+    assert p.get_pending_creditor_purges() == []
+
+
+def test_purge_deactivated_creditor(account, current_ts):
+    p.create_new_account(C_ID, 1)
+    p.create_new_account(C_ID, 2)
+    for i in range(3):
+        p.initiate_running_transfer(
+            creditor_id=C_ID,
+            transfer_uuid=UUID(int=i),
+            debtor_id=D_ID,
+            amount=1000,
+            recipient_uri="swpt:18446744073709551615/666",
+            recipient="666",
+            transfer_note_format="",
+            transfer_note="",
+        )
+    p.deactivate_creditor(C_ID)
+    uls_count = len(models.UpdatedLedgerSignal.query.all())
+    assert len(models.Account.query.all()) == 3
+    assert len(models.RunningTransfer.query.all()) == 3
+
+    assert not p.process_pending_creditor_purge(C_ID, burst_count=2)
+    assert len(models.Account.query.all()) == 1
+    assert len(models.AccountData.query.all()) == 1
+    assert len(models.RunningTransfer.query.all()) == 1
+    purge = models.PendingCreditorPurge.query.one()
+    assert purge.deleted_accounts_count == 2
+    assert purge.deleted_transfers_count == 2
+
+    assert p.process_pending_creditor_purge(C_ID, burst_count=2)
+    assert len(models.Account.query.all()) == 0
+    assert len(models.AccountData.query.all()) == 0
+    assert len(models.RunningTransfer.query.all()) == 0
+    assert models.PendingCreditorPurge.query.count() == 0
+    assert len(models.UpdatedLedgerSignal.query.all()) == uls_count + 3
+    assert p.process_pending_creditor_purge(C_ID, burst_count=2)
 
 
 def test_delete_account_without_debtor_name(account, current_ts):
@@ -394,6 +554,143 @@ def test_process_account_update_signal(account):
     assert len(models.UpdatedLedgerSignal.query.all()) == 2
 
 
+def _add_sample_pending_log_entries(creditor_id, current_ts):
+    paths, types = p.get_paths_and_types()
+    entries = [
+        dict(object_type_hint=LogEntry.OTH_TRANSFER, transfer_uuid=TEST_UUID,
+             object_update_id=1),
+        dict(object_type_hint=LogEntry.OTH_TRANSFER, transfer_uuid=TEST_UUID,
+             object_update_id=2, data_finalized_at=current_ts,
+             data_error_code="TEST"),
+        dict(object_type=types.account_info, object_uri="/info",
+             object_update_id=5, data={"test": 1}),
+        dict(object_type_hint=LogEntry.OTH_ACCOUNT_LEDGER, debtor_id=D_ID,
+             object_update_id=3, data_principal=1000,
+             data_next_entry_id=4),
+        dict(object_type_hint=LogEntry.OTH_COMMITTED_TRANSFER,
+             debtor_id=D_ID, creation_date=date(2020, 1, 2),
+             transfer_number=7),
+        dict(object_type=types.transfer, object_uri="/transfer",
+             object_update_id=3, is_deleted=True),
+        dict(object_type_hint=LogEntry.OTH_TRANSFER, transfer_uuid=TEST_UUID2),
+        dict(object_type=types.account, object_uri="/account",
+             object_update_id=1),
+    ]
+    for i, entry in enumerate(entries):
+        db.session.add(
+            models.PendingLogEntry(
+                creditor_id=creditor_id,
+                added_at=current_ts + timedelta(seconds=i),
+                **entry,
+            )
+        )
+    db.session.commit()
+
+
+def _get_log_entries_and_counters(creditor_id):
+    columns = ["entry_id", *p.LOG_ENTRY_COPIED_COLUMNS]
+    log_entries = [
+        tuple(getattr(le, c) for c in columns)
+        for le in LogEntry.query.filter_by(creditor_id=creditor_id)
+        .order_by(LogEntry.entry_id)
+        .all()
+    ]
+    creditor = Creditor.query.filter_by(creditor_id=creditor_id).one()
+    counters = (
+        creditor.last_log_entry_id,
+        creditor.transfers_list_latest_update_id,
+        creditor.transfers_list_latest_update_ts,
+    )
+    return log_entries, counters
+
+
+@pytest.mark.parametrize("existing_entries", [0, 2])
+def test_process_pending_log_entries_set_based(
+    creditor, current_ts, existing_entries
+):
+    from swpt_creditors.procedures.creditors import (
+        _process_pending_log_entries_one_by_one,
+    )
+
+    for _ in range(existing_entries):
+        _add_sample_pending_log_entries(C_ID, current_ts)
+        p.process_pending_log_entries(C_ID)
+
+    initial_state = _get_log_entries_and_counters(C_ID)
+    _add_sample_pending_log_entries(C_ID, current_ts)
+    p.process_pending_log_entries(C_ID)
+    assert models.PendingLogEntry.query.count() == 0
+    set_based_result = _get_log_entries_and_counters(C_ID)
+
+    # Restore the initial state, and use the reference implementation.
+    LogEntry.query.filter(
+        LogEntry.entry_id > initial_state[1][0]
+    ).delete(synchronize_session=False)
+    Creditor.query.filter_by(creditor_id=C_ID).update(
+        {
+            Creditor.last_log_entry_id: initial_state[1][0],
+            Creditor.transfers_list_latest_update_id: initial_state[1][1],
+            Creditor.transfers_list_latest_update_ts: initial_state[1][2],
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+    assert _get_log_entries_and_counters(C_ID) == initial_state
+
+    _add_sample_pending_log_entries(C_ID, current_ts)
+    db.atomic(_process_pending_log_entries_one_by_one)(C_ID)
+    assert models.PendingLogEntry.query.count() == 0
+    assert _get_log_entries_and_counters(C_ID) == set_based_result
+
+    log_entries, counters = set_based_result
+    assert len(log_entries) == len(initial_state[0]) + 11
+    assert counters[0] == initial_state[1][0] + 11
+    assert counters[1] == initial_state[1][1] + 3
+    assert counters[2] == current_ts + timedelta(seconds=6)
+
+    # Pending log entries for non-existing creditors are deleted.
+    _add_sample_pending_log_entries(1235, current_ts)
+    p.process_pending_log_entries(1235)
+    assert models.PendingLogEntry.query.count() == 0
+    assert LogEntry.query.filter_by(creditor_id=1235).count() == 0
+
+
+def test_process_pending_log_entries_batch(creditor, current_ts):
+    p.reserve_creditor(C_ID + 1)
+    p.reserve_creditor(C_ID + 2)
+    initial_states = {
+        creditor_id: _get_log_entries_and_counters(creditor_id)
+        for creditor_id in [C_ID, C_ID + 1, C_ID + 2]
+    }
+    for creditor_id in [C_ID, C_ID + 1, C_ID + 2, 1235]:
+        _add_sample_pending_log_entries(creditor_id, current_ts)
+
+    # Lock one of the creditors from another connection.
+    with db.engine.connect() as conn:
+        conn.execute(
+            sqlalchemy.text(
+                "SELECT creditor_id FROM creditor"
+                " WHERE creditor_id = :creditor_id FOR UPDATE"
+            ),
+            {"creditor_id": C_ID + 2},
+        )
+        assert p.process_pending_log_entries_batch(
+            [C_ID + 2, 1235, C_ID + 1, C_ID]
+        ) == [C_ID + 2]
+        conn.rollback()
+
+    assert list(p.get_creditors_with_pending_log_entries()) == [(C_ID + 2,)]
+    assert p.process_pending_log_entries_batch([C_ID + 2]) == []
+    assert models.PendingLogEntry.query.count() == 0
+    for creditor_id, initial_state in initial_states.items():
+        log_entries, counters = _get_log_entries_and_counters(creditor_id)
+        assert len(log_entries) == len(initial_state[0]) + 11
+        assert counters[0] == initial_state[1][0] + 11
+        assert counters[1] == initial_state[1][1] + 3
+
+    assert p.process_pending_log_entries_batch([]) == []
+
+
 def test_process_rejected_config_signal(account):
     c = p.get_account_config(C_ID, D_ID)
     assert c.config_error is None
@@ -716,13 +1013,13 @@ def test_process_account_transfer_signal(account, current_ts):
         "previous_transfer_number": 0,
         "retention_interval": timedelta(days=5),
     }
-    p.process_account_transfer_signal(**params)
+    assert not p.process_account_transfer_signal(**params)
     assert len(CommittedTransfer.query.all()) == 0
     assert get_committed_tranfer_entries_count() == 0
     assert not has_pending_ledger_update()
 
     params["retention_interval"] = timedelta(days=7)
-    p.process_account_transfer_signal(**params)
+    assert p.process_account_transfer_signal(**params)
     ct = CommittedTransfer.query.one()
     assert ct.debtor_id == D_ID
     assert ct.creditor_id == C_ID
@@ -972,6 +1269,65 @@ def test_process_pending_ledger_update_missing_last_transfer(
     assert data.ledger_latest_update_id == ledger_latest_update_id + 2
 
 
+def test_initiate_running_transfers(account, current_ts):
+    uuids = [UUID(int=i) for i in range(3)]
+
+    def transfer(transfer_uuid, amount=1000):
+        return dict(
+            transfer_uuid=transfer_uuid,
+            debtor_id=D_ID,
+            amount=amount,
+            recipient_uri="swpt:18446744073709551615/666",
+            recipient="666",
+            transfer_note_format="",
+            transfer_note="",
+            deadline=current_ts + timedelta(seconds=1000),
+        )
+
+    with pytest.raises(p.CreditorDoesNotExist):
+        p.initiate_running_transfers(666, [transfer(uuids[0])])
+
+    def get_transfers_list_latest_update_id():
+        return Creditor.query.filter_by(
+            creditor_id=C_ID
+        ).one().transfers_list_latest_update_id
+
+    transfers_list_latest_update_id = get_transfers_list_latest_update_id()
+
+    p.initiate_running_transfer(creditor_id=C_ID, **transfer(uuids[0]))
+    with pytest.raises(p.UpdateConflict):
+        p.initiate_running_transfers(C_ID, [transfer(uuids[0], 999)])
+    with pytest.raises(p.UpdateConflict):
+        p.initiate_running_transfers(
+            C_ID, [transfer(uuids[1]), transfer(uuids[1], 999)]
+        )
+    assert len(RunningTransfer.query.all()) == 1
+
+    assert p.initiate_running_transfers(
+        C_ID,
+        [transfer(uuids[2]), transfer(uuids[0]), transfer(uuids[1])],
+    ) == {uuids[2]: True, uuids[0]: False, uuids[1]: True}
+    rts = RunningTransfer.query.all()
+    assert len(rts) == 3
+    assert len({rt.coordinator_request_id for rt in rts}) == 3
+    signals = PrepareTransferSignal.query.all()
+    assert len(signals) == 3
+    assert {s.coordinator_request_id for s in signals} == {
+        rt.coordinator_request_id for rt in rts
+    }
+    assert all(s.max_commit_delay <= 1000 for s in signals)
+    pending_log_entries = models.PendingLogEntry.query.filter(
+        models.PendingLogEntry.transfer_uuid.is_not(None)
+    ).all()
+    assert sorted(e.transfer_uuid for e in pending_log_entries) == uuids
+
+    p.process_pending_log_entries(C_ID)
+    assert (
+        get_transfers_list_latest_update_id()
+        == transfers_list_latest_update_id + 3
+    )
+
+
 def test_process_rejected_direct_transfer_signal(account, current_ts):
     rt = p.initiate_running_transfer(
         creditor_id=C_ID,
@@ -1256,6 +1612,56 @@ def test_unsuccessful_transfer_unexpected_error(account, current_ts):
     assert rt.total_locked_amount is None
 
 
+def test_register_account_reconfigs(creditor):
+    p.register_account_reconfigs({C_ID: 3, 1: 5}, 10000)
+    assert p.is_account_reconfig_allowed(C_ID, 4) is True
+    assert p.is_account_reconfig_allowed(C_ID, 3) is False
+    p.register_account_reconfigs({C_ID: 2}, 10000)
+    assert p.is_account_reconfig_allowed(C_ID, 6) is True
+    assert p.is_account_reconfig_allowed(C_ID, 5) is False
+
+
+def test_pin_session(creditor):
+    params = dict(
+        secret="secret",
+        pin_value=None,
+        pin_failures_reset_interval=timedelta(days=1),
+        max_age_seconds=1000.0,
+    )
+    with pytest.raises(p.CreditorDoesNotExist):
+        p.create_pin_session(1, **params)
+
+    token, expires_at = p.create_pin_session(C_ID, **params)
+    assert expires_at > datetime.now(tz=timezone.utc)
+    assert p.verify_pin_session(C_ID, token, secret="secret")
+    assert not p.verify_pin_session(C_ID, token, secret="other")
+    assert not p.verify_pin_session(C_ID + 1, token, secret="secret")
+    assert not p.verify_pin_session(C_ID, "invalid", secret="secret")
+    assert not p.verify_pin_session(C_ID, "1.2.3.4", secret="secret")
+
+    expired_token, _ = p.create_pin_session(
+        C_ID, **{**params, "max_age_seconds": -1.0}
+    )
+    assert not p.verify_pin_session(C_ID, expired_token, secret="secret")
+
+    p.update_pin_info(
+        C_ID,
+        status_name="on",
+        secret="secret",
+        new_pin_value="1234",
+        latest_update_id=2,
+        pin_reset_mode=False,
+        pin_value=None,
+        pin_failures_reset_interval=timedelta(days=1),
+    )
+    assert not p.verify_pin_session(C_ID, token, secret="secret")
+    with pytest.raises(p.WrongPinValue):
+        p.create_pin_session(C_ID, **params)
+
+    token, _ = p.create_pin_session(C_ID, **{**params, "pin_value": "1234"})
+    assert p.verify_pin_session(C_ID, token, secret="secret")
+
+
 def test_inspect_ops_procedures(creditor):
     assert p.is_account_creation_allowed(C_ID, 1, 1) is True
     assert p.is_account_creation_allowed(C_ID, 0, 1) is False
@@ -1312,3 +1718,27 @@ def test_inspect_ops_procedures(creditor):
     assert p.is_transfer_creation_allowed(C_ID, 4, 2) is True
     p.decrement_transfer_number(C_ID)
     assert p.is_transfer_creation_allowed(C_ID, 3, 2) is True
+
+    assert p.is_account_creation_allowed(C_ID, 5, 5, count=3) is True
+    assert p.is_account_creation_allowed(C_ID, 4, 5, count=3) is False
+    assert p.is_account_creation_allowed(C_ID, 5, 4, count=3) is False
+    p.register_account_creation(C_ID, 10000, count=2)
+    assert p.is_account_creation_allowed(C_ID, 5, 5, count=1) is True
+    assert p.is_account_creation_allowed(C_ID, 4, 5, count=1) is False
+    p.register_account_creation(C_ID, 10000, count=0)
+    assert p.is_account_creation_allowed(C_ID, 5, 5, count=1) is True
+
+    assert p.is_transfer_creation_allowed(C_ID, 5, 5, count=3) is True
+    assert p.is_transfer_creation_allowed(C_ID, 4, 5, count=3) is False
+    assert p.is_transfer_creation_allowed(C_ID, 5, 3, count=3) is False
+    p.register_transfer_creation(C_ID, 10000, count=2)
+    assert p.is_transfer_creation_allowed(C_ID, 5, 5, count=1) is True
+    assert p.is_transfer_creation_allowed(C_ID, 4, 5, count=1) is False
+
+    assert p.is_account_reconfig_allowed(C_ID, 5) is True
+    assert p.is_account_reconfig_allowed(C_ID, 4) is False
+    p.register_account_reconfig(C_ID, 10000, count=3)
+    assert p.is_account_reconfig_allowed(C_ID, 8) is True
+    assert p.is_account_reconfig_allowed(C_ID, 7) is False
+    p.register_account_reconfig(C_ID, 10000, count=0)
+    assert p.is_account_reconfig_allowed(C_ID, 8) is True
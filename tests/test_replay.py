@@ -0,0 +1,229 @@
+import json
+import threading
+from datetime import datetime, date, timezone
+from unittest.mock import Mock
+from sqlalchemy.exc import IntegrityError
+from swpt_pythonlib.rabbitmq import MessageProperties
+from swpt_creditors import procedures as p
+from swpt_creditors.extensions import db
+from swpt_creditors.models import Creditor, CommittedTransfer
+from swpt_creditors.replay import (
+    MessageReplayer,
+    get_death_time,
+    read_stream,
+)
+
+D_ID = -1
+C_ID = 4294967296
+
+
+def _death_headers(t):
+    return {"x-death": [{"time": t, "reason": "rejected"}]}
+
+
+def _activate_creditor_message(creditor_id, reservation_id, t=None):
+    body = json.dumps(
+        {
+            "type": "ActivateCreditor",
+            "creditor_id": creditor_id,
+            "reservation_id": str(reservation_id),
+            "ts": "2099-12-31T00:00:00+00:00",
+        }
+    ).encode("utf8")
+    props = MessageProperties(
+        content_type="application/json",
+        type="ActivateCreditor",
+        headers=_death_headers(t) if t else None,
+    )
+    return body, props
+
+
+def test_get_death_time():
+    t = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    assert get_death_time(MessageProperties()) is None
+    assert get_death_time(MessageProperties(headers={})) is None
+    assert get_death_time(MessageProperties(headers={"x-death": []})) is None
+    assert get_death_time(Mock(headers=_death_headers(t))) == t
+    assert (
+        get_death_time(Mock(headers=_death_headers(t.replace(tzinfo=None))))
+        == t
+    )
+
+
+def test_read_stream():
+    props = MessageProperties(headers={"x-stream-offset": 5})
+    channel = Mock()
+    channel.consume.return_value = iter(
+        [
+            (Mock(delivery_tag=1), props, b"1"),
+            (Mock(delivery_tag=2), props, b"2"),
+            (None, None, None),
+            (Mock(delivery_tag=3), props, b"3"),
+        ]
+    )
+    messages = list(read_stream(channel, "test.XQ", offset="first"))
+    assert messages == [(5, props, b"1"), (5, props, b"2")]
+    channel.consume.assert_called_once_with(
+        "test.XQ",
+        inactivity_timeout=5.0,
+        arguments={"x-stream-offset": "first"},
+    )
+    assert channel.basic_ack.call_count == 2
+    channel.cancel.assert_called_once()
+
+
+def test_replay_messages(app, db_session):
+    reservation_ids = [
+        p.reserve_creditor(C_ID + i).reservation_id for i in range(5)
+    ]
+    t0 = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    t1 = datetime(2020, 1, 2, tzinfo=timezone.utc)
+    t2 = datetime(2020, 1, 3, tzinfo=timezone.utc)
+    messages = [
+        _activate_creditor_message(C_ID, reservation_ids[0], t0),
+        _activate_creditor_message(C_ID + 1, reservation_ids[1], t1),
+        _activate_creditor_message(C_ID + 2, reservation_ids[2], t1),
+        _activate_creditor_message(C_ID + 3, reservation_ids[3], t1),
+        (b"{}", MessageProperties(content_type="application/json")),
+        (b"invalid", MessageProperties(content_type="application/json",
+                                       type="ActivateCreditor")),
+        _activate_creditor_message(1, reservation_ids[1], t1),
+        _activate_creditor_message(C_ID + 4, reservation_ids[4], t2),
+    ]
+
+    replayer = MessageReplayer(app, since=t1, until=t2, dry_run=True)
+    for offset, (body, props) in enumerate(messages):
+        if not replayer.add(body, props, offset):
+            break
+    stats = replayer.finish()
+    assert stats.read_count == 8
+    assert stats.last_offset == 7
+    assert stats.resume_offset == 7
+    assert stats.processed_count == 3
+    assert stats.invalid_count == 2
+    assert stats.skipped_count == 2
+    assert stats.type_counts == {"ActivateCreditor": 3}
+    assert all(not c.is_activated for c in Creditor.query.all())
+
+    replayer = MessageReplayer(
+        app,
+        threads=2,
+        batch_size=2,
+        message_types={"ActivateCreditor"},
+        until=t2,
+    )
+    for body, props in messages:
+        if not replayer.add(body, props):
+            break
+    stats = replayer.finish()
+    assert stats.resume_offset is None
+    assert stats.processed_count == 4
+    assert stats.failed_count == 0
+    assert stats.invalid_count == 1
+    assert stats.skipped_count == 2
+    activated = {c.creditor_id for c in Creditor.query.all() if c.is_activated}
+    assert activated == {C_ID, C_ID + 1, C_ID + 2, C_ID + 3}
+
+
+def test_replay_resume_offset(app):
+    event = threading.Event()
+    replayer = MessageReplayer(app, batch_size=2)
+    replayer._process = lambda batch: event.wait()
+    assert replayer._calc_resume_offset() is None
+
+    for offset in [10, 11, 12]:
+        body, props = _activate_creditor_message(C_ID, 1)
+        assert replayer.add(body, props, offset)
+    assert replayer.stats.last_offset == 12
+    assert replayer._calc_resume_offset() == 10
+
+    event.set()
+    stats = replayer.finish()
+    assert stats.resume_offset == 13
+
+
+def test_replay_failed_batch(app, db_session):
+    reservation_id = p.reserve_creditor(C_ID).reservation_id
+
+    def fail(**kwargs):
+        raise RuntimeError
+
+    from swpt_creditors.actors import _on_activate_creditor_signal
+
+    replayer = MessageReplayer(app)
+    replayer._process(
+        [
+            (
+                _on_activate_creditor_signal,
+                dict(creditor_id=C_ID, reservation_id=str(reservation_id)),
+            ),
+            (fail, {}),
+        ]
+    )
+    assert replayer.stats.processed_count == 1
+    assert replayer.stats.failed_count == 1
+    assert Creditor.query.one().is_activated
+    replayer.finish()
+
+
+def test_replay_retried_batch(monkeypatch, caplog, app, db_session):
+    from swpt_creditors.actors import (
+        RecentKeysCache,
+        _on_account_transfer_signal,
+    )
+
+    duplicates_filter = RecentKeysCache(100, name="test")
+    monkeypatch.setitem(
+        app.extensions, "transfers_duplicates_filter", duplicates_filter
+    )
+    creditor = p.reserve_creditor(C_ID)
+    p.activate_creditor(C_ID, str(creditor.reservation_id))
+    p.create_new_account(C_ID, D_ID)
+
+    current_ts = datetime.now(tz=timezone.utc)
+    creation_date = date(2020, 1, 2)
+    failures = []
+
+    def fail_once(**kwargs):
+        # The transaction will be rolled back, and the whole batch
+        # will be retried.
+        if not failures:
+            failures.append(1)
+            with db.retry_on_integrity_error():
+                raise IntegrityError("test", None, Exception())
+
+    replayer = MessageReplayer(app)
+    replayer._process(
+        [
+            (
+                _on_account_transfer_signal,
+                dict(
+                    debtor_id=D_ID,
+                    creditor_id=C_ID,
+                    creation_date=creation_date,
+                    transfer_number=1,
+                    coordinator_type="direct",
+                    sender="666",
+                    recipient=str(C_ID),
+                    acquired_amount=1000,
+                    transfer_note_format="",
+                    transfer_note="",
+                    committed_at=current_ts,
+                    principal=1000,
+                    ts=current_ts,
+                    previous_transfer_number=0,
+                ),
+            ),
+            (fail_once, {}),
+        ]
+    )
+    assert failures == [1]
+    assert "one by one" not in caplog.text
+    assert replayer.stats.processed_count == 2
+    assert replayer.stats.failed_count == 0
+    assert duplicates_filter.hits == 0
+    assert duplicates_filter.contains((C_ID, D_ID, creation_date, 1))
+    ct = CommittedTransfer.query.one()
+    assert ct.creditor_id == C_ID
+    assert ct.transfer_number == 1
+    replayer.finish()
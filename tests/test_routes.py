@@ -1,3 +1,5 @@
+import json
+import struct
 from urllib.parse import urljoin, urlparse
 from datetime import datetime, timezone, timedelta, date
 import pytest
@@ -72,6 +74,51 @@ def test_auto_genereate_creditor_id(client):
     assert datetime.fromisoformat(data["createdAt"])
 
 
+def test_auto_generate_many_creditor_ids(client):
+    r = client.post("/creditors/.creditors-reserve", json={})
+    assert r.status_code == 422
+
+    r = client.post(
+        "/creditors/.creditors-reserve",
+        json={"type": "CreditorReservationRequest", "count": 1},
+    )
+    assert r.status_code == 422
+
+    r = client.post("/creditors/.creditors-reserve", json={"count": 3})
+    assert r.status_code == 200
+    data = r.get_json()
+    assert len(data) == 3
+    assert len({item["creditorId"] for item in data}) == 3
+    for item in data:
+        assert item["type"] == "CreditorReservation"
+        assert isinstance(item["reservationId"], str)
+        assert datetime.fromisoformat(item["validUntil"])
+        assert datetime.fromisoformat(item["createdAt"])
+        creditor_id = u64_to_i64(int(item["creditorId"]))
+        assert not p.get_active_creditor(creditor_id)
+        p.activate_creditor(creditor_id, item["reservationId"])
+        assert p.get_active_creditor(creditor_id)
+
+    r = client.post(
+        "/creditors/.creditors-reserve",
+        json={
+            "type": "CreditorsReservationRequest",
+            "count": 2,
+            "activate": True,
+        },
+    )
+    assert r.status_code == 200
+    data = r.get_json()
+    assert len(data) == 2
+    for item in data:
+        assert item["reservationId"] == "0"
+        creditor_id = u64_to_i64(int(item["creditorId"]))
+        assert p.get_active_creditor(creditor_id)
+        assert p.get_pin_info(creditor_id)
+
+    assert len(m.Creditor.query.all()) == 5
+
+
 def test_create_creditor(client):
     r = client.get("/creditors/4294967296/")
     assert r.status_code == 403
@@ -234,6 +281,32 @@ def test_get_creditors_list(client):
     ]
 
 
+def test_enumerate_all_creditors(client):
+    r = client.post("/creditors/4294967296/reserve", json={})
+    assert r.status_code == 200
+    for creditor_id in [4294967297, 4294967298, 8589934591]:
+        r = client.post(f"/creditors/{creditor_id}/activate", json={})
+        assert r.status_code == 200
+
+    r = client.get("/creditors/9223372036854775808/enumerate-all")
+    assert r.status_code == 200
+    assert r.mimetype == "application/x-ndjson"
+    lines = r.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"uri": "/creditors/4294967297/"},
+        {"uri": "/creditors/4294967298/"},
+        {"uri": "/creditors/8589934591/"},
+    ]
+
+    r = client.get(
+        "/creditors/4294967298/enumerate-all",
+        headers={"Accept": "application/octet-stream"},
+    )
+    assert r.status_code == 200
+    assert r.mimetype == "application/octet-stream"
+    assert r.get_data() == struct.pack("!2Q", 4294967298, 8589934591)
+
+
 def test_change_pin(client, creditor):
     r = client.get(
         "/creditors/4294967296/wallet", headers={"X-Swpt-Require-Pin": "true"}
@@ -387,6 +460,89 @@ def test_change_pin(client, creditor):
     ]
 
 
+def test_pin_session(client, account):
+    headers = {"X-Swpt-Require-Pin": "true"}
+    r = client.patch(
+        "/creditors/4294967296/pin",
+        json={
+            "status": "on",
+            "newPin": "1234",
+            "latestUpdateId": 2,
+        },
+    )
+    assert r.status_code == 200
+
+    r = client.post(
+        "/creditors/4294967297/pin-session", headers=headers, json={}
+    )
+    assert r.status_code == 404
+
+    r = client.post(
+        "/creditors/4294967296/pin-session",
+        headers=headers,
+        json={"pin": "1111"},
+    )
+    assert r.status_code == 403
+
+    r = client.post(
+        "/creditors/4294967296/pin-session",
+        headers=headers,
+        json={"type": "PinSessionRequest", "pin": "1234"},
+    )
+    assert r.status_code == 200
+    data = r.get_json()
+    assert data["type"] == "PinSession"
+    assert datetime.fromisoformat(data["expiresAt"])
+    token = data["token"]
+
+    r = client.get("/creditors/4294967296/accounts/1/config")
+    assert r.status_code == 200
+    request_data = {
+        "negligibleAmount": 100.0,
+        "allowUnsafeDeletion": False,
+        "scheduledForDeletion": False,
+        "configData": "",
+        "latestUpdateId": r.get_json()["latestUpdateId"] + 1,
+    }
+    r = client.patch(
+        "/creditors/4294967296/accounts/1/config",
+        headers=headers,
+        json=request_data,
+    )
+    assert r.status_code == 403
+
+    r = client.patch(
+        "/creditors/4294967296/accounts/1/config",
+        headers={**headers, "Pin-Session": token[:-1]},
+        json=request_data,
+    )
+    assert r.status_code == 403
+
+    r = client.patch(
+        "/creditors/4294967296/accounts/1/config",
+        headers={**headers, "Pin-Session": token},
+        json=request_data,
+    )
+    assert r.status_code == 200
+
+    # Changing the PIN invalidates the session.
+    r = client.patch(
+        "/creditors/4294967296/pin",
+        json={
+            "status": "on",
+            "newPin": "5678",
+            "latestUpdateId": 3,
+        },
+    )
+    assert r.status_code == 200
+    r = client.patch(
+        "/creditors/4294967296/accounts/1/config",
+        headers={**headers, "Pin-Session": token},
+        json=request_data,
+    )
+    assert r.status_code == 403
+
+
 def test_redirect_to_wallet(client, creditor):
     r = client.get("/creditors/.wallet")
     assert r.status_code == 204
@@ -692,6 +848,74 @@ def test_debtor_lookup(client, account):
     assert r.data == b""
 
 
+def test_create_accounts(client, creditor):
+    r = client.post(
+        "/creditors/4294967296/create-accounts",
+        json={"debtors": [{"uri": "swpt:1"}, {"uri": "xxx:2"}]},
+    )
+    assert r.status_code == 422
+    data = r.get_json()
+    assert data["errors"]["json"]["debtors"]["1"]["uri"] == [
+        "The URI can not be recognized."
+    ]
+
+    r = client.post(
+        "/creditors/4294967296/create-accounts", json={"debtors": []}
+    )
+    assert r.status_code == 422
+
+    r = client.post(
+        "/creditors/4294967296/accounts/",
+        json={"type": "DebtorIdentity", "uri": "swpt:1"},
+    )
+    assert r.status_code == 201
+
+    r = client.post(
+        "/creditors/4294967296/create-accounts",
+        json={
+            "type": "AccountsCreationRequest",
+            "debtors": [
+                {"uri": "swpt:1"},
+                {"type": "DebtorIdentity", "uri": "swpt:2"},
+                {"uri": "swpt:3"},
+            ],
+        },
+    )
+    assert r.status_code == 200
+    data = r.get_json()
+    assert data["type"] == "AccountsCreationResult"
+    assert data["items"] == [
+        {
+            "type": "AccountCreationResult",
+            "debtor": {"type": "DebtorIdentity", "uri": "swpt:1"},
+            "account": {"uri": "/creditors/4294967296/accounts/1/"},
+            "created": False,
+        },
+        {
+            "type": "AccountCreationResult",
+            "debtor": {"type": "DebtorIdentity", "uri": "swpt:2"},
+            "account": {"uri": "/creditors/4294967296/accounts/2/"},
+            "created": True,
+        },
+        {
+            "type": "AccountCreationResult",
+            "debtor": {"type": "DebtorIdentity", "uri": "swpt:3"},
+            "account": {"uri": "/creditors/4294967296/accounts/3/"},
+            "created": True,
+        },
+    ]
+    assert len(m.ConfigureAccountSignal.query.all()) == 3
+
+    r = client.get("/creditors/4294967296/accounts/3/")
+    assert r.status_code == 200
+
+    r = client.post(
+        "/creditors/4294967297/create-accounts",
+        json={"debtors": [{"uri": "swpt:1"}]},
+    )
+    assert r.status_code == 404
+
+
 def test_create_account(client, creditor):
     p.process_pending_log_entries(4294967296)
     entries = _get_all_pages(
@@ -1889,6 +2113,92 @@ def test_get_committed_transfer(client, account, current_ts):
     assert r.status_code == 404
 
 
+def test_create_transfers(client, account):
+    p.process_pending_log_entries(4294967296)
+
+    def transfer_data(i, **kwargs):
+        return {
+            "type": "TransferCreationRequest",
+            "transferUuid": f"123e4567-e89b-12d3-a456-42665544000{i}",
+            "recipient": {"uri": "swpt:1/4294967299"},
+            "amount": 1000,
+            **kwargs,
+        }
+
+    request_data = {
+        "type": "TransfersCreationRequest",
+        "transfers": [transfer_data(0), transfer_data(1)],
+        "pin": "1234",
+    }
+
+    r = client.post(
+        "/creditors/4294967299/create-transfers", json=request_data
+    )
+    assert r.status_code == 404
+
+    r = client.post(
+        "/creditors/4294967296/create-transfers",
+        json={
+            "transfers": [
+                transfer_data(0),
+                transfer_data(1, recipient={"uri": "INVALID"}),
+            ],
+        },
+    )
+    assert r.status_code == 422
+    data = r.get_json()
+    assert data["errors"]["json"]["transfers"]["1"]["recipient"]["uri"] == [
+        "The URI can not be recognized."
+    ]
+
+    r = client.post(
+        "/creditors/4294967296/transfers/", json=transfer_data(0)
+    )
+    assert r.status_code == 201
+
+    r = client.post(
+        "/creditors/4294967296/create-transfers", json=request_data
+    )
+    assert r.status_code == 200
+    data = r.get_json()
+    assert data["type"] == "TransfersCreationResult"
+    assert data["items"] == [
+        {
+            "type": "TransferCreationResult",
+            "transfer": {
+                "uri": "/creditors/4294967296/transfers/"
+                "123e4567-e89b-12d3-a456-426655440000"
+            },
+            "created": False,
+        },
+        {
+            "type": "TransferCreationResult",
+            "transfer": {
+                "uri": "/creditors/4294967296/transfers/"
+                "123e4567-e89b-12d3-a456-426655440001"
+            },
+            "created": True,
+        },
+    ]
+    assert len(m.RunningTransfer.query.all()) == 2
+    assert len(m.PrepareTransferSignal.query.all()) == 2
+
+    r = client.get(
+        "/creditors/4294967296/transfers/123e4567-e89b-12d3-a456-426655440001"
+    )
+    assert r.status_code == 200
+    data = r.get_json()
+    assert data["amount"] == 1000
+    assert data["recipient"]["uri"] == "swpt:1/4294967299"
+
+    r = client.post(
+        "/creditors/4294967296/create-transfers",
+        json={"transfers": [transfer_data(2), transfer_data(1, amount=999)]},
+    )
+    assert r.status_code == 409
+    assert len(m.RunningTransfer.query.all()) == 2
+
+
 def test_create_transfer(client, account):
     p.process_pending_log_entries(4294967296)
 